@@ -2,33 +2,95 @@
 
 import os
 import sys
+import argparse
 
-from utils import config, logger, env, updater
-from librarian.librarian import Librarian
+from utils import config, logger, env, updater, INDEX_PATH, QUEUE_PATH, HEALTH_PATH, WATCHED_PATH, WORKER_LOCK_PATH
+from librarian.events import eventFromEnv, processEvent, describeEvent
+
+# The Kodi client stack (kodijsonrpc, jsonschema, requests) and the daemon are imported by
+# the modes that use them, so test events and queued downloads start without loading them.
+
+def buildLibrarian():
+    from librarian.librarian import Librarian
+    from librarian.libraryindex import LibraryIndex
+    from librarian.hosthealth import HostHealth
+    from librarian.sqlbackend import SQLBackend
+    from librarian.snapshots import WatchedStateSnapshots
+    from librarian.cleaner import CleanScheduler
+    from librarian.metrics import Metrics
+    from librarian.trace import TraceRecorder
+    from librarian.readcache import ReadCache
+    sql = SQLBackend(**config.video_database) if config.video_database else None
+    index = LibraryIndex(INDEX_PATH, ttl=config.index_ttl)
+    cleaner = CleanScheduler(QUEUE_PATH, config.clean_window) if config.clean_after_update and config.clean_deferred else None
+    health = HostHealth(HEALTH_PATH, config.health_ttl, config.playing_ttl, config.failure_threshold, config.failure_cooldown, config.probe_timeout)
+    return Librarian(config.hosts, update_while_playing=config.update_while_playing, index=index, use_notifications=config.use_notifications, max_workers=config.max_workers, health=health, sql=sql,
+                     snapshots=WatchedStateSnapshots(WATCHED_PATH), cleaner=cleaner, metrics=Metrics(config.metrics_textfile or None),
+                     recorder=TraceRecorder(config.trace_file) if config.trace_file else None, cache=ReadCache(config.read_cache_ttl))
+
+def buildJobQueue():
+    from librarian.jobqueue import JobQueue
+    return JobQueue(QUEUE_PATH, maxAttempts=config.queue_max_attempts, retryDelay=config.queue_retry_delay)
+
+parser = argparse.ArgumentParser(description='Update Kodi libraries on Sonarr/Radarr events.')
+parser.add_argument('--daemon', action='store_true', help='run as a resident Sonarr/Radarr webhook receiver')
+parser.add_argument('--worker', action='store_true', help='run queued library updates until the queue is empty')
+parser.add_argument('--update', action='store_true', help='check Git for updates and exit')
+parser.add_argument('--if-due', action='store_true', help='with --update, only check once update check_interval has passed')
+parser.add_argument('--clean', action='store_true', help='run deferred library cleans now unless a video is playing')
+args = parser.parse_args()
 
-updater.pull()
 log = logger.get_log('KodiLibrarian')
-kodi = Librarian(config.hosts, update_while_playing=config.update_while_playing)
-
-if env.event == 'download':
-    if env.calledBy == 'radarr':
-        log.info('Radarr has downloaded "{}" {}. Initiating update process.'.format(env.movieTitle, env.moviePath))
-        kodi.updateMovie(env.movieTitle, env.movieDirectory, env.moviePath)
-        if config.clean_after_update:
-            kodi.cleanLibrary('movies')
-
-    elif env.calledBy == 'sonarr':
-        log.info('Sonarr has downloaded "{}" {}. Initiating update process.'.format(env.showTitle, env.episodePath))
-        kodi.updateTVShow(env.episodePath, env.showDirectory)
-        if config.clean_after_update:
-            kodi.cleanLibrary('tvshows')
-
-    elif env.calledBy == 'lidarr':
-        log.info('Lidarr not supported yet!! Aborting.')
-
-elif env.event == 'test':
-    log.debug('Called with test environment from {}'.format(env.calledBy))
+username, password = config.daemon_credentials
+
+if args.update:
+    # checks spawned for events stay throttled, a manual check runs right away
+    updater.check(config.update_check_interval if args.if_due else 0, config.update_timeout, wait=True)
+    sys.exit(0)
+
+if args.clean:
+    kodi = buildLibrarian()
+    if kodi.cleaner is not None:
+        kodi.runDeferredClean(force=True)
+    elif not kodi.idle():
+        log.info('Deferred cleaning is off (clean_deferred) and a host is playing a video. Not cleaning.')
+    else:
+        log.info('Deferred cleaning is off (clean_deferred). Cleaning the whole library now.')
+        kodi.cleanLibrary()
+    sys.exit(0)
+
+if args.daemon:
+    from librarian.daemon import LibrarianDaemon
+    LibrarianDaemon(buildLibrarian, config.daemon_listen, config.daemon_port, username, password, config.clean_after_update, config.daemon_coalesce_window, buildJobQueue(),
+                    updater, config.update_check_interval, config.update_timeout).serve_forever()
+    sys.exit(0)
+
+if args.worker:
+    from librarian.jobqueue import runWorker
+    runWorker(buildJobQueue(), buildLibrarian, WORKER_LOCK_PATH, config.queue_workers, config.clean_after_update, updater.eventLock)
+    sys.exit(0)
+
+# Anything but a download (e.g. the Sonarr/Radarr connection test) needs no network at all
+event = eventFromEnv(env)
+if not event['event'] == 'download':
+    processEvent(None, event, config.clean_after_update)
+    sys.exit(0)
+
+# Check for updates at most every check_interval seconds, in the background unless configured otherwise
+if updater.due(config.update_check_interval):
+    if config.update_background:
+        updater.spawn(os.path.abspath(__file__))
+    else:
+        updater.check(config.update_check_interval, config.update_timeout)
+
+from librarian.daemon import forwardEvent
+if config.daemon_forward and forwardEvent(event, config.daemon_listen, config.daemon_port, username, password):
+    log.info('Forwarded {} event for "{}" to the running daemon.'.format(event['source'], event['title']))
     sys.exit(0)
 
-else:
-    log.critical('Could not find any recognizable environment variables. Aborting.')
+# Queue the update and hand it to a background worker so Sonarr/Radarr can continue importing.
+# Waiting coalesce_window seconds lets the rest of a season pack join this job.
+from librarian.jobqueue import spawnWorker
+buildJobQueue().put(event, delay=config.daemon_coalesce_window)
+spawnWorker(os.path.abspath(__file__))
+log.info('Queued {}'.format(describeEvent(event)))
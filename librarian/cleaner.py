@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import time
+import sqlite3
+import threading
+from utils import logger
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cleans (
+    content TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    requested REAL NOT NULL,
+    PRIMARY KEY (content, directory)
+);
+'''
+
+def parseWindow(window):
+    # 'HH:MM-HH:MM' to (start, end) minutes of the day, None when unset or invalid
+    try:
+        start, end = [part.strip().split(':') for part in window.split('-')]
+        return (int(start[0]) * 60 + int(start[1]), int(end[0]) * 60 + int(end[1]))
+    except (AttributeError, ValueError, IndexError):
+        return None
+
+def inWindow(window, now=None):
+    # True when now is inside window or there is no window, windows may span midnight
+    bounds = parseWindow(window)
+    if not bounds:
+        return True
+    local = time.localtime(now)
+    minute = local.tm_hour * 60 + local.tm_min
+    start, end = bounds
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+class CleanScheduler():
+    '''
+    Deferred library cleaning. Updates only record the directory that needs
+    cleaning, run() later cleans all of them together while no host is
+    playing, inside the idle window when one is configured. More than
+    maxDirectories directories of one content type become a single clean
+    of that content.
+    '''
+    log = logger.get_log('CleanScheduler')
+
+    def __init__(self, dbPath, window=None, maxDirectories=5):
+        self.path = dbPath
+        self.window = window
+        self.maxDirectories = maxDirectories
+        self._lock = threading.Lock()
+        self._conn = None
+        if window and not parseWindow(window):
+            self.log.warning('Ignoring clean window "{}", expected HH:MM-HH:MM'.format(window))
+
+    @property
+    def db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute('SELECT COUNT(*) FROM cleans').fetchone()[0]
+
+    def request(self, content, directory=None):
+        # remember a clean of directory (all of content without one) for the next run
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO cleans (content, directory, requested) VALUES (?, ?, ?)', (content, directory or '', time.time()))
+        self.log.debug('Deferred clean of {} {}'.format(content, directory or ''))
+
+    def due(self):
+        return inWindow(self.window) and len(self) > 0
+
+    def run(self, kodi, force=False):
+        # clean everything requested so far unless outside the window (force ignores it) or a host is playing.
+        # Returns True when a clean was started.
+        if not (force and len(self) or self.due()):
+            return False
+        if not kodi.idle():
+            self.log.debug('A host is playing a video. Deferring {} cleans.'.format(len(self)))
+            return False
+
+        with self._lock:
+            rows = self.db.execute('SELECT content, directory, requested FROM cleans ORDER BY content, directory').fetchall()
+        byContent = {}
+        for content, directory, _ in rows:
+            byContent.setdefault(content, []).append(directory)
+
+        cleaned = []
+        for content, directories in byContent.items():
+            if '' in directories or len(directories) > self.maxDirectories:
+                targets = [None]
+            else:
+                targets = directories
+            if all([kodi.cleanLibrary(content, directory) for directory in targets]):
+                cleaned.append(content)
+
+        # requests made while cleaning stay for the next run
+        with self._lock, self.db:
+            self.db.executemany('DELETE FROM cleans WHERE content = ? AND directory = ? AND requested <= ?',
+                                [row for row in rows if row[0] in cleaned])
+        return bool(cleaned)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import base64
+import threading
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils import logger
+from collections import OrderedDict
+from contextlib import nullcontext
+from librarian.events import eventFromWebhook, eventError, processEvents, describeEvent, coalesceKey
+from librarian.jobqueue import JobWorker
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    '''
+    POST /webhook  Sonarr/Radarr webhook JSON
+    POST /event    event forwarded by KodiLibrarian.py in script mode
+    GET  /health   liveness and queue length
+    GET  /metrics  RPC, scan and poll metrics in the Prometheus text format
+    '''
+    server_version = 'KodiLibrarian'
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        self.server.librarianDaemon.log.debug('{} - {}'.format(self.address_string(), format % args))
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _replyText(self, code, text):
+        data = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        credentials = self.server.librarianDaemon.credentials
+        if not credentials:
+            return True
+        expected = 'Basic ' + base64.b64encode('{}:{}'.format(*credentials).encode('utf-8')).decode('ascii')
+        return self.headers.get('Authorization') == expected
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            return self._replyText(200, self.server.librarianDaemon.metrics)
+        if not self.path == '/health':
+            return self._reply(404, {'error': 'not found'})
+        self._reply(200, {'status': 'ok', 'queued': self.server.librarianDaemon.queued})
+
+    def do_POST(self):
+        if not self.path in ['/webhook', '/event']:
+            return self._reply(404, {'error': 'not found'})
+        if not self._authorized():
+            return self._reply(401, {'error': 'unauthorized'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as e:
+            return self._reply(400, {'error': 'invalid json: {}'.format(e)})
+        if not isinstance(payload, dict):
+            return self._reply(400, {'error': 'expected a json object'})
+
+        event = eventFromWebhook(payload) if self.path == '/webhook' else payload
+        if not event.get('event'):
+            return self._reply(400, {'error': 'unrecognized event'})
+        # malformed events are refused here instead of failing every retry
+        error = eventError(event)
+        if error:
+            return self._reply(400, {'error': 'invalid event: {}'.format(error)})
+        self.server.librarianDaemon.submit(event)
+        self._reply(202, {'accepted': True})
+
+class EventCoalescer():
+    '''
+    Holds download events for window seconds after the first one arrives so
+    events for the same show or movie folder (e.g. a season pack import) are
+    handed out as one group. Groups are handed out in arrival order.
+    '''
+    def __init__(self, window=0):
+        self.window = window
+        self._groups = OrderedDict()
+        self._condition = threading.Condition()
+        self._sequence = 0
+
+    def __len__(self):
+        with self._condition:
+            return sum(len(group['events']) for group in self._groups.values())
+
+    def put(self, event):
+        key = coalesceKey(event)
+        with self._condition:
+            if key is None:
+                # never grouped, due right away
+                self._sequence += 1
+                key = ('event', self._sequence)
+                self._groups[key] = {'due': time.time(), 'events': []}
+            elif not key in self._groups:
+                self._groups[key] = {'due': time.time() + self.window, 'events': []}
+            self._groups[key]['events'].append(event)
+            self._condition.notify()
+
+    def get(self, timeout):
+        # returns the events of the oldest group once its window has passed, None after timeout
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                now = time.time()
+                wait = deadline - now
+                if self._groups:
+                    key = next(iter(self._groups))
+                    if self._groups[key]['due'] <= now:
+                        return self._groups.pop(key)['events']
+                    wait = min(wait, self._groups[key]['due'] - now)
+                if deadline <= now:
+                    return None
+                self._condition.wait(wait)
+
+class LibrarianDaemon():
+    '''
+    Resident webhook receiver. Keeps one Librarian (hosts, connections,
+    notification sockets and index) warm and runs received events on a
+    single worker thread in arrival order, coalescing downloads for the same
+    folder that arrive within coalesce_window seconds. Failed updates go to
+    the persistent job queue, which the worker drains while idle. Idle time
+    is also used to check for updates, restarting into the new code once
+    one was pulled.
+    '''
+    log = logger.get_log('Daemon')
+    HOST_REFRESH = 300
+    # seconds between checks whether deferred cleans may run
+    CLEAN_CHECK = 60
+    # seconds between checks whether updates parked during playback may run
+    PARKED_CHECK = 5
+
+    def __init__(self, librarianFactory, listen='127.0.0.1', port=8765, username=None, password=None, clean_after_update=False, coalesce_window=10, jobs=None,
+                 updater=None, update_interval=-1, update_timeout=60):
+        self.librarianFactory = librarianFactory
+        self.address = (listen, int(port))
+        self.credentials = (username, password) if username else None
+        self.clean_after_update = clean_after_update
+        self._queue = EventCoalescer(coalesce_window)
+        self.jobs = jobs
+        self.updater = updater
+        self.update_interval = update_interval
+        self.update_timeout = update_timeout
+        self._eventLock = updater.eventLock if updater else nullcontext
+        self._jobWorker = JobWorker(jobs, self._librarian, clean_after_update, self._eventLock) if jobs is not None else None
+        self._restart = False
+        self._stopping = threading.Event()
+        self._worker = None
+        self._server = None
+        self.kodi = None
+        self._hostsChecked = 0
+        self._cleanChecked = 0
+        self._parkedChecked = 0
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    @property
+    def metrics(self):
+        # nothing is measured before the first update built the librarian
+        return self.kodi.metrics.render() if self.kodi else ''
+
+    def submit(self, event):
+        self.log.info('Received {}'.format(describeEvent(event)))
+        self._queue.put(event)
+
+    def _librarian(self):
+        # build once, then re-probe sleeping hosts every HOST_REFRESH seconds
+        if self.kodi is None:
+            self.kodi = self.librarianFactory()
+            self._hostsChecked = time.time()
+        elif time.time() - self._hostsChecked > self.HOST_REFRESH:
+            self.kodi.refreshHosts()
+            self._hostsChecked = time.time()
+        return self.kodi
+
+    def _work(self):
+        while not self._stopping.is_set():
+            events = self._queue.get(timeout=1)
+            if not events:
+                if not (self._jobWorker and self._jobWorker.runOnce()):
+                    self._checkForUpdate()
+                    self._replayParked()
+                    self._cleanIfDue()
+                continue
+            kodi = None
+            try:
+                kodi = self._librarian() if events[0].get('event') == 'download' else None
+                with self._eventLock():
+                    failed = processEvents(kodi, events, self.clean_after_update)
+            except Exception as e: # pylint: disable=broad-except
+                self.log.exception('Failed to process {} Error: {}'.format(describeEvent(events[-1]), e))
+                failed = events
+            if failed and self.jobs is not None:
+                # only events whose files were not found are retried.
+                # Updates skipped because every host was playing wait for playback to stop instead of a retry delay
+                waitingFor = kodi.waitingFor if kodi is not None else None
+                for event in failed:
+                    self.jobs.put(event, delay=self.jobs.retryDelay, waitingFor=waitingFor)
+
+    def _checkForUpdate(self):
+        # only called between events, a pulled update restarts the daemon once serve_forever returns
+        if not self.updater or len(self._queue) or not self.updater.due(self.update_interval):
+            return
+        updated, _ = self.updater.check(self.update_interval, self.update_timeout)
+        if updated:
+            self.log.info('Update applied. Restarting.')
+            self._restart = True
+            self._stopping.set()
+            self._server.shutdown()
+
+    def _replayParked(self):
+        # release parked updates once a host reported Player.OnStop or is found idle
+        if self.jobs is None or not self.kodi or time.time() - self._parkedChecked < self.PARKED_CHECK:
+            return
+        self._parkedChecked = time.time()
+        if self.jobs.parked() and self.kodi.waitForIdle(0):
+            self.log.info('Playback stopped. Resuming {} parked jobs'.format(self.jobs.unpark()))
+
+    def _cleanIfDue(self):
+        # run deferred cleans between events once playback stopped everywhere (and inside the idle window)
+        if not self.kodi or len(self._queue) or time.time() - self._cleanChecked < self.CLEAN_CHECK:
+            return
+        self._cleanChecked = time.time()
+        try:
+            with self._eventLock():
+                self.kodi.runDeferredClean()
+        except Exception as e: # pylint: disable=broad-except
+            self.log.exception('Deferred clean failed. Error: {}'.format(e))
+
+    def start(self):
+        self._server = ThreadingHTTPServer(self.address, WebhookHandler)
+        self._server.librarianDaemon = self
+        self._worker = threading.Thread(target=self._work, name='DaemonWorker', daemon=True)
+        self._worker.start()
+        self.log.info('Listening for webhooks on {}:{}'.format(*self._server.server_address))
+        return self
+
+    def serve_forever(self):
+        if self._server is None:
+            self.start()
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            self.log.info('Shutting down')
+        finally:
+            self.stop()
+        if self._restart:
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def stop(self):
+        self._stopping.set()
+        if self.kodi:
+            self.kodi.cancelPending()
+        if self._server:
+            self._server.server_close()
+
+def forwardEvent(event, host='127.0.0.1', port=8765, username=None, password=None, timeout=2):
+    # hand an event to a running daemon, returns False if it is not reachable or refused the event
+    request = urllib.request.Request(
+        'http://{}:{}/event'.format(host, port),
+        data=json.dumps(event).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST',
+    )
+    if username:
+        token = base64.b64encode('{}:{}'.format(username, password).encode('utf-8')).decode('ascii')
+        request.add_header('Authorization', 'Basic ' + token)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return 200 <= response.status < 300
+    except (urllib.error.URLError, OSError):
+        return False
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import os
+from utils import logger
+
+log = logger.get_log('KodiLibrarian')
+
+# Events are plain dicts so they can be forwarded to the daemon as JSON:
+# {
+#     'source': 'sonarr' | 'radarr' | 'lidarr' | None,
+#     'event': 'download' | 'test' | None,
+#     'title': series or movie title,
+#     'path': episode or movie file,
+#     'directory': series or movie folder,
+#     'season': season number (sonarr),
+#     'episode': episode number (sonarr),
+#     'episodes': every episode number of a multi-episode file (sonarr),
+# }
+
+# keys processing reads from every event
+EVENT_KEYS = ['source', 'event', 'title', 'path', 'directory', 'season', 'episode']
+# values a download of each source can not do without
+DOWNLOAD_KEYS = {
+    'sonarr': ['path', 'directory'],
+    'radarr': ['path', 'directory'],
+    'lidarr': [],
+}
+
+def eventFromEnv(env):
+    # build an event from the custom script environment
+    event = {
+        'source': env.calledBy,
+        'event': env.event,
+        'title': None,
+        'path': None,
+        'directory': None,
+        'season': None,
+        'episode': None,
+        'episodes': None,
+    }
+    if env.calledBy == 'sonarr':
+        event.update({
+            'title': env.showTitle,
+            'path': env.episodePath,
+            'directory': env.showDirectory,
+            'season': env.seasonNumber,
+            'episode': env.episodeNumber,
+            'episodes': env.episodeNumbers,
+        })
+    elif env.calledBy == 'radarr':
+        event.update({
+            'title': env.movieTitle,
+            'path': env.moviePath,
+            'directory': env.movieDirectory,
+        })
+    return event
+
+def eventFromWebhook(payload):
+    # build an event from a Sonarr/Radarr webhook body
+    event = {
+        'source': None,
+        'event': (payload.get('eventType') or '').lower() or None,
+        'title': None,
+        'path': None,
+        'directory': None,
+        'season': None,
+        'episode': None,
+        'episodes': None,
+    }
+    if 'series' in payload:
+        series = payload.get('series') or {}
+        episodeFile = payload.get('episodeFile') or {}
+        episodes = payload.get('episodes') or [{}]
+        directory = series.get('path')
+        path = episodeFile.get('path')
+        if not path and directory and episodeFile.get('relativePath'):
+            path = os.path.join(directory, episodeFile['relativePath'])
+        event.update({
+            'source': 'sonarr',
+            'title': series.get('title'),
+            'path': path,
+            'directory': directory,
+            'season': episodes[0].get('seasonNumber', episodeFile.get('seasonNumber')),
+            'episode': episodes[0].get('episodeNumber'),
+            'episodes': [ep['episodeNumber'] for ep in episodes if 'episodeNumber' in ep] or None,
+        })
+    elif 'movie' in payload:
+        movie = payload.get('movie') or {}
+        movieFile = payload.get('movieFile') or {}
+        directory = movie.get('folderPath') or movie.get('path')
+        path = movieFile.get('path')
+        if not path and directory and movieFile.get('relativePath'):
+            path = os.path.join(directory, movieFile['relativePath'])
+        event.update({
+            'source': 'radarr',
+            'title': movie.get('title'),
+            'path': path,
+            'directory': directory,
+        })
+    elif 'artist' in payload:
+        event['source'] = 'lidarr'
+    return event
+
+def eventError(event):
+    # why event can not be processed (e.g. a malformed forwarded event), None when it can
+    missing = [key for key in EVENT_KEYS if not key in event]
+    if missing:
+        return 'missing {}'.format(', '.join(missing))
+    if not event['event'] == 'download':
+        return None
+    if not event['source'] in DOWNLOAD_KEYS:
+        return 'download from unknown source {}'.format(event['source'])
+    empty = [key for key in DOWNLOAD_KEYS[event['source']] if not isinstance(event[key], str) or not event[key]]
+    if empty:
+        return '{} download without {}'.format(event['source'], ', '.join(empty))
+    return None
+
+def describeEvent(event):
+    return '{} {} "{}" {}'.format(event.get('source'), event.get('event'), event.get('title'), event.get('path'))
+
+def coalesceKey(event):
+    # download events for the same show/movie folder can share one scan, anything else runs alone
+    if event.get('event') == 'download' and event.get('source') in ['sonarr', 'radarr'] and event.get('directory'):
+        return (event['source'], event['directory'].rstrip('/'))
+    return None
+
+def processEvent(kodi, event, clean_after_update=False):
+    # run the library update for an event, kodi is a Librarian (only needed for downloads).
+    # Returns False when the update did not complete and should be retried later.
+    updated = True
+    if event['event'] == 'download':
+        if event['source'] == 'radarr':
+            log.info('Radarr has downloaded "{}" {}. Initiating update process.'.format(event['title'], event['path']))
+            updated = kodi.updateMovie(event['title'], event['directory'], event['path'])
+            if updated and clean_after_update:
+                kodi.requestClean('movies', event['directory'])
+
+        elif event['source'] == 'sonarr':
+            log.info('Sonarr has downloaded "{}" {}. Initiating update process.'.format(event['title'], event['path']))
+            updated = kodi.updateTVShow(event['path'], event['directory'], event['season'], event['episode'], event.get('episodes'))
+            if updated and clean_after_update:
+                kodi.requestClean('tvshows', event['directory'])
+
+        elif event['source'] == 'lidarr':
+            log.info('Lidarr not supported yet!! Aborting.')
+
+        kodi.endEvent(updated)
+
+    elif event['event'] == 'test':
+        log.debug('Called with test environment from {}'.format(event['source']))
+
+    else:
+        log.critical('Could not find any recognizable environment variables. Aborting.')
+    return updated
+
+def processEvents(kodi, events, clean_after_update=False):
+    # run a group of events sharing one coalesceKey, several sonarr downloads become a single show update.
+    # Returns the events whose update did not complete and should be retried later, the others are done.
+    if len(events) > 1 and events[0]['source'] == 'sonarr':
+        episodes = []
+        for event in events:
+            if not event['path'] in [item['path'] for item in episodes]:
+                episodes.append({'path': event['path'], 'season': event['season'], 'episode': event['episode'], 'episodes': event.get('episodes')})
+        log.info('Sonarr has downloaded {} episodes of "{}". Initiating update process.'.format(len(episodes), events[0]['title']))
+        found = kodi.updateTVShowEpisodes(events[0]['directory'], episodes)
+        if found and clean_after_update:
+            kodi.requestClean('tvshows', events[0]['directory'])
+        kodi.endEvent(len(found) == len(episodes))
+        return [event for event in events if not event['path'] in found]
+
+    # a movie folder holds one movie, only its latest import matters
+    if len(events) > 1:
+        log.info('Skipping {} superseded events for "{}"'.format(len(events) - 1, events[-1]['title']))
+    return [] if processEvent(kodi, events[-1], clean_after_update) else events
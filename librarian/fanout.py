@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor
+from utils.logger import ThreadBuffer
+
+class FanOut():
+    '''
+    Runs an independent operation for every host on a bounded thread pool.
+    Results are returned in host order and log records written by the
+    workers are replayed in host order once all of them have finished,
+    so output reads the same as a sequential run. The first exception
+    raised by a worker (in host order) is re-raised after the replay.
+    '''
+    def __init__(self, maxWorkers=4):
+        self.maxWorkers = max(1, int(maxWorkers))
+
+    def _call(self, func, host):
+        ThreadBuffer.capture()
+        try:
+            return func(host), None, ThreadBuffer.release()
+        except Exception as e: # pylint: disable=broad-except
+            return None, e, ThreadBuffer.release()
+
+    def run(self, func, hosts):
+        hosts = list(hosts)
+        if not hosts:
+            return []
+        if len(hosts) == 1 or self.maxWorkers == 1:
+            return [func(host) for host in hosts]
+
+        with ThreadPoolExecutor(max_workers=min(self.maxWorkers, len(hosts))) as pool:
+            outcomes = list(pool.map(lambda host: self._call(func, host), hosts))
+
+        results = []
+        error = None
+        for result, e, records in outcomes:
+            ThreadBuffer.replay(records)
+            if e and not error:
+                error = e
+            results.append(result)
+        if error:
+            raise error
+        return results
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import time
+from utils import logger
+from librarian.statefile import JSONStateFile
+
+# status() answers
+UP = 'up'                   # recently seen alive, use without probing
+DOWN = 'down'               # recently failed or circuit open, skip without probing
+PROBE = 'probe'             # nothing recent is known, probe normally
+QUICK_PROBE = 'quick-probe' # circuit half-open, one quick probe decides recovery
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class HostHealth():
+    '''
+    Liveness, playback state and recent RPC failures of each host, kept in a
+    small JSON file shared by every process. Answers are trusted for ttl
+    seconds (playingTtl for playback). After failureThreshold failures in a
+    row a host's circuit opens and it is skipped without probing until
+    cooldown has passed. Then a single process gets to send a quick
+    half-open probe which closes the circuit again or re-opens it.
+    '''
+    log = logger.get_log('HostHealth')
+    # a half-open probe not reported back within this many seconds is handed to the next caller
+    PROBE_GRACE = 30
+
+    def __init__(self, statePath, ttl=60, playingTtl=10, failureThreshold=3, cooldown=300, probeTimeout=1):
+        self.path = statePath
+        self.ttl = ttl
+        self.playingTtl = playingTtl
+        self.failureThreshold = failureThreshold
+        self.cooldown = cooldown
+        self.probeTimeout = probeTimeout
+        self._file = JSONStateFile(statePath, 'host health')
+
+    def _state(self, write=False):
+        # yields {hostName: record}, failing to write it is only logged
+        return self._file.open(write)
+
+    def _host(self, state, name):
+        return state.setdefault(name, {'circuit': CLOSED, 'failures': 0})
+
+    def status(self, name):
+        # how to treat a host before talking to it, one of UP, DOWN, PROBE, QUICK_PROBE
+        with self._state() as state:
+            answer = self._status(state.get(name, {'circuit': CLOSED, 'failures': 0}), time.time())
+        if not answer == QUICK_PROBE:
+            return answer
+        # only one process gets the half-open probe, decide again under the write lock
+        with self._state(write=True) as state:
+            return self._status(self._host(state, name), time.time(), claim=True)
+
+    def _status(self, host, now, claim=False):
+        # claim marks the host as being probed when the answer is QUICK_PROBE
+        if host['circuit'] == OPEN:
+            if now - host['opened'] < self.cooldown:
+                return DOWN
+            if claim:
+                host['circuit'] = HALF_OPEN
+                host['probing'] = now
+            return QUICK_PROBE
+        if host['circuit'] == HALF_OPEN:
+            if now - host.get('probing', 0) < self.PROBE_GRACE:
+                # another process is probing it right now
+                return DOWN
+            if claim:
+                host['probing'] = now
+            return QUICK_PROBE
+        # failures below the threshold do not keep a host down, it is probed again
+        if 'alive' in host and host['alive'] and now - host['checked'] < self.ttl:
+            return UP
+        return PROBE
+
+    def recordSuccess(self, name):
+        with self._state(write=True) as state:
+            host = self._host(state, name)
+            if not host['circuit'] == CLOSED:
+                self.log.info('{} is reachable again.'.format(name))
+            host.update({'circuit': CLOSED, 'failures': 0, 'alive': True, 'checked': time.time()})
+            host.pop('probing', None)
+
+    def recordFailure(self, name):
+        now = time.time()
+        with self._state(write=True) as state:
+            host = self._host(state, name)
+            host.update({'failures': host['failures'] + 1, 'alive': False, 'checked': now})
+            host.pop('probing', None)
+            if host['circuit'] == HALF_OPEN or host['failures'] >= self.failureThreshold:
+                if not host['circuit'] == OPEN:
+                    self.log.info('{} failed {} times in a row. Skipping it for {}s.'.format(name, host['failures'], self.cooldown))
+                host.update({'circuit': OPEN, 'opened': now})
+
+    def playing(self, name):
+        # recent playback state, None when it has to be asked for
+        with self._state() as state:
+            host = state.get(name, {})
+            if 'playing' in host and time.time() - host['playingChecked'] < self.playingTtl:
+                return host['playing']
+        return None
+
+    def recordPlaying(self, name, playing):
+        with self._state(write=True) as state:
+            self._host(state, name).update({'playing': bool(playing), 'playingChecked': time.time()})
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import fcntl
+import sqlite3
+import threading
+import subprocess
+from contextlib import contextmanager, nullcontext
+from utils import logger
+from librarian.events import coalesceKey, processEvents, describeEvent
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    grp TEXT NOT NULL,
+    event TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    due REAL NOT NULL,
+    claimed REAL,
+    error TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, due);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, state);
+'''
+
+log = logger.get_log('JobQueue')
+
+def jobKey(event):
+    # repeated imports of the same file are one job
+    return json.dumps([event.get('source'), event.get('event'), event.get('path')])
+
+def groupKey(event):
+    # jobs for the same show/movie folder are claimed and run together
+    key = coalesceKey(event)
+    return json.dumps(key) if key else jobKey(event)
+
+class JobQueue():
+    '''
+    Persistent queue of library update events shared by the script, worker
+    processes and the daemon. Identical jobs are stored once, failed jobs
+    are rescheduled with exponential backoff until maxAttempts is reached.
+    '''
+    log = logger.get_log('JobQueue')
+
+    def __init__(self, dbPath, maxAttempts=10, retryDelay=30, maxRetryDelay=3600, lease=7200):
+        self.path = dbPath
+        self.maxAttempts = maxAttempts
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        # running jobs older than this belong to a worker that died and are handed out again
+        self.lease = lease
+        self._lock = threading.RLock()
+        self._conn = None
+
+    @property
+    def db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        # writers from other processes wait on the database lock instead of failing
+        with self._lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'running', 'parked')").fetchone()[0]
+
+    def put(self, event, delay=0, waitingFor=None):
+        # queue an event, returns False if the same job was already waiting.
+        # With waitingFor (host names) the job starts out parked, see park().
+        key = jobKey(event)
+        now = time.time()
+        if waitingFor:
+            delay = self.maxRetryDelay
+        with self._transaction() as db:
+            row = db.execute("SELECT id FROM jobs WHERE key = ? AND state IN ('pending', 'parked')", (key,)).fetchone()
+            if row:
+                db.execute('UPDATE jobs SET event = ?, due = MIN(due, ?) WHERE id = ?', (json.dumps(event), now + delay, row[0]))
+                self.log.debug('Already queued {}'.format(describeEvent(event)))
+                return False
+            db.execute('INSERT INTO jobs (key, grp, event, due, created, state, error) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (key, groupKey(event), json.dumps(event), now + delay, now, 'parked' if waitingFor else 'pending',
+                        'waiting for {}'.format(', '.join(waitingFor)) if waitingFor else None))
+        return True
+
+    def claim(self):
+        # claim the oldest due job together with every pending job of its group, returns [(jobID, event)].
+        # Groups another worker is running are left alone so one folder is never scanned twice at once.
+        # Parked jobs join a claimed group of their folder and are tried on their own once their due passes.
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET state = 'pending' WHERE state = 'running' AND claimed < ?", (now - self.lease,))
+            db.execute("UPDATE jobs SET state = 'pending' WHERE state = 'parked' AND due <= ?", (now,))
+            first = db.execute(
+                "SELECT grp FROM jobs WHERE state = 'pending' AND due <= ? "
+                "AND grp NOT IN (SELECT grp FROM jobs WHERE state = 'running') ORDER BY id LIMIT 1", (now,)).fetchone()
+            if not first:
+                return []
+            rows = db.execute("SELECT id, event FROM jobs WHERE state IN ('pending', 'parked') AND grp = ? ORDER BY id", (first[0],)).fetchall()
+            db.executemany("UPDATE jobs SET state = 'running', claimed = ?, attempts = attempts + 1 WHERE id = ?", [(now, row[0]) for row in rows])
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def complete(self, jobIDs):
+        with self._transaction() as db:
+            db.executemany('DELETE FROM jobs WHERE id = ?', [(jobID,) for jobID in jobIDs])
+
+    def retry(self, jobIDs, error=None):
+        # reschedule failed jobs with exponential backoff, giving up after maxAttempts
+        now = time.time()
+        with self._transaction() as db:
+            for jobID in jobIDs:
+                row = db.execute('SELECT attempts, event FROM jobs WHERE id = ?', (jobID,)).fetchone()
+                if not row:
+                    continue
+                attempts, event = row
+                if attempts >= self.maxAttempts:
+                    self.log.error('Giving up on {} after {} attempts. Error: {}'.format(describeEvent(json.loads(event)), attempts, error))
+                    db.execute("UPDATE jobs SET state = 'failed', error = ? WHERE id = ?", (error, jobID))
+                    continue
+                delay = min(self.retryDelay * 2 ** (attempts - 1), self.maxRetryDelay)
+                self.log.info('Retrying {} in {}s (attempt {} of {})'.format(describeEvent(json.loads(event)), delay, attempts + 1, self.maxAttempts))
+                db.execute("UPDATE jobs SET state = 'pending', due = ?, error = ? WHERE id = ?", (now + delay, error, jobID))
+
+    def park(self, jobIDs, hosts):
+        # set jobs aside until one of hosts stops playing (see unpark), without using up an attempt.
+        # They are tried again after maxRetryDelay should no playback stop be noticed.
+        now = time.time()
+        with self._transaction() as db:
+            db.executemany("UPDATE jobs SET state = 'parked', attempts = MAX(attempts - 1, 0), due = ?, error = ? WHERE id = ?",
+                           [(now + self.maxRetryDelay, 'waiting for {}'.format(', '.join(hosts)), jobID) for jobID in jobIDs])
+
+    def parked(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM jobs WHERE state = 'parked'").fetchone()[0]
+
+    def unpark(self):
+        # a host went idle, parked jobs are due right away. Returns the number of jobs released.
+        with self._transaction() as db:
+            return db.execute("UPDATE jobs SET state = 'pending', due = ? WHERE state = 'parked'", (time.time(),)).rowcount
+
+    def nextDue(self):
+        # time the next pending job becomes due, None when nothing is pending
+        with self._lock:
+            return self.db.execute("SELECT MIN(due) FROM jobs WHERE state = 'pending'").fetchone()[0]
+
+class JobWorker():
+    '''
+    Drains a JobQueue one group of jobs at a time using a Librarian from
+    librarianFactory, completing or rescheduling each of its jobs. eventLock
+    returns a context manager held while a group runs.
+    '''
+    log = logger.get_log('JobWorker')
+    IDLE_WAIT = 60
+
+    def __init__(self, jobs, librarianFactory, clean_after_update=False, eventLock=None):
+        self.jobs = jobs
+        self.librarianFactory = librarianFactory
+        self.clean_after_update = clean_after_update
+        self.eventLock = eventLock or nullcontext
+        self.kodi = None
+
+    def _librarian(self):
+        # built on first use, hosts are re-probed before every later group as retried jobs wait for sleeping hosts
+        if self.kodi is None:
+            self.kodi = self.librarianFactory()
+        else:
+            self.kodi.refreshHosts()
+        return self.kodi
+
+    def runOnce(self):
+        # run one group of due jobs, returns False if nothing was due
+        claimed = self.jobs.claim()
+        if not claimed:
+            return False
+        events = [event for _, event in claimed]
+        try:
+            with self.eventLock():
+                failed = processEvents(self._librarian(), events, self.clean_after_update)
+            error = 'update incomplete'
+        except Exception as e: # pylint: disable=broad-except
+            self.log.exception('Failed to process {} Error: {}'.format(describeEvent(events[-1]), e))
+            failed, error = events, str(e)
+
+        # jobs of a group whose files were found are done, only the others are tried again
+        doneIDs = [jobID for jobID, event in claimed if not event in failed]
+        failedIDs = [jobID for jobID, event in claimed if event in failed]
+        if doneIDs:
+            self.jobs.complete(doneIDs)
+        if not failedIDs:
+            return True
+        if error == 'update incomplete' and self.kodi is not None and self.kodi.waitingFor:
+            self.log.info('Parking {} until {} stops playing'.format(describeEvent(failed[-1]), ' or '.join(self.kodi.waitingFor)))
+            self.jobs.park(failedIDs, self.kodi.waitingFor)
+        else:
+            self.jobs.retry(failedIDs, error)
+        return True
+
+    def _cleanIfDue(self):
+        # cleans deferred by the groups just processed run together once the queue is drained
+        if self.kodi is None:
+            return
+        try:
+            with self.eventLock():
+                self.kodi.runDeferredClean()
+        except Exception as e: # pylint: disable=broad-except
+            self.log.exception('Deferred clean failed. Error: {}'.format(e))
+
+    def run(self):
+        # work until nothing is pending, sleeping while only delayed retries remain
+        # and waiting for playback to stop while only parked jobs remain
+        while True:
+            if self.runOnce():
+                continue
+            due = self.jobs.nextDue()
+            parked = self.jobs.parked()
+            if due is None and not parked:
+                self._cleanIfDue()
+                return
+            wait = self.IDLE_WAIT if due is None else min(max(due - time.time(), 0.1), self.IDLE_WAIT)
+            if parked and self._librarian().waitForIdle(wait):
+                self.log.info('Playback stopped. Resuming {} parked jobs'.format(self.jobs.unpark()))
+            elif not parked:
+                time.sleep(wait)
+
+def acquireSlot(lockPath, slots):
+    # returns an open file holding one of slots exclusive locks, None when every slot is taken
+    for n in range(max(1, slots)):
+        handle = open('{}.{}'.format(lockPath, n), 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        return handle
+    return None
+
+def runWorker(jobs, librarianFactory, lockPath, slots=1, clean_after_update=False, eventLock=None):
+    # drain the queue in this process unless slots workers are already running
+    slot = acquireSlot(lockPath, slots)
+    if slot is None:
+        log.debug('All {} worker slots are busy. Exiting.'.format(slots))
+        return
+    worker = JobWorker(jobs, librarianFactory, clean_after_update, eventLock)
+    while slot:
+        worker.run()
+        # a job queued while we were finishing may have found every slot taken, check again after letting go
+        slot.close()
+        slot = acquireSlot(lockPath, slots) if jobs.nextDue() is not None else None
+
+def spawnWorker(script):
+    # start a detached worker process so the caller can return right away
+    try:
+        subprocess.Popen([sys.executable, script, '--worker'], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True, close_fds=True)
+    except OSError as e:
+        log.warning('Failed to start a queue worker. Error: {}'.format(e))
+        return False
+    return True
@@ -2,18 +2,96 @@
 
 import time
 import os
-from kodijsonrpc import KodiJSONClient
+import re
+import threading
+from urllib.parse import unquote
+from kodijsonrpc import KodiJSONClient, KodiNamespaceMethodCatcher, KODI_JSON_NAMESPACES
 from jsonrpcclient.exceptions import ReceivedErrorResponse, ReceivedNoResponse
 from utils import logger
+from librarian.libraryindex import LibraryIndex, directoryKey
+from librarian.snapshots import WatchedStateSnapshots
+from librarian.metrics import Metrics
+from librarian.readcache import ReadCache
+from librarian.notifications import NotificationListener, itemMatcher
+from librarian.poller import Poller
+from librarian.fanout import FanOut
+from librarian.transport import HTTPTransport, TCPTransport
+from librarian.hosthealth import UP, DOWN, QUICK_PROBE
 
 class KodiHost(KodiJSONClient):
-    def __init__(self, name, hostname, port, username, password, always_on, show_notifications):
+    def __init__(self, name, hostname, port, username, password, always_on, show_notifications, tcp_port=9090,
+                 transport='http', connect_timeout=3, read_timeout=30, pool_size=4, health=None, metrics=None, recorder=None, replay=None):
         self.name = name
         self.scanned = False
+        # set once the host rejected a clean limited to content or a directory
+        self.cleansEverything = False
         self.always_on = always_on
         self.show_notifications = show_notifications
+        self.hostname = hostname
+        self.tcp_port = tcp_port
+        self.listener = None
         super().__init__(hostname, port, username, password)
 
+        # Replace the per request HTTP client with a pooled transport, or answers from a recorded trace
+        if replay is not None:
+            self.server = replay.transport(name)
+        elif transport == 'tcp':
+            self.server = TCPTransport(hostname, tcp_port, connect_timeout, read_timeout, pool_size)
+        else:
+            self.server = HTTPTransport(self.url + 'jsonrpc', (username, password), connect_timeout, read_timeout, pool_size)
+        for namespace in KODI_JSON_NAMESPACES:
+            self.__dict__[namespace] = KodiNamespaceMethodCatcher(self.server, namespace)
+
+        # Share RPC outcomes with other processes through the host health state
+        self.health = health
+        self._reported = 0
+        if health:
+            self.server.observer = self._observeRPC
+
+        # Time every request for the metrics
+        self.metrics = metrics
+        if metrics:
+            self.server.meter = self._meterRPC
+
+        # Write every request and response to a trace
+        self.recorder = recorder
+        if recorder:
+            self.server.tracer = self._traceRPC
+
+    def _observeRPC(self, answered):
+        # every failure counts, successes are only written once per health ttl
+        if not answered:
+            self._reported = 0
+            self.health.recordFailure(self.name)
+        elif time.time() - self._reported > self.health.ttl / 2:
+            self._reported = time.time()
+            self.health.recordSuccess(self.name)
+
+    def _meterRPC(self, method, seconds, received, error):
+        self.metrics.recordRPC(self.name, method, seconds, received, error)
+
+    def _traceRPC(self, request, response, seconds, error):
+        self.recorder.rpc(self.name, request, response, seconds, error)
+
+    def listen(self):
+        # subscribe to library notifications, returns False if the socket is unavailable
+        self.listener = NotificationListener(self.name, self.hostname, self.tcp_port)
+        if not self.listener.start():
+            self.listener = None
+            return False
+        return True
+
+    @property
+    def listening(self):
+        return self.listener is not None and self.listener.connected
+
+    @property
+    def eventCursor(self):
+        # position in the notification stream, taken before triggering a change
+        if self.listening:
+            return self.listener.cursor
+        return 0
+
     @property
     def isAlive(self):
         try:
@@ -21,16 +99,44 @@ class KodiHost(KodiJSONClient):
         except Exception:
             return False
 
+    def probe(self, connectTimeout=None):
+        # isAlive with an optional shorter connect timeout for quick health probes
+        saved = self.server.connectTimeout
+        self.server.connectTimeout = connectTimeout or saved
+        try:
+            return self.isAlive
+        finally:
+            self.server.connectTimeout = saved
+
+    def batch(self, calls):
+        # send [(method, params), ...] in one round-trip, failed calls yield their exception in place of a result
+        return self.server.batch(calls)
+
+    def request(self, method, params):
+        # send a single call by its full method name, e.g. VideoLibrary.GetTVShows
+        return self.server.request(method, params)
+
+    @property
+    def connectionStats(self):
+        # connections opened and reused by the transport
+        return self.server.stats
+
     @property
     def inUse(self):
+        # hosts that cannot be asked are treated as busy
+        if self.health:
+            playing = self.health.playing(self.name)
+            if playing is not None:
+                return playing
         try:
             response = self.Player.GetActivePlayers() # pylint: disable=no-member
-        except ReceivedErrorResponse:
+        except (ReceivedErrorResponse, ReceivedNoResponse):
             return True
 
-        if len(response) > 0:
-            return True
-        return False
+        playing = len(response) > 0
+        if self.health:
+            self.health.recordPlaying(self.name, playing)
+        return playing
 
     def notify(self, msg, title='Kodi Library Manager'):
         imageURL = 'https://github.com/jsaddiction/KodiLibrarian/raw/main/img/'
@@ -54,12 +160,59 @@ class KodiHost(KodiJSONClient):
 
 class Librarian():
     TIMEOUT = 20
+    EVENT_RECHECK = 5
+    # polling policies: (timeout seconds, first interval, max interval)
+    POLL_WATCHED_STATE = (TIMEOUT, 0.1, 1)
+    POLL_DIRECTORY_SCAN = (TIMEOUT, 0.1, 2)
+    POLL_NEW_SHOW_SCAN = (TIMEOUT * 3, 0.2, 5)
+    POLL_SOURCE_SCAN = (TIMEOUT * 15, 0.5, 10)
+    POLL_LIBRARY_SCAN = (TIMEOUT * 60, 1, 30)
+    # video sources rarely change, each host's list is asked for at most this often
+    SOURCE_TTL = 3600
+    # seconds between playback probes while waiting for a host to go idle
+    PLAYBACK_RECHECK = 15
+    LOOKUP_LIMIT = 10
+    # library listings are fetched this many items per request so a lookup can stop at the first match
+    LIST_PAGE_SIZE = 500
+    EPISODE_LOOKUP_PROPERTIES = ['file', 'season', 'episode', 'tvshowid']
+    EPISODE_DETAIL_PROPERTIES = ['lastplayed', 'playcount', 'file', 'season', 'episode', 'tvshowid', 'showtitle', 'dateadded']
+    EPISODE_SNAPSHOT_PROPERTIES = ['season', 'episode', 'playcount', 'lastplayed', 'dateadded']
+    MOVIE_DETAIL_PROPERTIES = ['file', 'lastplayed', 'playcount', 'year', 'dateadded']
+    # read cache tags a write makes stale besides the item it names, Clean empties the whole cache
+    WRITE_TAGS = {
+        'VideoLibrary.RemoveEpisode': ['episodes'],
+        'VideoLibrary.SetEpisodeDetails': ['episodes'],
+        'VideoLibrary.RemoveMovie': ['movies'],
+        'VideoLibrary.SetMovieDetails': ['movies'],
+        'VideoLibrary.RemoveTVShow': ['tvshows', 'episodes'],
+        'VideoLibrary.SetTVShowDetails': ['tvshows'],
+        'VideoLibrary.Scan': ['tvshows', 'episodes', 'movies'],
+    }
     log = logger.get_log('Librarian')
-    def __init__(self, hostList, update_while_playing=False):
-        self.hosts = []
+    def __init__(self, hostList, update_while_playing=False, index=None, use_notifications=False, max_workers=4, health=None, sql=None, snapshots=None, cleaner=None,
+                 metrics=None, recorder=None, replay=None, cache=None):
+        self._hosts = None
+        self.health = health
+        # optional read-only SQLBackend answering lookups without JSON-RPC round-trips
+        self.sql = sql
         self.update_while_playing = update_while_playing
-        for host in hostList:
-            client = KodiHost(
+        self.index = index if index else LibraryIndex()
+        self.snapshots = snapshots if snapshots else WatchedStateSnapshots()
+        # optional CleanScheduler deferring cleans after updates
+        self.cleaner = cleaner
+        self.metrics = metrics if metrics else Metrics()
+        # ReadCache answering repeated lookups, emptied every event unless it has a ttl
+        self.cache = cache if cache is not None else ReadCache()
+        # optional TraceRecorder writing every request, TraceReplay answering them from a trace instead of Kodi
+        self.recorder = recorder
+        self.cancel = threading.Event()
+        self._sources = {}
+        # names of the hosts that were all playing when the last update had to be skipped
+        self.waitingFor = []
+        self._stopCursors = {}
+        self.fanout = FanOut(max_workers)
+        self.use_notifications = use_notifications
+        self.clients = [KodiHost(
             name=host['name'],
             hostname=host['hostname'],
             port=host['port'],
@@ -67,11 +220,313 @@ class Librarian():
             password=host['password'],
             always_on=host['always_on'],
             show_notifications=host['show_notifications'],
-            )
-            if client.isAlive:
-                self.hosts.append(client)
+            tcp_port=host.get('tcp_port', 9090),
+            transport=host.get('transport', 'http'),
+            connect_timeout=host.get('connect_timeout', 3),
+            read_timeout=host.get('read_timeout', 30),
+            pool_size=host.get('pool_size', max_workers),
+            health=health,
+            metrics=self.metrics,
+            recorder=recorder,
+            replay=replay,
+            ) for host in hostList]
+        if recorder:
+            recorder.session([client.name for client in self.clients])
+
+    @property
+    def hosts(self):
+        # hosts are probed on first use so runs that never talk to Kodi stay off the network
+        if self._hosts is None:
+            self.refreshHosts()
+        return self._hosts
+
+    def refreshHosts(self):
+        # (re)probe every configured host and keep the ones that respond
+        def connect(client):
+            # hosts known to be up or down from the shared health state are not probed again
+            status = self.health.status(client.name) if self.health else None
+            if status == DOWN:
+                self.log.debug('{} is marked unavailable. Skipping without probing.'.format(client.name))
+                return False
+            if not status == UP and not client.probe(self.health.probeTimeout if status == QUICK_PROBE else None):
+                return False
+            if self.use_notifications and not client.listening:
+                client.listen()
+            return True
+
+        hosts = []
+        for client, alive in zip(self.clients, self.fanout.run(connect, self.clients)):
+            if alive:
+                hosts.append(client)
             else:
                 self.log.warning('Failed to establish connection with {}.'.format(client.name))
+        self._hosts = hosts
+
+    def _beginEvent(self):
+        # hosts are reused between events in daemon mode, forget which ones scanned last time
+        self.metrics.beginEvent()
+        self.metrics.enterPhase('lookup')
+        if not self.cache.ttl:
+            self.cache.clear()
+        self.waitingFor = []
+        for host in self.hosts:
+            host.scanned = False
+
+    def _traceCall(self, method, args, directory):
+        # mark the start of an update in the trace together with the index entries it may use
+        if self.recorder:
+            self.recorder.call(method, args, self.index.entries(directory))
+
+    def endEvent(self, updated):
+        # log where the time of the event went, called once the event is processed
+        self.logConnectionStats()
+        summary = self.metrics.endEvent(updated)
+        if summary:
+            self.log.info(summary)
+
+    def logConnectionStats(self):
+        for host in self.hosts:
+            stats = host.connectionStats
+            self.log.debug('Host: {} Connections opened: {} reused: {}'.format(host.name, stats['opened'], stats['reused']))
+
+    def _sqlLookup(self, name, *args, **kwargs):
+        # answer from the direct database backend, None when there is none or it failed (use JSON-RPC then)
+        if not self.sql:
+            return None
+        return getattr(self.sql, name)(*args, **kwargs)
+
+    def _cached(self, key, tags, read):
+        # answer of read() remembered under key until a write touching one of tags
+        hit, value = self.cache.get(key)
+        if hit:
+            return value
+        value = read()
+        self.cache.put(key, value, tags)
+        return value
+
+    def _cachedDetails(self, idKey, ids, read):
+        # returns {id: details}, read(ids) is asked only for the ids not cached
+        ids = [int(itemID) for itemID in ids if itemID]
+        details = {}
+        for itemID in ids:
+            hit, value = self.cache.get((idKey, itemID))
+            if hit:
+                details[itemID] = value
+        missing = [itemID for itemID in ids if not itemID in details]
+        if missing:
+            fetched = read(missing)
+            for itemID, value in fetched.items():
+                self.cache.put((idKey, int(itemID)), value, ['{}:{}'.format(idKey, int(itemID))])
+            details.update(fetched)
+        return details
+
+    def _wrote(self, method, params):
+        # forget cached answers a write to the library made stale
+        if method == 'VideoLibrary.Clean':
+            self.cache.clear()
+            return
+        tags = list(self.WRITE_TAGS.get(method, []))
+        for idKey in ['episodeid', 'movieid', 'tvshowid']:
+            if params and idKey in params:
+                tags.append('{}:{}'.format(idKey, params[idKey]))
+        self.cache.invalidate(*tags)
+
+    def _fresh(self, check):
+        # poll checks wait for the library to change and must not be answered from the cache
+        def fresh():
+            with self.cache.bypass():
+                return check()
+        return fresh
+
+    def _getDetailsBatch(self, method, idKey, resultKey, ids, properties):
+        # returns {id: details} for several library items fetched in one batch round-trip
+        ids = [int(itemID) for itemID in ids if itemID]
+        if not ids:
+            return {}
+        calls = [(method, {idKey: itemID, 'properties': properties}) for itemID in ids]
+        for host in self.hosts:
+            try:
+                responses = host.batch(calls)
+            except (ReceivedErrorResponse, ReceivedNoResponse) as e:
+                self.log.warning('Host: {} Failed to get {} for {}s: {} Error: {}'.format(host.name, resultKey, idKey, ids, e))
+                continue
+
+            details = {}
+            for itemID, response in zip(ids, responses):
+                if isinstance(response, dict) and resultKey in response:
+                    details[itemID] = response[resultKey]
+                else:
+                    self.log.debug('Host: {} No {} for {}: {} Response: {}'.format(host.name, resultKey, idKey, itemID, response))
+            return details
+        return {}
+
+    def _readPage(self, hosts, method, params, description):
+        # one page of a listing from the first of hosts that answers, hosts failing are dropped from the list.
+        # Returns the response, None once no host is left.
+        while hosts:
+            host = hosts[0]
+            try:
+                response = host.request(method, params)
+            except (ReceivedErrorResponse, ReceivedNoResponse) as e:
+                self.log.warning('Host: {} Failed to get {}. Error: {}'.format(host.name, description, e))
+                hosts.pop(0)
+                continue
+            if isinstance(response, dict) and response:
+                return response
+            self.log.debug('Host: {} No {} Response: {}'.format(host.name, description, response))
+            hosts.pop(0)
+        return None
+
+    def _iterList(self, method, resultKey, params, description, limit=None):
+        # yields the items of a library listing LIST_PAGE_SIZE at a time (at most limit items),
+        # a caller that stops early never fetches the remaining pages
+        hosts = list(self.hosts)
+        start = 0
+        while not limit or start < limit:
+            end = min(start + self.LIST_PAGE_SIZE, limit) if limit else start + self.LIST_PAGE_SIZE
+            pageParams = dict(params, limits={'start': start, 'end': end})
+            page = self._cached((method, repr(sorted(pageParams.items()))), [resultKey], lambda: self._readPage(hosts, method, pageParams, description))
+            items = page.get(resultKey, []) if page else []
+            for item in items:
+                yield item
+            # Kodi leaves out the list when nothing matched, a short page is the last one
+            total = page.get('limits', {}).get('total') if page else None
+            if len(items) < end - start or total is not None and end >= total:
+                return
+            start = end
+
+    def _batchWrite(self, host, calls, description):
+        # send related writes in one round-trip, logging each failed call. Returns list of calls that failed.
+        for method, params in calls:
+            self._wrote(method, params)
+        try:
+            responses = host.batch(calls)
+        except (ReceivedErrorResponse, ReceivedNoResponse) as e:
+            self.log.warning('Host: {} Failed to {}. Error: {}'.format(host.name, description, e))
+            return list(calls)
+
+        failed = []
+        for call, response in zip(calls, responses):
+            if not response == 'OK':
+                self.log.warning('Host: {} Failed to {} {} Response: {}'.format(host.name, description, call[1], response))
+                failed.append(call)
+        return failed
+
+    def _toggleWatchedState(self, host, method, newWatchedState, watchedState):
+        # write the modified and then the original watched state in one round-trip so the host picks up the change
+        self.log.debug('Toggling watched state {} Host: {}'.format(watchedState, host.name))
+        return not self._batchWrite(host, [(method, newWatchedState), (method, watchedState)], 'toggle watched state')
+
+    def _busyHosts(self):
+        # hosts currently playing a video which should not be updated, probed concurrently
+        if self.update_while_playing:
+            return []
+        inUse = self.fanout.run(lambda host: host.inUse, self.hosts)
+        return [host for host, playing in zip(self.hosts, inUse) if playing]
+
+    def _canUpdate(self):
+        # at least one reachable host must be idle, otherwise the update is left for a later retry
+        if not self.hosts:
+            self.log.warning('No hosts available. Skipping update.')
+            return False
+        if len(self._busyHosts()) == len(self.hosts):
+            self.log.warning('Every host is currently playing a video. Deferring update.')
+            self.waitingFor = [host.name for host in self.hosts]
+            return False
+        return True
+
+    def idleHosts(self):
+        # names of reachable hosts not playing a video, probed concurrently
+        inUse = self.fanout.run(lambda host: host.inUse, self.hosts)
+        return [host.name for host, playing in zip(self.hosts, inUse) if not playing]
+
+    def _waitForPlaybackStop(self, timeout):
+        # sleep up to timeout seconds, returning early when a listening host reports Player.OnStop
+        listening = [host for host in self.hosts if host.listening]
+        if not listening:
+            self.cancel.wait(timeout)
+            return
+        for host in listening:
+            cursor = self._stopCursors.get(host.name, host.eventCursor)
+            self._stopCursors[host.name], stopped = host.listener.wait(cursor, timeout / len(listening), methods=['Player.OnStop'])
+            if stopped:
+                # the cached playback state is outdated now
+                if self.health:
+                    self.health.recordPlaying(host.name, False)
+                return
+
+    def waitForIdle(self, timeout):
+        # Block up to timeout seconds until some host is not playing, woken by Player.OnStop notifications
+        # and otherwise probing every PLAYBACK_RECHECK seconds. Returns True once a host is idle.
+        deadline = time.time() + timeout
+        # take in stops reported since the last call before trusting cached playback states
+        self._waitForPlaybackStop(0)
+        while not self.cancel.is_set():
+            if self.idleHosts():
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self._waitForPlaybackStop(min(remaining, self.PLAYBACK_RECHECK))
+        return False
+
+    def _notify(self, msg, title):
+        # send notification to every host that wants them, the update is done already so failures are only logged
+        def notify(host):
+            self.log.info('Sending notification to {}. Message: "{}"'.format(host.name, msg))
+            try:
+                host.notify(msg, title)
+            except (ReceivedErrorResponse, ReceivedNoResponse) as e:
+                self.log.warning('Host: {} Failed to send notification. Error: {}'.format(host.name, e))
+        self.fanout.run(notify, [host for host in self.hosts if host.show_notifications])
+
+    def _poller(self, host, cursor, name, policy, match=None):
+        # Build a Poller for an operation on host. Hosts pushing notifications wake it up
+        # on matching library events, re-checking every EVENT_RECHECK seconds.
+        timeout, interval, maxInterval = policy
+        observer = lambda poller: self.metrics.recordPoll(host.name, poller)
+        if host.listening:
+            return Poller(name, timeout, interval=self.EVENT_RECHECK, backoff=1, jitter=0, cancel=self.cancel, wait=host.listener.waiter(cursor, match), observer=observer)
+        return Poller(name, timeout, interval=interval, maxInterval=maxInterval, cancel=self.cancel, observer=observer)
+
+    def cancelPending(self):
+        # stop all running waits, they return as if they timed out
+        self.cancel.set()
+
+    def _getSources(self, host):
+        # returns list of video source paths of host, multipath sources contribute each of their paths
+        cached = self._sources.get(host.name)
+        if cached and time.time() - cached[0] < self.SOURCE_TTL:
+            return cached[1]
+        try:
+            response = host.Files.GetSources(media='video') # pylint: disable=no-member
+        except (ReceivedErrorResponse, ReceivedNoResponse) as e:
+            self.log.warning('Host: {} Failed to get video sources. Error: {}'.format(host.name, e))
+            return cached[1] if cached else []
+
+        paths = []
+        for source in (response or {}).get('sources', []):
+            if source['file'].startswith('multipath://'):
+                paths += [unquote(path) for path in source['file'][len('multipath://'):].split('/') if path]
+            else:
+                paths.append(source['file'])
+        self._sources[host.name] = (time.time(), paths)
+        return paths
+
+    def _getSource(self, directory):
+        # returns the video source path holding directory, None when no host has one
+        directory = directoryKey(directory)
+        for host in self.hosts:
+            sources = [directoryKey(path) for path in self._getSources(host) if directory.startswith(directoryKey(path))]
+            if sources:
+                return max(sources, key=len)
+        return None
+
+    def _folderScanAllowed(self, directory, content):
+        # Kodi scans a single folder as part of the nearest parent with content settings. Only the database tells
+        # what those are, without it the folder scan is simply tried.
+        settings = self._sqlLookup('pathContent', directory)
+        return not settings or settings == content
 
     def _modifyWatchedState(self, watchedState):
         # Create modified watched state
@@ -80,26 +535,64 @@ class Librarian():
         newWatchedState['playcount'] += 1
         return newWatchedState
 
-    def cleanLibrary(self, content=None):
+    def idle(self):
+        # True when no host is playing a video, whatever update_while_playing says
+        return not any(self.fanout.run(lambda host: host.inUse, self.hosts))
+
+    def cleanLibrary(self, content=None, directory=None):
+        # clean content, limited to the items below directory when given. Returns True once a host started it
         params = {
             'showdialogs': False,
             'content': content
         }
         if not content or not content in ['movies', 'tvshows']:
             del params['content']
+        if directory:
+            params['directory'] = directoryKey(directory)
 
         for host in self.hosts:
-            self.log.info('Initiating clean of {} on host: {}'.format(content, host.name))
-            try:
-                response = host.VideoLibrary.Clean(params)
-            except (ReceivedErrorResponse, ReceivedNoResponse):
-                pass
+            if host.cleansEverything:
+                self.log.info('Initiating clean of the whole library for {} {}on host: {}'.format(content, directory + ' ' if directory else '', host.name))
+            else:
+                self.log.info('Initiating clean of {} {}on host: {}'.format(content, directory + ' ' if directory else '', host.name))
+            response = self._startClean(host, {'showdialogs': False} if host.cleansEverything else params)
 
             if not response == 'OK':
                 self.log.warning('Incorrect response received from Host: {} Response: {}. Trying next host.'.format(host.name, response))
                 continue
 
-            return
+            # Cleaned items may be gone, re-validate index entries on next use
+            self.index.expire(None if host.cleansEverything else directory)
+            return True
+        return False
+
+    def _startClean(self, host, params):
+        # returns the response of host to VideoLibrary.Clean. Kodi before JSON-RPC v12 rejects the content and
+        # directory params, such a host cleans the whole library instead, from then on without asking first.
+        self._wrote('VideoLibrary.Clean', params)
+        try:
+            return host.VideoLibrary.Clean(params)
+        except ReceivedErrorResponse as e:
+            if len(params) == 1:
+                return None
+            self.log.warning('Host: {} rejected a clean of {} Error: {}. Cleaning the whole library instead.'.format(host.name, params, e))
+            host.cleansEverything = True
+            return self._startClean(host, {'showdialogs': False})
+        except ReceivedNoResponse:
+            return None
+
+    def requestClean(self, content, directory=None):
+        # clean after an update, right away or later together with others when a CleanScheduler is set
+        if self.cleaner is not None:
+            self.cleaner.request(content, directory)
+            return True
+        return self.cleanLibrary(content, directory)
+
+    def runDeferredClean(self, force=False):
+        # run the cleans the CleanScheduler collected if it is time, force ignores the idle window
+        if self.cleaner is None:
+            return False
+        return self.cleaner.run(self, force)
 
     ########################  TV Show methods  #######################
 
@@ -108,64 +601,125 @@ class Librarian():
         if not path.endswith('/'):
             path += '/'
 
-        showList = self._getTVShows()
+        # Check the local index first, re-validating stale entries with a single details call
+        entry = self.index.getTVShow(path)
+        if entry and not entry['stale']:
+            return entry['tvshowid']
+        if entry:
+            details = self._getTVShowDetails(entry['tvshowid'])
+            if details and details['file'] == path:
+                self.index.addTVShow(path, entry['tvshowid'])
+                return entry['tvshowid']
+            self.index.removeTVShow(entry['tvshowid'])
+
+        # Unknown to the index, the database answers for this path alone
+        showList = self._sqlLookup('tvShows', path)
+        if showList is not None:
+            self.index.addTVShows(showList)
+            return showList[0]['tvshowid'] if showList else None
+
+        # otherwise ask the library for the show at path alone, polls for new shows repeat this
+        showList = list(self._iterTVShows(filter={'operator': 'is', 'field': 'path', 'value': path}, limit=self.LOOKUP_LIMIT))
+        self.index.addTVShows(showList)
         for show in showList:
             if show['file'] == path:
                 return show['tvshowid']
         return None
 
-    def _getTVShows(self):
-        # returns list of all tvshows in the library
-        params = {
-            'properties': ['file']
-        }
-        for host in self.hosts:
-            try:
-                response = host.VideoLibrary.GetTVShows(params) # pylint: disable=no-member
-            except (ReceivedErrorResponse, ReceivedNoResponse) as e:
-                self.log.warning('Host: {} Failed to get TVShow list. Error: {}'.format(host.name, e))
-                response = None
-            
-            if response and 'tvshows' in response:
-                return response['tvshows']
-        return []
+    def _iterTVShows(self, properties=None, filter=None, limit=None): # pylint: disable=redefined-builtin
+        # yields the tvshows in the library (matching filter) page by page
+        params = {'properties': properties or ['file']}
+        if filter:
+            params['filter'] = filter
+        return self._iterList('VideoLibrary.GetTVShows', 'tvshows', params, 'TVShow list', limit)
 
-    def _getEpisodeID(self, tvshowID, episodePath):
-        # returns episodeID of episode located at episodePath
+    def _getFileEpisodeIDs(self, tvshowID, episodePath, season=None, episode=None):
+        # returns list of episodeIDs backed by the file at episodePath, more than one for multi-episode files
         if not tvshowID:
-            return None
-        episodes = self._getEpisodes(tvshowID)
+            return []
 
-        # return episodeid if only one was found
-        if len(episodes) == 1:
-            return episodes[0]['episodeid']
+        # Check the local index first, re-validating stale entries with one batched details call
+        entries = [entry for entry in self.index.getEpisodes(episodePath) if entry['tvshowid'] == tvshowID]
+        fresh = [entry['episodeid'] for entry in entries if not entry['stale']]
+        if fresh:
+            return fresh
+        stale = self._getEpisodeDetailsBatch([entry['episodeid'] for entry in entries])
+        valid = []
+        for entry in entries:
+            details = stale.get(entry['episodeid'])
+            if details and os.path.splitext(details['file'])[0] == os.path.splitext(episodePath)[0]:
+                self.index.addEpisodes([details])
+                valid.append(entry['episodeid'])
+            else:
+                self.index.removeEpisode(entry['episodeid'])
+        if valid:
+            return valid
 
-        # return episode id of anything in the list matches path excluding extension
-        for episode in episodes:
-            if os.path.splitext(episode['file'])[0] == os.path.splitext(episodePath)[0]:
-                return episode['episodeid']
-        return None
+        # Unknown to the index, ask the library for matching rows only
+        if self._isNumber(season) and self._isNumber(episode):
+            episodes = self._getEpisodes(tvshowID, season=season, episode=episode, properties=self.EPISODE_LOOKUP_PROPERTIES, limit=self.LOOKUP_LIMIT)
+        else:
+            episodes = self._getEpisodes(tvshowID, filename=os.path.basename(os.path.splitext(episodePath)[0]), properties=self.EPISODE_LOOKUP_PROPERTIES, limit=self.LOOKUP_LIMIT)
+        self.index.addEpisodes(episodes)
+
+        # return episode ids of everything in the list matching path excluding extension
+        found = [ep['episodeid'] for ep in episodes if os.path.splitext(ep['file'])[0] == os.path.splitext(episodePath)[0]]
+        if found:
+            return found
+
+        # a single row for the requested season/episode is the episode we are looking for
+        if self._isNumber(season) and self._isNumber(episode) and len(episodes) == 1:
+            return [episodes[0]['episodeid']]
+        return []
+
+    def _isNumber(self, value):
+        # Sonarr provides season/episode numbers as strings which may be empty
+        try:
+            int(value)
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    def _getEpisodes(self, tvshowID, season=None, episode=None, filename=None, properties=None, limit=None):
+        # returns list of episodes of a tvshow, optionally filtered server side by season, episode and filename prefix
+        return list(self._iterEpisodes(tvshowID, season, episode, filename, properties, limit))
 
-    def _getEpisodes(self, tvshowID):
-        # returns list of all episodes of a tvshow
+    def _iterEpisodes(self, tvshowID, season=None, episode=None, filename=None, properties=None, limit=None):
+        # yields the episodes _getEpisodes lists page by page
         params = {
             'tvshowid': int(tvshowID),
-            'properties': ['lastplayed', 'playcount', 'file', 'season', 'episode', 'tvshowid', 'showtitle']
+            'properties': properties or ['lastplayed', 'playcount', 'file', 'season', 'episode', 'tvshowid', 'showtitle']
         }
-        for host in self.hosts:
-            try:
-                response = host.VideoLibrary.GetEpisodes(params) # pylint: disable=no-member
-            except (ReceivedErrorResponse, ReceivedNoResponse) as e:
-                self.log.warning('Host: {} Failed to get episodes for tvshowID: {} Error: {}'.format(host.name, tvshowID, e))
-                response = None
-
-            if response and 'episodes' in response:
-                return response['episodes']
-        return []
+        if self._isNumber(season):
+            params['season'] = int(season)
+
+        rules = []
+        if self._isNumber(episode):
+            rules.append({'field': 'episode', 'operator': 'is', 'value': str(int(episode))})
+        if filename:
+            rules.append({'field': 'filename', 'operator': 'startswith', 'value': filename})
+        if len(rules) == 1:
+            params['filter'] = rules[0]
+        elif rules:
+            params['filter'] = {'and': rules}
+
+        episodes = self._sqlLookup('episodes', tvshowID, season=params.get('season'), episode=int(episode) if self._isNumber(episode) else None,
+                                   filename=filename, limit=limit)
+        if episodes is not None:
+            yield from episodes
+            return
+        yield from self._iterList('VideoLibrary.GetEpisodes', 'episodes', params, 'episodes for tvshowID: {}'.format(tvshowID), int(limit) if limit else None)
 
     def _getTVShowDetails(self, tvshowID):
         if not tvshowID:
             return None
+        return self._cachedDetails('tvshowid', [tvshowID], self._readTVShowDetails).get(int(tvshowID))
+
+    def _readTVShowDetails(self, tvshowIDs):
+        tvshowID = tvshowIDs[0]
+        details = self._sqlLookup('tvShowDetails', tvshowID)
+        if details is not None:
+            return {tvshowID: details} if details else {}
         params = {
             'tvshowid': tvshowID,
             'properties': ['file']
@@ -179,16 +733,23 @@ class Librarian():
                 continue
 
             if response and 'tvshowdetails' in response:
-                return response['tvshowdetails']
+                return {tvshowID: response['tvshowdetails']}
         
-        return None
+        return {}
 
     def _getEpisodeDetails(self, episodeID):
         if not episodeID:
             return None
+        return self._cachedDetails('episodeid', [episodeID], self._readEpisodeDetails).get(int(episodeID))
+
+    def _readEpisodeDetails(self, episodeIDs):
+        episodeID = episodeIDs[0]
+        details = self._sqlLookup('episodeDetails', [episodeID])
+        if details is not None:
+            return details
         params = {
-            'episodeid': int(episodeID),
-            'properties': ['lastplayed', 'playcount', 'file', 'season', 'episode', 'tvshowid', 'showtitle', 'dateadded']
+            'episodeid': episodeID,
+            'properties': self.EPISODE_DETAIL_PROPERTIES
         }
 
         for host in self.hosts:
@@ -199,8 +760,18 @@ class Librarian():
                 response = None
             
             if response and 'episodedetails' in response:
-                return response['episodedetails']
-        return None
+                return {episodeID: response['episodedetails']}
+        return {}
+
+    def _getEpisodeDetailsBatch(self, episodeIDs):
+        # returns {episodeid: details} for several episodes in one round-trip
+        return self._cachedDetails('episodeid', episodeIDs, self._readEpisodeDetailsBatch)
+
+    def _readEpisodeDetailsBatch(self, episodeIDs):
+        details = self._sqlLookup('episodeDetails', episodeIDs)
+        if details is not None:
+            return details
+        return self._getDetailsBatch('VideoLibrary.GetEpisodeDetails', 'episodeid', 'episodedetails', episodeIDs, self.EPISODE_DETAIL_PROPERTIES)
 
     def _getEpisodeWatchedState(self, episodeID=None, episodeDetails=None):
         # returns object contianing watches status of an episode given either episodeid or episode details
@@ -213,218 +784,407 @@ class Librarian():
         
         return {k:v for k, v in details.items() if k in ['playcount', 'lastplayed', 'episodeid', 'dateadded']}
 
-    def _toggleEpisodeWatchedState(self, episodeID):
-        # toggle watchedstate on each nonscanned host
-        watchedState = self._getEpisodeWatchedState(episodeID)
-        newWatchedState = self._modifyWatchedState(watchedState)
+    def _toggleEpisodeWatchedStates(self, episodeIDs):
+        # toggle watched state of several episodes on each nonscanned host, one round-trip per host
+        details = self._getEpisodeDetailsBatch(episodeIDs)
+        calls = []
+        for episodeID in details:
+            watchedState = self._getEpisodeWatchedState(episodeDetails=details[episodeID])
+            calls.append(('VideoLibrary.SetEpisodeDetails', self._modifyWatchedState(watchedState)))
+            calls.append(('VideoLibrary.SetEpisodeDetails', watchedState))
+        if not calls:
+            return
 
-        for host in self.hosts:
-            if not host.scanned:
-                self._setEpisodeWatchedState(host, newWatchedState)
-                self._setEpisodeWatchedState(host, watchedState)
+        def toggle(host):
+            self.log.debug('Toggling watched state of episodeIDs: {} Host: {}'.format(list(details), host.name))
+            return not self._batchWrite(host, calls, 'toggle watched state')
+        self.fanout.run(toggle, [host for host in self.hosts if not host.scanned])
 
-    def _setEpisodeWatchedState(self, host, watchedState):
-        if not watchedState:
+    def _setEpisodeWatchedStates(self, host, watchedStates):
+        # write several watched states in one round-trip and wait until the host reports all of them
+        watchedStates = [watchedState for watchedState in watchedStates if watchedState]
+        if not watchedStates:
             return None
-        
-        # Get what is currently in the library
-        oldWatchedState = self._getEpisodeWatchedState(watchedState['episodeid'])
 
-        # check if we need a watched state change
-        if oldWatchedState == watchedState:
+        # Get what is currently in the library and skip states that need no change, a cached state may be stale
+        with self.cache.bypass():
+            current = self._getEpisodeDetailsBatch([watchedState['episodeid'] for watchedState in watchedStates])
+        oldWatchedStates = {episodeID: self._getEpisodeWatchedState(episodeDetails=details) for episodeID, details in current.items()}
+        pending = [watchedState for watchedState in watchedStates if not oldWatchedStates.get(watchedState['episodeid']) == watchedState]
+        if not pending:
             return True
 
-        self.log.debug('Setting episode watched state to {} Host: {}'.format(watchedState, host.name))
+        self.log.debug('Setting episode watched states to {} Host: {}'.format(pending, host.name))
 
         # Initiate the changes
-        try:
-            response = host.VideoLibrary.SetEpisodeDetails(watchedState) # pylint: disable=no-member
-        except (ReceivedErrorResponse, ReceivedNoResponse) as e:
-            self.log.warning('Failed to set watched state watchedState: {} Error: {}'.format(watchedState, e))
-            response = None
-
-        if not response == 'OK':
-            self.log.warning('Incorrect response received from Host: {} Response: {}. Trying next host.'.format(host.name, response))
+        cursor = host.eventCursor
+        if self._batchWrite(host, [('VideoLibrary.SetEpisodeDetails', watchedState) for watchedState in pending], 'set episode watched state'):
+            self.log.warning('Host: {} Failed to set episode watched states. Trying next host.'.format(host.name))
             return False
 
-        t = 0
-        while t < self.TIMEOUT * 10:
-            time.sleep(0.1)
-            t += 1
-            newWatchedState = self._getEpisodeWatchedState(watchedState['episodeid'])
-            if newWatchedState and not newWatchedState == oldWatchedState:
-                self.log.debug('Setting watched state complete. Took {}s'.format(t/10))
-                return True
-        
-        self.log.warning('Host: {} Timed out after {}s while setting episode watched state. Trying next host.'.format(host.name, t/10))
-        return False
-
-    def _removeEpisode(self, episodeID):
-        # Remove given episode and return true if success
-        self.log.debug('Removing episodeID: {}'.format(episodeID))
-        params = {
-            'episodeid': episodeID
-        }
-        for host in self.hosts:
-            try:
-                response = host.VideoLibrary.RemoveEpisode(params)
-            except (ReceivedErrorResponse, ReceivedNoResponse) as e:
-                response = None
-
-            if not response == 'OK':
-                self.log.warning('Host: {} Failed to remove episodeid: {} Error: {}'.format(host.name, episodeID, e))
-                continue
-            
+        episodeIDs = [watchedState['episodeid'] for watchedState in pending]
+        match = itemMatcher('episode', episodeIDs[0]) if len(episodeIDs) == 1 else itemMatcher('episode')
+        poller = self._poller(host, cursor, 'Setting episode watched state', self.POLL_WATCHED_STATE, match)
+        def statesChanged():
+            details = self._getEpisodeDetailsBatch(episodeIDs)
+            return all(episodeID in details and not self._getEpisodeWatchedState(episodeDetails=details[episodeID]) == oldWatchedStates.get(episodeID) for episodeID in episodeIDs)
+        if poller.poll(self._fresh(statesChanged)):
+            self.log.debug('Setting watched state complete. {}'.format(poller))
             return True
 
-    def _refreshEpisode(self, episodeID, episodePath):
-        # store watched state for later
-        # remove any episode that matches tvshowid, season, episode (may be more than one)
-        # initiate a scan on tvshow folder
-        # return new episodeID
-        self.log.debug('Refreshing episodeID: {}'.format(episodeID))
-
-        # Retain details of given episodeid
-        episodeDetails = self._getEpisodeDetails(episodeID)
-        tvShowDetails = self._getTVShowDetails(episodeDetails['tvshowid'])
-        watchedState = self._getEpisodeWatchedState(episodeDetails=episodeDetails)
-
-        # Get all episodes matching tvshowid, season, episode
-        episodeIDs = [episode['episodeid'] for episode in self._getEpisodes(episodeDetails['tvshowid']) if episode['season'] == episodeDetails['season'] and episode['episode'] == episodeDetails['episode']]
-
-        # remove all found episodes
-        for epID in episodeIDs:
-            self._removeEpisode(epID)
-
-        # Initiate scan of show directory
-        newEpisodeID = self._scanTVShowDirectory(tvShowDetails['file'], episodePath)
+        self.log.warning('Host: {} Timed out after {:.1f}s ({} attempts) while setting episode watched state. Trying next host.'.format(host.name, poller.elapsed, poller.attempts))
+        return False
 
-        # Set previously collected watched state of new episode
-        watchedState['episodeid'] = newEpisodeID
+    def _removeEpisodes(self, episodeIDs):
+        # Remove given episodes in one batch and return true if all were removed
+        pending = [('VideoLibrary.RemoveEpisode', {'episodeid': epID}) for epID in episodeIDs]
+        if not pending:
+            return True
+        self.log.debug('Removing episodeIDs: {}'.format(list(episodeIDs)))
         for host in self.hosts:
-            if self._setEpisodeWatchedState(host, watchedState):
-                return newEpisodeID
-
-        return None
+            failed = self._batchWrite(host, pending, 'remove episode')
+            for call in pending:
+                if not call in failed:
+                    self.index.removeEpisode(call[1]['episodeid'])
+            pending = failed
+            if not pending:
+                return True
+        return False
 
-    def _scanTVShowDirectory(self, showDirectory, episodePath):
-        # Scan tvshow directory and return new episodeID
-        self.log.debug('Scanning show directory {}'.format(showDirectory))
-        showID = self._getTVShowID(showDirectory)
+    def _episodeNumbers(self, item):
+        # episode numbers covered by the file of an episode item, several for multi-episode files
+        numbers = item.get('episodes') or [item.get('episode')]
+        return [int(number) for number in numbers if self._isNumber(number)]
+
+    def _getEpisodeIDs(self, tvshowID, episodes):
+        # returns {path: [episodeIDs]} for the known episodes of one show, looked up with a single library call.
+        # A multi-episode file is backed by one row per episode and resolves to all of them.
+        if not tvshowID or not episodes:
+            return {}
+        if len(episodes) == 1 and len(self._episodeNumbers(episodes[0])) <= 1:
+            item = episodes[0]
+            episodeIDs = self._getFileEpisodeIDs(tvshowID, item['path'], item['season'], item['episode'])
+            return {item['path']: episodeIDs} if episodeIDs else {}
+
+        # Check the local index first
+        found = {}
+        for item in episodes:
+            entries = [entry['episodeid'] for entry in self.index.getEpisodes(item['path']) if entry['tvshowid'] == tvshowID and not entry['stale']]
+            if entries and len(entries) >= len(self._episodeNumbers(item)):
+                found[item['path']] = entries
+        missing = [item for item in episodes if not item['path'] in found]
+        if not missing:
+            return found
+
+        # One listing covers the rest, limited to their season when they share one. It stops once every file
+        # has all its episodes, numbers only decide after the whole listing.
+        seasons = {int(item['season']) if self._isNumber(item['season']) else None for item in missing}
+        season = seasons.pop() if len(seasons) == 1 else None
+        wanted = {os.path.splitext(item['path'])[0]: len(self._episodeNumbers(item)) for item in missing}
+        byPath = {}
+        byNumber = {}
+        seen = []
+        for ep in self._iterEpisodes(tvshowID, season=season, properties=self.EPISODE_LOOKUP_PROPERTIES):
+            seen.append(ep)
+            byPath.setdefault(os.path.splitext(ep['file'])[0], []).append(ep['episodeid'])
+            byNumber.setdefault((ep['season'], ep['episode']), []).append(ep['episodeid'])
+            if all(len(byPath.get(path, [])) >= count for path, count in wanted.items()):
+                break
+            if len(seen) >= self.LIST_PAGE_SIZE:
+                self.index.addEpisodes(seen)
+                seen = []
+        self.index.addEpisodes(seen)
+
+        for item in missing:
+            episodeIDs = list(byPath.get(os.path.splitext(item['path'])[0], []))
+            if not episodeIDs and self._isNumber(item['season']):
+                # a single row for each requested season/episode is the episode we are looking for
+                for number in self._episodeNumbers(item):
+                    rows = byNumber.get((int(item['season']), number), [])
+                    if len(rows) == 1:
+                        episodeIDs.append(rows[0])
+            if episodeIDs:
+                found[item['path']] = episodeIDs
+        return found
+
+    def _episodeKey(self, season, episode):
+        # refreshed files get new episodeids and often new names, their watched states follow season/episode numbers
+        return '{}x{}'.format(season, episode)
+
+    def _removeForRefresh(self, snapshotKey, tvshowID, existing, season=None, pending=None, numbers=None):
+        # Snapshot watched states of existing episodes ({path: [episodeIDs]}) from one listing of the show (or season),
+        # persist it, then remove every episode sharing their season/episode numbers (may be more than one).
+        # Given the episode numbers of season only their rows are looked up, the listing is the fallback.
+        # States pending from an interrupted earlier refresh win. Returns {'<season>x<episode>': watchedState}
+        episodeIDs = {episodeID for pathIDs in existing.values() for episodeID in pathIDs}
+        self.log.debug('Refreshing episodeIDs: {}'.format(sorted(episodeIDs)))
+        watchedStates = dict(pending or {})
+        library = []
+        # an episode watched since it was cached must not get its old state back
+        with self.cache.bypass():
+            if numbers and season is not None:
+                library = [ep for number in numbers for ep in self._getEpisodes(tvshowID, season=season, episode=number, properties=self.EPISODE_SNAPSHOT_PROPERTIES, limit=self.LOOKUP_LIMIT)]
+            if not episodeIDs.issubset(ep['episodeid'] for ep in library):
+                # the library numbers these files differently
+                library = self._getEpisodes(tvshowID, season=season, properties=self.EPISODE_SNAPSHOT_PROPERTIES)
+        numbers = set()
+        for ep in library:
+            if ep['episodeid'] in episodeIDs:
+                key = self._episodeKey(ep['season'], ep['episode'])
+                numbers.add(key)
+                if not key in watchedStates:
+                    watchedStates[key] = {k: v for k, v in self._getEpisodeWatchedState(episodeDetails=ep).items() if not k == 'episodeid'}
+        if not numbers:
+            return watchedStates
+
+        # Nothing is removed before the snapshot is on disk
+        if not self.snapshots.save(snapshotKey, watchedStates):
+            self.log.warning('Could not save watched states of episodeIDs: {}. Not removing them for a refresh.'.format(sorted(episodeIDs)))
+            return watchedStates
+        self._removeEpisodes([ep['episodeid'] for ep in library if self._episodeKey(ep['season'], ep['episode']) in numbers])
+        return watchedStates
+
+    def _restoreEpisodeWatchedStates(self, snapshotKey, watchedStates, details):
+        # Write snapshot states back to the scanned episodes ({episodeid: details}) in one batch per host.
+        # States that found no episode stay on disk for a later refresh of the show.
+        restore = {}
+        for episodeID, ep in details.items():
+            key = self._episodeKey(ep['season'], ep['episode'])
+            if key in watchedStates:
+                restore[key] = dict(watchedStates[key], episodeid=episodeID)
+        if not restore:
+            return
         for host in self.hosts:
-            if not self.update_while_playing and host.inUse:
-                self.log.info('{} is currently playing a video. Skipping update.'.format(host.name))
-                continue
-            try:
-                response = host.VideoLibrary.Scan(directory=showDirectory) # pylint: disable=no-member
-            except (ReceivedErrorResponse, ReceivedNoResponse):
-                pass
-
-            if not response == 'OK':
-                self.log.warning('Incorrect response received from Host: {} Response: {}. Trying next host.'.format(host.name, response))
-                continue
-
-            t = 0
-            while t < self.TIMEOUT * 10:
-                time.sleep(0.1)
-                t += 1
-                episodeID = self._getEpisodeID(showID, episodePath)
-                if episodeID:
-                    host.scanned = True
-                    self.log.debug('Scan complete. EpisodeID: {} Took {}s'.format(episodeID, t/10))
-                    return episodeID
-            self.log.warning('Host: {} Timed out after {}s while scanning show directory. Trying next host.'.format(host.name, t/10))
-        return None
-
-    def _scanNewTVShow(self, showDirectory, episodePath):
-        # Full library scan and return new episodeID
-        self.log.debug('Scanning new Tv Show {}. This may take a while.'.format(showDirectory))
+            if self._setEpisodeWatchedStates(host, list(restore.values())):
+                break
+        else:
+            self.log.warning('Failed to restore watched states of episodeIDs: {}. Keeping them for the next update.'.format([state['episodeid'] for state in restore.values()]))
+            return
 
+        remaining = {key: state for key, state in watchedStates.items() if not key in restore}
+        if remaining:
+            self.snapshots.save(snapshotKey, remaining)
+        else:
+            self.snapshots.discard(snapshotKey)
+
+    def _scanForEpisodes(self, showDirectory, episodes, params, name, policy, description):
+        # Run one scan and poll until every given episode file is in the library. Returns {path: [episodeIDs]}
+        found = {}
+        checked = []
+        def resolve():
+            missing = [item for item in episodes if not item['path'] in found]
+            tvshowID = self._getTVShowID(showDirectory)
+            found.update(self._getEpisodeIDs(tvshowID, missing))
+            if not found and tvshowID and not tvshowID in checked:
+                # a show removed and added again has a new id, drop an index entry still naming the old one
+                checked.append(tvshowID)
+                details = self._getTVShowDetails(tvshowID)
+                if not details or not details['file'] == showDirectory.rstrip('/') + '/':
+                    self.log.debug('TVShowID: {} no longer belongs to {}. Looking it up again.'.format(tvshowID, showDirectory))
+                    self.index.removeTVShow(tvshowID)
+            return len(found) == len(episodes)
+
+        busy = self._busyHosts()
         for host in self.hosts:
-            if not self.update_while_playing and host.inUse:
+            if host in busy:
                 self.log.info('{} is currently playing a video. Skipping update.'.format(host.name))
                 continue
+            cursor = host.eventCursor
+            started = time.time()
+            self._wrote('VideoLibrary.Scan', params)
             try:
-                response = host.VideoLibrary.Scan() # pylint: disable=no-member
+                response = host.VideoLibrary.Scan(**params) # pylint: disable=no-member
             except (ReceivedErrorResponse, ReceivedNoResponse):
-                pass
+                response = None
 
             if not response == 'OK':
                 self.log.warning('Incorrect response received from Host: {} Response: {}. Trying next host.'.format(host.name, response))
                 continue
 
-            t = 0
-            while t < self.TIMEOUT * 60:
-                time.sleep(1)
-                t += 1
-                episodeID = self._getEpisodeID(self._getTVShowID(showDirectory), episodePath)
-                if episodeID:
-                    host.scanned = True
-                    self.log.debug('Scan complete. EpisodeID: {} Took {}s'.format(episodeID, t))
-                    return episodeID
-            self.log.warning('Host: {} Timed out after {}s while scanning entire library. Trying next host.'.format(host.name, t/10))
-
-    # Main method used to update / add new episode / tvshow
-    def updateTVShow(self, episodePath, showDirectory):
+            poller = self._poller(host, cursor, name, policy, itemMatcher('episode'))
+            visible = poller.poll(self._fresh(resolve))
+            self.metrics.recordScan(host.name, name, time.time() - started, visible)
+            if visible:
+                host.scanned = True
+                self.log.debug('Scan complete. EpisodeIDs: {} {}'.format([episodeID for pathIDs in found.values() for episodeID in pathIDs], poller))
+                return found
+            if poller.cancelled:
+                return found
+            self.log.warning('Host: {} Timed out after {:.1f}s ({} attempts) while {}. Found {} of {} episodes. Trying next host.'.format(host.name, poller.elapsed, poller.attempts, description, len(found), len(episodes)))
+        return found
+
+    def _scanTVShowDirectory(self, showDirectory, episodes):
+        # Scan tvshow directory once and return {path: [episodeIDs]} of the given episodes
+        self.log.debug('Scanning show directory {}'.format(showDirectory))
+        return self._scanForEpisodes(showDirectory, episodes, {'directory': showDirectory}, 'Directory scan', self.POLL_DIRECTORY_SCAN, 'scanning show directory')
+
+    def _scanNewTVShow(self, showDirectory, episodes):
+        # Scan for a show new to the library as narrowly as possible and return {path: [episodeIDs]} of the given episodes.
+        # The show folder itself when its source's content settings allow, then the video source holding it,
+        # the entire library only as last resort.
+        found = {}
+        def missing():
+            return [item for item in episodes if not item['path'] in found]
+
+        if self._folderScanAllowed(showDirectory, 'tvshows'):
+            self.log.debug('Scanning new Tv Show directory {}'.format(showDirectory))
+            found.update(self._scanForEpisodes(showDirectory, missing(), {'directory': showDirectory}, 'New show scan', self.POLL_NEW_SHOW_SCAN, 'scanning new show directory'))
+        if not missing() or self.cancel.is_set():
+            return found
+
+        source = self._getSource(showDirectory)
+        if source:
+            self.log.info('Scanning video source {} for new Tv Show {}'.format(source, showDirectory))
+            found.update(self._scanForEpisodes(showDirectory, missing(), {'directory': source}, 'Source scan', self.POLL_SOURCE_SCAN, 'scanning video source'))
+            if not missing() or self.cancel.is_set():
+                return found
+
+        self.log.warning('Scanning entire library for new Tv Show {}. This may take a while.'.format(showDirectory))
+        found.update(self._scanForEpisodes(showDirectory, missing(), {}, 'Library scan', self.POLL_LIBRARY_SCAN, 'scanning entire library'))
+        return found
+
+    # Main method used to update / add new episode / tvshow, episodes lists every number of a multi-episode file
+    def updateTVShow(self, episodePath, showDirectory, season=None, episode=None, episodes=None):
+        return episodePath in self.updateTVShowEpisodes(showDirectory, [{'path': episodePath, 'season': season, 'episode': episode, 'episodes': episodes}])
+
+    # Update / add several episode files of one show (e.g. a season pack) with a single scan.
+    # episodes: [{'path', 'season', 'episode', 'episodes' (optional, all numbers of a multi-episode file)}]
+    # Returns {path: [episodeIDs]} of the files found in the library, files missing from it are not updated.
+    def updateTVShowEpisodes(self, showDirectory, episodes):
+        self._traceCall('updateTVShowEpisodes', [showDirectory, episodes], showDirectory)
+        self._beginEvent()
+        if not self._canUpdate():
+            return {}
         showID = self._getTVShowID(showDirectory)
-        episodeID = self._getEpisodeID(showID, episodePath)
 
-        # Refresh or add this episode to the library
-        if episodeID:
-            # Episode and show exists. Refresh episode. Return updated episodeID.
-            episodeID = self._refreshEpisode(episodeID, episodePath)
-            notificationStr = 'Updated Episode '
-        elif showID:
-            # Show exists but not episode. Scaning show directory for new content. Return new episodeID.
-            episodeID = self._scanTVShowDirectory(showDirectory, episodePath)
-            notificationStr = 'Added Episode '
+        # Episodes already in the library are removed and their watched states kept for later,
+        # together with states an interrupted earlier update of this show could not write back
+        snapshotKey = 'tvshow:' + directoryKey(showDirectory)
+        watchedStates = self.snapshots.load(snapshotKey)
+        existing = self._getEpisodeIDs(showID, episodes)
+        if existing:
+            self.metrics.enterPhase('remove')
+            seasons = {int(item['season']) if self._isNumber(item['season']) else None for item in episodes}
+            season = seasons.pop() if len(seasons) == 1 else None
+            # a single file only needs the rows of its own episode numbers
+            numbers = self._episodeNumbers(episodes[0]) if len(episodes) == 1 else None
+            watchedStates = self._removeForRefresh(snapshotKey, showID, existing, season, watchedStates, numbers)
+
+        # Refresh or add these episodes with one scan
+        self.metrics.enterPhase('scan')
+        if showID:
+            # Show exists. Scanning show directory for new and refreshed content.
+            found = self._scanTVShowDirectory(showDirectory, episodes)
+            notificationStr = 'Updated Episode{}' if existing else 'Added Episode{}'
         else:
-            # Neither show nor episode exist. Preform full library scan. Return new episodeID.
-            episodeID = self._scanNewTVShow(showDirectory, episodePath)
-            notificationStr = 'Added TV Show '
-
-        # Toggle watched state of this new/updated episode
-        self._toggleEpisodeWatchedState(episodeID)
+            # Show does not exist. Scan its folder, its source or the library.
+            found = self._scanNewTVShow(showDirectory, episodes)
+            notificationStr = 'Added TV Show'
+
+        if not found:
+            self.log.warning('Failed to find any of {} episodes in "{}" after scanning.'.format(len(episodes), showDirectory))
+            return {}
+        missing = [item['path'] for item in episodes if not item['path'] in found]
+        if missing:
+            self.log.warning('Failed to find {} of {} episodes in "{}" after scanning: {}'.format(len(missing), len(episodes), showDirectory, missing))
+
+        # Set previously collected watched states of refreshed episodes, every episode of a multi-episode file has its own
+        self.metrics.enterPhase('restore')
+        foundIDs = [episodeID for pathIDs in found.values() for episodeID in pathIDs]
+        details = self._getEpisodeDetailsBatch(foundIDs)
+        if watchedStates:
+            self._restoreEpisodeWatchedStates(snapshotKey, watchedStates, details)
+
+        # Toggle watched state of these new/updated episodes
+        self.metrics.enterPhase('toggle')
+        self._toggleEpisodeWatchedStates(foundIDs)
 
         # Send notifications
-        episodeDetails = self._getEpisodeDetails(episodeID)
-        notificationStr += '"{}" S{}E{} "{}"'.format(episodeDetails['showtitle'], episodeDetails['season'], episodeDetails['episode'], episodeDetails['label'])
-        for host in self.hosts:
-            if host.show_notifications:
-                self.log.info('Sending notification to {}. Message: "{}"'.format(host.name, notificationStr))
-                host.notify(notificationStr, 'Sonarr')
+        self.metrics.enterPhase('notify')
+        details = sorted(details.values(), key=lambda ep: (ep['season'], ep['episode']))
+        if len(details) == 1:
+            notificationStr = notificationStr.format('') + ' "{}" S{}E{} "{}"'.format(details[0]['showtitle'], details[0]['season'], details[0]['episode'], details[0]['label'])
+        elif details:
+            notificationStr = notificationStr.format('s') + ' "{}" {}'.format(details[0]['showtitle'], ', '.join('S{}E{}'.format(ep['season'], ep['episode']) for ep in details))
+        self._notify(notificationStr, 'Sonarr')
+        return found
 
     ########################  Movie methods  #######################
 
-    def _getMovieID(self, title, path):
-        if not title or not path:
-            return
-
-        params = {
-            'filter': {'operator': 'is', 'field': 'title', 'value': title},
-            'properties': ['file']
-            }
-        for host in self.hosts:
-            try:
-                response = host.VideoLibrary.GetMovies(params)
-            except (ReceivedErrorResponse, ReceivedNoResponse) as e:
-                self.log.warning('Host: {} Failed to get movieid for {}. Error: {}'.format(host.name, title, e))
-                response = None
-
-            if response and 'movies' in response:
-                # if more than one movie was found parse through and pick one based on path ignoring extension
-                for movie in response['movies']:
-                    if os.path.splitext(movie['file'])[0] == os.path.splitext(path)[0]:
-                        return movie['movieid']
+    def _titleKey(self, title):
+        # Radarr and Kodi titles differ in case, punctuation and a trailing year
+        return re.sub(r'[^a-z0-9]', '', re.sub(r'\(\d{4}\)\s*$', '', (title or '').lower()))
+
+    def _pickMovie(self, movies, title, path, movieDirectory):
+        # the movie stored at path (ignoring extension). Failing that, the movie in movieDirectory as an upgrade
+        # replaces the file. The title only breaks ties between several movies sharing the directory.
+        matches = [movie for movie in movies if os.path.splitext(movie['file'])[0] == os.path.splitext(path)[0]]
+        if not matches:
+            matches = [movie for movie in movies if directoryKey(os.path.dirname(movie['file'])) == movieDirectory]
+        if len(matches) > 1:
+            matches = [movie for movie in matches if self._titleKey(movie['label']) == self._titleKey(title)] or matches
+        if len(set(movie['movieid'] for movie in matches)) == 1:
+            return matches[0]['movieid']
         return None
 
+    def _getMovieID(self, title, path, movieDirectory=None):
+        # returns movieid of the movie stored at path, looked up by file and directory, never by title alone
+        if not path:
+            return None
+        movieDirectory = directoryKey(movieDirectory or os.path.dirname(path))
+
+        # Check the local index first, re-validating stale entries with one batched details call
+        entries = self.index.getMovies(path)
+        for entry in entries:
+            if not entry['stale']:
+                return entry['movieid']
+        stale = self._getMovieDetailsBatch([entry['movieid'] for entry in entries])
+        for entry in entries:
+            details = stale.get(entry['movieid'])
+            if details and os.path.splitext(details['file'])[0] == os.path.splitext(path)[0]:
+                self.index.addMovies([details])
+                return entry['movieid']
+            self.index.removeMovie(entry['movieid'])
+
+        # An upgrade replaces the file, a single fresh entry for its directory is the movie
+        entries = self.index.getMoviesInDirectory(movieDirectory)
+        if len(entries) == 1 and not entries[0]['stale']:
+            return entries[0]['movieid']
+
+        # Unknown file, list the movies of its directory
+        movies = self._getDirectoryMovies(movieDirectory)
+        self.index.addMovies(movies)
+        return self._pickMovie(movies, title, path, movieDirectory)
+
+    def _getDirectoryMovies(self, movieDirectory):
+        # returns list of movies stored in movieDirectory
+        movieDirectory = directoryKey(movieDirectory)
+        movies = self._sqlLookup('movies', directory=movieDirectory)
+        if movies is not None:
+            return movies
+        return list(self._iterMovies(filter={'operator': 'startswith', 'field': 'path', 'value': movieDirectory}, description='movies in {}'.format(movieDirectory)))
+
+    def _iterMovies(self, properties=None, filter=None, description='movie list'): # pylint: disable=redefined-builtin
+        # yields the movies in the library (matching filter) page by page
+        params = {'properties': properties or ['file']}
+        if filter:
+            params['filter'] = filter
+        return self._iterList('VideoLibrary.GetMovies', 'movies', params, description)
+
     def _getMovieDetails(self, movieID):
         if not movieID:
             return None
+        return self._cachedDetails('movieid', [movieID], self._readMovieDetails).get(int(movieID))
+
+    def _readMovieDetails(self, movieIDs):
+        movieID = movieIDs[0]
+        details = self._sqlLookup('movieDetails', [movieID])
+        if details is not None:
+            return details
 
         params = {
-            'movieid': int(movieID),
-            'properties': ['file', 'lastplayed', 'playcount', 'year', 'dateadded']
+            'movieid': movieID,
+            'properties': self.MOVIE_DETAIL_PROPERTIES
         }
 
         for host in self.hosts:
@@ -435,128 +1195,146 @@ class Librarian():
                 response = None
 
             if response and 'moviedetails' in response:
-                return response['moviedetails']
-        return None
-
-    def _getMovieIDs(self, title):
-        if not title:
-            return []
-
-        params = {
-            'properties': ['file', 'lastplayed', 'playcount', 'year'],
-            'filter': {'operator': 'is', 'field': 'title', 'value': title}
-        }
-
-        for host in self.hosts:
-            try:
-                response = host.VideoLibrary.GetMovies(params)
-            except (ReceivedErrorResponse, ReceivedNoResponse) as e:
-                self.log.warning('Host: {} Failed to get Movie list matching {} Error: {}'.format(host.name, title, e))
-                return []
-
-        if response and 'movies' in response:
-            return response['movies']
-
-    def _removeMovie(self, movieID):
-        self.log.debug('Removing movieID: {}'.format(movieID))
-        params = {
-            'movieid': movieID
-        }
-        for host in self.hosts:
-            try:
-                response = host.VideoLibrary.RemoveMovie(params)
-            except (ReceivedErrorResponse, ReceivedNoResponse) as e:
-                response = None
-
-            if not response == 'OK':
-                self.log.warning('Host: {} Failed to remove movieID: {} Error: {}'.format(host.name, movieID, e))
-                continue
-
+                return {movieID: response['moviedetails']}
+        return {}
+
+    def _getMovieDetailsBatch(self, movieIDs):
+        # returns {movieid: details} for several movies in one round-trip
+        return self._cachedDetails('movieid', movieIDs, self._readMovieDetailsBatch)
+
+    def _readMovieDetailsBatch(self, movieIDs):
+        details = self._sqlLookup('movieDetails', movieIDs)
+        if details is not None:
+            return details
+        return self._getDetailsBatch('VideoLibrary.GetMovieDetails', 'movieid', 'moviedetails', movieIDs, self.MOVIE_DETAIL_PROPERTIES)
+
+    def _removeMovies(self, movieIDs):
+        # Remove given movies in one batch and return true if all were removed
+        pending = [('VideoLibrary.RemoveMovie', {'movieid': mID}) for mID in movieIDs]
+        if not pending:
             return True
+        self.log.debug('Removing movieIDs: {}'.format(list(movieIDs)))
+        for host in self.hosts:
+            failed = self._batchWrite(host, pending, 'remove movie')
+            for call in pending:
+                if not call in failed:
+                    self.index.removeMovie(call[1]['movieid'])
+            pending = failed
+            if not pending:
+                return True
+        return False
 
-    def _refreshMovie(self, movieID, movieDirectory):
+    def _refreshMovie(self, movieID, movieDirectory, moviePath):
         # Save watched state of movie currently in library
         # Remove movie currently in library
-        # Rescan that directory
+        # Rescan that directory for the new file at moviePath
         # Set watched state of new movie to previously recorded value
         # return the new movie id
         self.log.info('Refreshing movieID: {}'.format(movieID))
 
-        # Save watched state and movie details of movie currently in library
-        movieDetails = self._getMovieDetails(movieID)
-        watchedState = self._getMovieWatchedState(movieDetails=movieDetails)
-        
-        # Get all movies matching title and directory
-        movieIDs = [movie['movieid'] for movie in self._getMovieIDs(movieDetails['label']) if movieDirectory in movie['file']]
+        # Save watched state and movie details of movie currently in library, read past the cache as it may be stale
+        with self.cache.bypass():
+            movieDetails = self._getMovieDetails(movieID)
+        if not movieDetails:
+            # the index pointed at a movie that is gone, forget it so a retry scans it as new
+            self.log.warning('MovieID: {} is no longer in the library.'.format(movieID))
+            self.index.removeMovie(movieID)
+            return None
+
+        # A state left behind by an interrupted refresh of this movie wins, nothing is removed before it is on disk
+        snapshotKey = 'movie:' + directoryKey(movieDirectory)
+        if not self.snapshots.load(snapshotKey):
+            watchedState = self._getMovieWatchedState(movieDetails=movieDetails)
+            if not self.snapshots.save(snapshotKey, {'movie': {k: v for k, v in watchedState.items() if not k == 'movieid'}}):
+                self.log.warning('Could not save watched state of movieID: {}. Not removing it for a refresh.'.format(movieID))
+                return None
+
+        # Get every instance of this movie in its directory, the refreshed one and any with the same title
+        movieIDs = [movie['movieid'] for movie in self._getDirectoryMovies(movieDirectory)
+                    if movie['movieid'] == movieID or self._titleKey(movie['label']) == self._titleKey(movieDetails['label'])]
+        if not movieID in movieIDs:
+            movieIDs.append(movieID)
 
         # Remove movie in the library (could be more than one instance of the same movie)
-        for mID in movieIDs:
-            self._removeMovie(mID)
+        self.metrics.enterPhase('remove')
+        self._removeMovies(movieIDs)
 
         # Rescan directory
-        newMovieID = self._scanNewMovie(movieDetails['label'], movieDirectory, movieDetails['file'])
+        newMovieID = self._scanNewMovie(movieDetails['label'], movieDirectory, moviePath)
+        if not newMovieID:
+            return None
 
         # Set watched state
-        watchedState['movieid'] = newMovieID
+        self.metrics.enterPhase('restore')
+        self._restoreMovieWatchedState(movieDirectory, newMovieID)
+        return newMovieID
+
+    def _restoreMovieWatchedState(self, movieDirectory, movieID):
+        # write back the snapshot taken before the movie in movieDirectory was removed, if there is one
+        snapshotKey = 'movie:' + directoryKey(movieDirectory)
+        watchedState = self.snapshots.load(snapshotKey).get('movie')
+        if not watchedState:
+            return
+        watchedState = dict(watchedState, movieid=movieID)
         for host in self.hosts:
             if self._setMovieWatchedState(host, watchedState):
-                return newMovieID
-        
-        return None
+                self.snapshots.discard(snapshotKey)
+                return
+        self.log.warning('Failed to restore watched state of movieID: {}. Keeping it for the next update.'.format(movieID))
 
-    def _scanNewMovie(self, title, movieDirectory, moviePath):
-        self.log.debug('Initiating directory scan for new movie. directory: "{}"'.format(movieDirectory))
-        if not movieDirectory.endswith('/'):
-            movieDirectory += '/'
+    def _scanForMovie(self, title, movieDirectory, moviePath, params, name, policy, description):
+        # Run one scan and poll until the movie at moviePath is in the library. Returns movieID
+        busy = self._busyHosts()
         for host in self.hosts:
-            if not self.update_while_playing and host.inUse:
+            if host in busy:
                 self.log.info('{} is currently playing a video. Skipping update.'.format(host.name))
                 continue
+            cursor = host.eventCursor
+            started = time.time()
+            self._wrote('VideoLibrary.Scan', params)
             try:
-                response = host.VideoLibrary.Scan(directory=movieDirectory)
+                response = host.VideoLibrary.Scan(**params) # pylint: disable=no-member
             except (ReceivedErrorResponse, ReceivedNoResponse):
-                pass
+                response = None
 
             if not response == 'OK':
                 self.log.warning('Incorrect response received from Host: {} Response: {}. Trying next host.'.format(host.name, response))
                 continue
 
-            t = 0
-            while t < self.TIMEOUT * 10:
-                time.sleep(0.1)
-                t += 1
-                movieID = self._getMovieID(title, moviePath)
-                if movieID:
-                    self.log.debug('Directroy Scan complete. New movieID: {} Took {}s'.format(movieID, t/10))
-                    host.scanned = True
-                    return movieID
-            self.log.warning('Host: {} Timed out after {}s while scanning new movie. Trying next host.'.format(host.name, t/10))
-        
-        self.log.warning('All hosts failed to scan by directory. Initiating full library scan.')
-        for host in self.hosts:
-            if not self.update_while_playing and host.inUse:
-                self.log.info('{} is currently playing a video. Skipping update.'.format(host.name))
-                continue
-            try:
-                response = host.VideoLibrary.Scan()
-            except (ReceivedErrorResponse, ReceivedNoResponse):
-                pass
+            poller = self._poller(host, cursor, name, policy, itemMatcher('movie'))
+            movieID = poller.poll(self._fresh(lambda: self._getMovieID(title, moviePath, movieDirectory)))
+            self.metrics.recordScan(host.name, name, time.time() - started, bool(movieID))
+            if movieID:
+                self.log.debug('{} complete. New movieID: {} {}'.format(name, movieID, poller))
+                host.scanned = True
+                return movieID
+            if poller.cancelled:
+                return None
+            self.log.warning('Host: {} Timed out after {:.1f}s ({} attempts) while {}. Trying next host.'.format(host.name, poller.elapsed, poller.attempts, description))
+        return None
 
-            if not response == 'OK':
-                self.log.warning('Incorrect response received from Host: {} Response: {}. Trying next host.'.format(host.name, response))
-                continue
+    def _scanNewMovie(self, title, movieDirectory, moviePath):
+        # Scan the movie directory, then the video source holding it, the entire library only as last resort
+        self.metrics.enterPhase('scan')
+        self.log.debug('Initiating directory scan for new movie. directory: "{}"'.format(movieDirectory))
+        if not movieDirectory.endswith('/'):
+            movieDirectory += '/'
+        movieID = self._scanForMovie(title, movieDirectory, moviePath, {'directory': movieDirectory}, 'Directory scan', self.POLL_DIRECTORY_SCAN, 'scanning new movie')
+        if movieID or self.cancel.is_set():
+            return movieID
+
+        source = self._getSource(movieDirectory)
+        if source and not source == movieDirectory:
+            self.log.warning('All hosts failed to scan by directory. Scanning video source {}.'.format(source))
+            movieID = self._scanForMovie(title, movieDirectory, moviePath, {'directory': source}, 'Source scan', self.POLL_SOURCE_SCAN, 'scanning video source')
+            if movieID or self.cancel.is_set():
+                return movieID
 
-            t = 0
-            while t < self.TIMEOUT * 60:
-                time.sleep(1)
-                t += 1
-                movieID = self._getMovieID(title, moviePath)
-                if movieID:
-                    self.log.debug('Full scan complete. New movieID: {} Took {}s'.format(movieID, t))
-                    host.scanned = True
-                    return movieID
-            self.log.warning('Host: {} Timed out after {}s while scanning new movie. Trying next host.'.format(host.name, t))
-        self.log.warning('All hosts failed to scan "{}" {}. Aborting.'.format(title, moviePath))
+        self.log.warning('All hosts failed to scan by directory. Initiating full library scan.')
+        movieID = self._scanForMovie(title, movieDirectory, moviePath, {}, 'Library scan', self.POLL_LIBRARY_SCAN, 'scanning entire library')
+        if not movieID:
+            self.log.warning('All hosts failed to scan "{}" {}. Aborting.'.format(title, moviePath))
+        return movieID
 
     def _getMovieWatchedState(self, movieID=None, movieDetails=None):
         if movieID:
@@ -565,6 +1343,9 @@ class Librarian():
             details = movieDetails
         else:
             return None
+        if not details:
+            # dropped or failed lookup
+            return None
         
         return {k:v for k, v in details.items() if k in ['playcount', 'lastplayed', 'movieid', 'dateadded']}
 
@@ -572,8 +1353,12 @@ class Librarian():
         if not watchedState:
             return None
 
-        # Get what is currently in the library
-        oldWatchedState = self._getMovieWatchedState(watchedState['movieid'])
+        # Get what is currently in the library, a cached state may be stale
+        with self.cache.bypass():
+            oldWatchedState = self._getMovieWatchedState(watchedState['movieid'])
+        if oldWatchedState is None:
+            self.log.warning('Host: {} Could not get details of movieID: {}. Skipping watched state.'.format(host.name, watchedState['movieid']))
+            return False
 
         # Check if we need to set watched state
         if oldWatchedState == watchedState:
@@ -582,53 +1367,74 @@ class Librarian():
         self.log.debug('Setting movie watched state to {} Host: {}'.format(watchedState, host.name))
 
         # Initiate the changes
+        cursor = host.eventCursor
+        self._wrote('VideoLibrary.SetMovieDetails', watchedState)
         try:
             response = host.VideoLibrary.SetMovieDetails(watchedState) # pylint: disable=no-member
         except (ReceivedErrorResponse, ReceivedNoResponse) as e:
             self.log.warning('Failed to set watched state watchedState: {} Error: {}'.format(watchedState, e))
+            response = None
 
         if not response == 'OK':
             self.log.warning('Incorrect response received from Host: {} Response: {}.'.format(host.name, response))
-            return
+            return False
 
-        t = 0
-        while t < self.TIMEOUT * 10:
-            time.sleep(0.1)
-            t += 1
+        poller = self._poller(host, cursor, 'Setting movie watched state', self.POLL_WATCHED_STATE, itemMatcher('movie', watchedState['movieid']))
+        def stateChanged():
             newWatchedState = self._getMovieWatchedState(watchedState['movieid'])
-            if newWatchedState and not oldWatchedState == newWatchedState:
-                self.log.debug('Setting watched state complete. Took {}s'.format(t/10))
-                return
-        self.log.warning('Host: {} Timed out after {}s while setting movie watched state.'.format(host.name, t/10))
+            return newWatchedState and not oldWatchedState == newWatchedState
+        if poller.poll(self._fresh(stateChanged)):
+            self.log.debug('Setting watched state complete. {}'.format(poller))
+            return True
+        self.log.warning('Host: {} Timed out after {:.1f}s ({} attempts) while setting movie watched state.'.format(host.name, poller.elapsed, poller.attempts))
+        return False
 
     def _toggleMovieWatchedState(self, movieID):
         watchedState = self._getMovieWatchedState(movieID)
+        if watchedState is None:
+            self.log.warning('Could not get details of movieID: {}. Skipping watched state toggle.'.format(movieID))
+            return
         newWatchedState = self._modifyWatchedState(watchedState)
 
-        for host in self.hosts:
-            if not host.scanned:
-                self.log.info('Toggling watched state on host: {}'.format(host.name))
-                self._setMovieWatchedState(host, newWatchedState)
-                self._setMovieWatchedState(host, watchedState)
+        def toggle(host):
+            self.log.info('Toggling watched state on host: {}'.format(host.name))
+            self._toggleWatchedState(host, 'VideoLibrary.SetMovieDetails', newWatchedState, watchedState)
+        self.fanout.run(toggle, [host for host in self.hosts if not host.scanned])
 
     # Main method used to update / add new movie
     def updateMovie(self, title, movieDirectory, moviePath):
-        movieID = self._getMovieID(title, moviePath)
+        self._traceCall('updateMovie', [title, movieDirectory, moviePath], movieDirectory)
+        self._beginEvent()
+        if not self._canUpdate():
+            return False
+        movieID = self._getMovieID(title, moviePath, movieDirectory)
 
         if not movieID:
             movieID = self._scanNewMovie(title, movieDirectory, moviePath)
             notificationStr = 'Added New Movie '
+            if movieID:
+                # an earlier refresh may have removed this movie and died before restoring its watched state
+                self.metrics.enterPhase('restore')
+                self._restoreMovieWatchedState(movieDirectory, movieID)
         else:
-            movieID = self._refreshMovie(movieID, movieDirectory)
+            movieID = self._refreshMovie(movieID, movieDirectory, moviePath)
             notificationStr = 'Updated Movie '
 
+        if not movieID:
+            self.log.warning('Failed to find "{}" {} after scanning.'.format(title, moviePath))
+            return False
+
         # Toggle watched state on remaining hosts
+        self.metrics.enterPhase('toggle')
         self._toggleMovieWatchedState(movieID)
 
         # Send notifications
+        self.metrics.enterPhase('notify')
         movieDetails = self._getMovieDetails(movieID)
-        notificationStr += '"{}" ({})'.format(movieDetails['label'], movieDetails['year'])
-        for host in self.hosts:
-            if host.show_notifications:
-                self.log.info('Sending notification to {}. Message: "{}"'.format(host.name, notificationStr))
-                host.notify(notificationStr, 'Radarr')
\ No newline at end of file
+        if movieDetails:
+            notificationStr += '"{}" ({})'.format(movieDetails['label'], movieDetails['year'])
+        else:
+            # the movie is updated, only its details could not be read back
+            notificationStr += '"{}"'.format(title)
+        self._notify(notificationStr, 'Radarr')
+        return True
\ No newline at end of file
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import sqlite3
+import threading
+from utils import logger
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tvshows (
+    path TEXT PRIMARY KEY,
+    tvshowid INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tvshows_id ON tvshows (tvshowid);
+CREATE TABLE IF NOT EXISTS episodes (
+    episodeid INTEGER PRIMARY KEY,
+    stem TEXT NOT NULL,
+    tvshowid INTEGER,
+    season INTEGER,
+    episode INTEGER,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS episodes_stem ON episodes (stem);
+CREATE INDEX IF NOT EXISTS episodes_show ON episodes (tvshowid);
+CREATE TABLE IF NOT EXISTS movies (
+    movieid INTEGER PRIMARY KEY,
+    stem TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS movies_stem ON movies (stem);
+'''
+
+def directoryKey(path):
+    # directories are stored the way Kodi reports them, with a trailing slash
+    return path.rstrip('/\\') + '/'
+
+def directoryPattern(directory):
+    # LIKE pattern (escaped with '!') matching everything below directory
+    return directoryKey(directory).replace('!', '!!').replace('%', '!%').replace('_', '!_') + '%'
+
+def fileKey(path):
+    # files are stored without extension so upgrades (avi -> mkv) still match
+    return os.path.splitext(path)[0]
+
+class LibraryIndex():
+    '''
+    Persistent map of show directories, episode files and movie files to
+    their Kodi library IDs. Entries older than ttl seconds are reported as
+    stale so the caller can re-validate them against Kodi.
+    '''
+    log = logger.get_log('LibraryIndex')
+
+    def __init__(self, dbPath=':memory:', ttl=3600):
+        self.path = dbPath
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._conn = None
+
+    @property
+    def db(self):
+        if self._conn is None:
+            try:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                self._conn.executescript(SCHEMA)
+            except sqlite3.Error as e:
+                self.log.warning('Could not open library index {} Error: {}. Using in-memory index.'.format(self.path, e))
+                self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+                self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _execute(self, sql, params=()):
+        with self._lock, self.db:
+            return self.db.execute(sql, params).fetchall()
+
+    def _executemany(self, sql, rows):
+        with self._lock, self.db:
+            self.db.executemany(sql, rows)
+
+    def _isStale(self, updated):
+        return time.time() - updated > self.ttl
+
+    def expire(self, directory=None):
+        # mark every entry (below directory when given) stale, forcing re-validation on next lookup
+        if not directory:
+            self.log.debug('Expiring all library index entries')
+            for table in ['tvshows', 'episodes', 'movies']:
+                self._execute('UPDATE {} SET updated = 0'.format(table))
+            return
+        self.log.debug('Expiring library index entries below {}'.format(directory))
+        for table, column in [('tvshows', 'path'), ('episodes', 'stem'), ('movies', 'stem')]:
+            self._execute("UPDATE {} SET updated = 0 WHERE {} LIKE ? ESCAPE '!'".format(table, column), (directoryPattern(directory),))
+
+    def entries(self, directory):
+        # rows of every entry below directory with their age in seconds in place of the update time, see load()
+        now = time.time()
+        pattern = directoryPattern(directory)
+        return {
+            'tvshows': [[path, showID, now - updated] for path, showID, updated in
+                        self._execute("SELECT path, tvshowid, updated FROM tvshows WHERE path LIKE ? ESCAPE '!'", (pattern,))],
+            'episodes': [list(row[:-1]) + [now - row[-1]] for row in
+                         self._execute("SELECT episodeid, stem, tvshowid, season, episode, updated FROM episodes WHERE stem LIKE ? ESCAPE '!'", (pattern,))],
+            'movies': [[movieID, stem, now - updated] for movieID, stem, updated in
+                       self._execute("SELECT movieid, stem, updated FROM movies WHERE stem LIKE ? ESCAPE '!'", (pattern,))],
+        }
+
+    def load(self, entries):
+        # add rows taken by entries(), as old as they were then
+        now = time.time()
+        self._executemany('INSERT OR REPLACE INTO tvshows (path, tvshowid, updated) VALUES (?, ?, ?)',
+            [(path, showID, now - age) for path, showID, age in entries.get('tvshows', [])])
+        self._executemany('INSERT OR REPLACE INTO episodes (episodeid, stem, tvshowid, season, episode, updated) VALUES (?, ?, ?, ?, ?, ?)',
+            [tuple(row[:-1]) + (now - row[-1],) for row in entries.get('episodes', [])])
+        self._executemany('INSERT OR REPLACE INTO movies (movieid, stem, updated) VALUES (?, ?, ?)',
+            [(movieID, stem, now - age) for movieID, stem, age in entries.get('movies', [])])
+
+    ########################  TV Show entries  #######################
+
+    def getTVShow(self, path):
+        rows = self._execute('SELECT tvshowid, updated FROM tvshows WHERE path = ?', (directoryKey(path),))
+        if not rows:
+            return None
+        return {'tvshowid': rows[0][0], 'stale': self._isStale(rows[0][1])}
+
+    def addTVShow(self, path, tvshowID):
+        self._execute('INSERT OR REPLACE INTO tvshows (path, tvshowid, updated) VALUES (?, ?, ?)', (directoryKey(path), int(tvshowID), time.time()))
+
+    def addTVShows(self, shows):
+        # shows is a list of VideoLibrary.GetTVShows results with 'file' property
+        now = time.time()
+        self._executemany('INSERT OR REPLACE INTO tvshows (path, tvshowid, updated) VALUES (?, ?, ?)',
+            [(directoryKey(show['file']), int(show['tvshowid']), now) for show in shows])
+
+    def removeTVShow(self, tvshowID):
+        self._execute('DELETE FROM tvshows WHERE tvshowid = ?', (int(tvshowID),))
+        self._execute('DELETE FROM episodes WHERE tvshowid = ?', (int(tvshowID),))
+
+    ########################  Episode entries  #######################
+
+    def getEpisodes(self, path):
+        rows = self._execute('SELECT episodeid, tvshowid, season, episode, updated FROM episodes WHERE stem = ? ORDER BY season, episode', (fileKey(path),))
+        return [{
+            'episodeid': row[0],
+            'tvshowid': row[1],
+            'season': row[2],
+            'episode': row[3],
+            'stale': self._isStale(row[4]),
+        } for row in rows]
+
+    def addEpisodes(self, episodes):
+        # episodes is a list of VideoLibrary.GetEpisodes/GetEpisodeDetails results with 'file' property
+        now = time.time()
+        self._executemany('INSERT OR REPLACE INTO episodes (episodeid, stem, tvshowid, season, episode, updated) VALUES (?, ?, ?, ?, ?, ?)',
+            [(int(ep['episodeid']), fileKey(ep['file']), ep.get('tvshowid'), ep.get('season'), ep.get('episode'), now) for ep in episodes])
+
+    def removeEpisode(self, episodeID):
+        self._execute('DELETE FROM episodes WHERE episodeid = ?', (int(episodeID),))
+
+    ########################  Movie entries  #######################
+
+    def getMovies(self, path):
+        rows = self._execute('SELECT movieid, updated FROM movies WHERE stem = ?', (fileKey(path),))
+        return [{'movieid': row[0], 'stale': self._isStale(row[1])} for row in rows]
+
+    def getMoviesInDirectory(self, directory):
+        # entries of every movie file directly inside directory
+        directory = directoryKey(directory)
+        rows = self._execute("SELECT movieid, stem, updated FROM movies WHERE stem LIKE ? ESCAPE '!'", (directoryPattern(directory),))
+        return [{'movieid': row[0], 'stale': self._isStale(row[2])} for row in rows if directoryKey(os.path.dirname(row[1])) == directory]
+
+    def addMovies(self, movies):
+        # movies is a list of VideoLibrary.GetMovies/GetMovieDetails results with 'file' property
+        now = time.time()
+        self._executemany('INSERT OR REPLACE INTO movies (movieid, stem, updated) VALUES (?, ?, ?)',
+            [(int(movie['movieid']), fileKey(movie['file']), now) for movie in movies])
+
+    def removeMovie(self, movieID):
+        self._execute('DELETE FROM movies WHERE movieid = ?', (int(movieID),))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import threading
+from utils import logger
+
+# upper bounds in seconds shared by every histogram, RPCs take milliseconds, library scans minutes
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# name: (type, help)
+METRICS = {
+    'kodi_rpc_duration_seconds': ('histogram', 'JSON-RPC round-trip time by host and method, batches as batch:<first method>'),
+    'kodi_rpc_received_bytes_total': ('counter', 'JSON-RPC response bytes received by host'),
+    'kodi_rpc_errors_total': ('counter', 'JSON-RPC requests that got no response, by reason (timeout or unreachable)'),
+    'kodi_scan_visible_seconds': ('histogram', 'Time from starting a library scan until the new files were found in the library'),
+    'kodi_poll_attempts_total': ('counter', 'Checks made while waiting for a host to finish an operation'),
+    'kodi_poll_duration_seconds': ('histogram', 'Time spent waiting for a host to finish an operation'),
+    'kodi_poll_timeouts_total': ('counter', 'Waits for a host that timed out'),
+    'librarian_phase_duration_seconds': ('histogram', 'Time spent per update phase (lookup, scan, restore, toggle, notify)'),
+    'librarian_events_total': ('counter', 'Library updates by result'),
+}
+
+def formatLabels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in pairs) + '}'
+
+class Metrics():
+    '''
+    Counters and histograms of RPC latency, scans and polls, labelled by
+    host and method, rendered in the Prometheus text format. Between
+    beginEvent() and endEvent() the same measurements are also summed up
+    per event, enterPhase() attributes the time that follows to a phase.
+    Given a textfile path every endEvent() rewrites it for node_exporter's
+    textfile collector.
+    '''
+    log = logger.get_log('Metrics')
+
+    def __init__(self, textfile=None):
+        self.textfile = textfile
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._event = None
+
+    ########################  Registry  #######################
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def render(self):
+        # every metric in the Prometheus text exposition format
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: dict(value, buckets=list(value['buckets'])) for key, value in self._histograms.items()}
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            series = sorted(key for key in (counters if kind == 'counter' else histograms) if key[0] == name)
+            if not series:
+                continue
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for key in series:
+                labels = key[1]
+                if kind == 'counter':
+                    lines.append('{}{} {}'.format(name, formatLabels(labels), counters[key]))
+                    continue
+                histogram = histograms[key]
+                for bound, count in zip(BUCKETS, histogram['buckets']):
+                    lines.append('{}_bucket{} {}'.format(name, formatLabels(labels, [('le', bound)]), count))
+                lines.append('{}_bucket{} {}'.format(name, formatLabels(labels, [('le', '+Inf')]), histogram['count']))
+                lines.append('{}_sum{} {:.6f}'.format(name, formatLabels(labels), histogram['sum']))
+                lines.append('{}_count{} {}'.format(name, formatLabels(labels), histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def writeTextfile(self):
+        if not self.textfile:
+            return
+        temp = self.textfile + '.tmp'
+        try:
+            with open(temp, 'w') as textfile:
+                textfile.write(self.render())
+            os.replace(temp, self.textfile)
+        except IOError as e:
+            self.log.warning('Could not write metrics to {} Error: {}'.format(self.textfile, e))
+
+    ########################  Measurements  #######################
+
+    def recordRPC(self, host, method, seconds, received, error=None):
+        self.observe('kodi_rpc_duration_seconds', seconds, host=host, method=method)
+        if received:
+            self.increment('kodi_rpc_received_bytes_total', received, host=host)
+        if error:
+            self.increment('kodi_rpc_errors_total', host=host, method=method, reason=error)
+        with self._lock:
+            if self._event is not None:
+                event = self._event
+                event['rpcs'] += 1
+                event['received'] += received
+                event['timeouts'] += 1 if error == 'timeout' else 0
+                hostTotals = event['hosts'].setdefault(host, [0, 0])
+                hostTotals[0] += 1
+                hostTotals[1] += seconds
+
+    def recordPoll(self, host, poller):
+        self.increment('kodi_poll_attempts_total', poller.attempts, host=host, poll=poller.name)
+        self.observe('kodi_poll_duration_seconds', poller.elapsed, host=host, poll=poller.name)
+        if poller.timedOut:
+            self.increment('kodi_poll_timeouts_total', host=host, poll=poller.name)
+        with self._lock:
+            if self._event is not None:
+                self._event['polls'] += poller.attempts
+                self._event['timeouts'] += 1 if poller.timedOut else 0
+
+    def recordScan(self, host, scope, seconds, visible):
+        # visible is False when the scan timed out before the files showed up
+        if visible:
+            self.observe('kodi_scan_visible_seconds', seconds, host=host, scope=scope)
+
+    ########################  Events  #######################
+
+    def beginEvent(self):
+        with self._lock:
+            self._event = {'started': time.time(), 'phase': None, 'phaseStarted': None, 'phases': {},
+                           'rpcs': 0, 'received': 0, 'polls': 0, 'timeouts': 0, 'hosts': {}}
+
+    def _closePhase(self, event, now):
+        if event['phase']:
+            elapsed = now - event['phaseStarted']
+            event['phases'][event['phase']] = event['phases'].get(event['phase'], 0) + elapsed
+            self.observe('librarian_phase_duration_seconds', elapsed, phase=event['phase'])
+
+    def enterPhase(self, phase):
+        # the time until the next phase or the end of the event counts towards phase
+        with self._lock:
+            event = self._event
+        if event is None:
+            return
+        now = time.time()
+        self._closePhase(event, now)
+        event['phase'], event['phaseStarted'] = phase, now
+
+    def endEvent(self, updated):
+        # close the event, returns its summary line (None without an event) and rewrites the textfile
+        with self._lock:
+            event, self._event = self._event, None
+        if event is None:
+            return None
+        now = time.time()
+        self._closePhase(event, now)
+        self.increment('librarian_events_total', result='updated' if updated else 'incomplete')
+        self.writeTextfile()
+
+        summary = 'Event took {:.2f}s'.format(now - event['started'])
+        if event['phases']:
+            summary += ' ({})'.format(', '.join('{} {:.2f}s'.format(phase, elapsed) for phase, elapsed in event['phases'].items()))
+        summary += '. {} RPCs, {:.1f} KB received, {} poll checks, {} timeouts.'.format(event['rpcs'], event['received'] / 1024.0, event['polls'], event['timeouts'])
+        if event['hosts']:
+            host, (calls, seconds) = max(event['hosts'].items(), key=lambda item: item[1][1])
+            summary += ' Slowest host: {} {:.2f}s over {} RPCs.'.format(host, seconds, calls)
+        return summary
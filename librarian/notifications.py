@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import codecs
+import socket
+import threading
+from collections import deque
+from utils import logger
+
+LIBRARY_EVENTS = ['VideoLibrary.OnUpdate', 'VideoLibrary.OnScanFinished']
+
+class NotificationListener():
+    '''
+    Reads notifications pushed by Kodi on its raw TCP JSON-RPC port
+    (default 9090) in a background thread. Waiting code takes a cursor
+    before triggering a change and then blocks in wait() until a matching
+    notification newer than that cursor arrives.
+    '''
+    log = logger.get_log('Notifications')
+    MAX_BUFFER = 1000000
+
+    def __init__(self, name, hostname, port=9090, connectTimeout=2):
+        self.name = name
+        self.hostname = hostname
+        self.port = int(port)
+        self.connectTimeout = connectTimeout
+        self._events = deque(maxlen=200)
+        self._cursor = 0
+        self._cond = threading.Condition()
+        self._sock = None
+        self._thread = None
+        self.connected = False
+
+    def start(self):
+        # connect and begin reading, returns True if notifications are available
+        try:
+            self._sock = socket.create_connection((self.hostname, self.port), timeout=self.connectTimeout)
+            self._sock.settimeout(None)
+        except (OSError, socket.timeout) as e:
+            self.log.info('Host: {} Notifications unavailable on port {}. Falling back to polling. Error: {}'.format(self.name, self.port, e))
+            return False
+
+        self.connected = True
+        self._thread = threading.Thread(target=self._run, name='Notifications-{}'.format(self.name), daemon=True)
+        self._thread.start()
+        self.log.debug('Host: {} Listening for notifications on port {}'.format(self.name, self.port))
+        return True
+
+    def stop(self):
+        self.connected = False
+        if self._sock:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder('utf-8')()
+        buffer = ''
+        while self.connected:
+            try:
+                data = self._sock.recv(65536)
+            except OSError:
+                data = b''
+            if not data:
+                break
+
+            # Kodi writes JSON objects back to back without a delimiter
+            buffer += utf8.decode(data)
+            while buffer:
+                buffer = buffer.lstrip()
+                try:
+                    message, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break
+                buffer = buffer[end:]
+                self._dispatch(message)
+
+            if len(buffer) > self.MAX_BUFFER:
+                self.log.warning('Host: {} Discarding unparsable notification data'.format(self.name))
+                buffer = ''
+
+        if self.connected:
+            self.log.warning('Host: {} Notification socket closed. Falling back to polling.'.format(self.name))
+        self.connected = False
+        with self._cond:
+            self._cond.notify_all()
+
+    def _dispatch(self, message):
+        # responses carry an id, notifications do not
+        if not isinstance(message, dict) or 'id' in message or 'method' not in message:
+            return
+        data = message.get('params', {}).get('data')
+        with self._cond:
+            self._cursor += 1
+            self._events.append((self._cursor, message['method'], data))
+            self._cond.notify_all()
+
+    @property
+    def cursor(self):
+        with self._cond:
+            return self._cursor
+
+    def wait(self, cursor, timeout, methods=LIBRARY_EVENTS, match=None):
+        # block until a notification in methods newer than cursor arrives (optionally accepted by match(method, data))
+        # returns (newCursor, (method, data)) or (newCursor, None) on timeout / disconnect
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                for seq, method, data in self._events:
+                    if seq <= cursor:
+                        continue
+                    cursor = seq
+                    if method in methods and (match is None or match(method, data)):
+                        return cursor, (method, data)
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.connected:
+                    return cursor, None
+                self._cond.wait(remaining)
+
+    def waiter(self, cursor, match=None, methods=LIBRARY_EVENTS):
+        # returns a wait(timeout) callable for Poller which keeps its own cursor
+        state = {'cursor': cursor}
+        def wait(timeout):
+            if not self.connected:
+                time.sleep(timeout)
+                return
+            state['cursor'], _ = self.wait(state['cursor'], timeout, methods=methods, match=match)
+        return wait
+
+def itemMatcher(itemType, itemID=None):
+    # match OnUpdate notifications for itemType (optionally a specific id) and any OnScanFinished
+    def match(method, data):
+        if method == 'VideoLibrary.OnScanFinished':
+            return True
+        item = (data or {}).get('item', {})
+        if not item.get('type') == itemType:
+            return False
+        return itemID is None or item.get('id') == itemID
+    return match
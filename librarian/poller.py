@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import time
+import random
+import threading
+
+class Poller():
+    '''
+    Calls check() until it returns something truthy, the deadline passes
+    or the cancel event is set. The delay between attempts starts at
+    interval and grows by backoff (randomised by +/- jitter) up to
+    maxInterval. wait(timeout) replaces the plain sleep when given, e.g.
+    to wake up early on a Kodi notification.
+
+    After poll() returns, attempts, elapsed, timedOut and cancelled
+    describe what happened, observer(poller) is called with them when given.
+    '''
+    def __init__(self, name, timeout, interval=0.1, maxInterval=None, backoff=1.5, jitter=0.1, cancel=None, wait=None, observer=None):
+        self.name = name
+        self.timeout = timeout
+        self.interval = interval
+        self.maxInterval = maxInterval if maxInterval else interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.cancel = cancel if cancel else threading.Event()
+        self.wait = wait if wait else self.cancel.wait
+        self.observer = observer
+        self.attempts = 0
+        self.elapsed = 0
+        self.timedOut = False
+        self.cancelled = False
+
+    def _nextDelay(self, delay):
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return delay
+
+    def poll(self, check):
+        start = time.time()
+        deadline = start + self.timeout
+        delay = self.interval
+        try:
+            while True:
+                if self.cancel.is_set():
+                    self.cancelled = True
+                    return None
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.timedOut = True
+                    return None
+
+                self.wait(min(self._nextDelay(delay), remaining))
+                if self.cancel.is_set():
+                    self.cancelled = True
+                    return None
+
+                self.attempts += 1
+                result = check()
+                if result:
+                    return result
+                delay = min(delay * self.backoff, self.maxInterval)
+        finally:
+            self.elapsed = time.time() - start
+            if self.observer:
+                self.observer(self)
+
+    def __str__(self):
+        return '{} took {:.1f}s over {} attempts'.format(self.name, self.elapsed, self.attempts)
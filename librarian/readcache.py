@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import copy
+import time
+import threading
+from contextlib import contextmanager
+
+class ReadCache():
+    '''
+    Library answers (details and lists) remembered by key so repeated
+    lookups during an update cost no round-trip. Every entry carries tags
+    naming what it was read from, invalidate() drops the entries of the
+    tags a write touched. Entries expire after ttl seconds, with ttl 0 they
+    live until clear(). Empty answers are never kept, reads made inside
+    bypass() always miss but still refresh the cache.
+    '''
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._tags = {}
+        self._local = threading.local()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @contextmanager
+    def bypass(self):
+        # reads of the current thread go to the library until the block ends
+        self._local.bypass = getattr(self._local, 'bypass', 0) + 1
+        try:
+            yield self
+        finally:
+            self._local.bypass -= 1
+
+    def get(self, key):
+        # returns (hit, value), value is a copy the caller may change
+        if getattr(self._local, 'bypass', 0):
+            return False, None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] and entry[0] < time.time():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, copy.deepcopy(entry[1])
+
+    def put(self, key, value, tags=()):
+        if not value:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.time() + self.ttl if self.ttl else 0, copy.deepcopy(value), tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._tags = {}
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import time
+from utils import logger
+from librarian.statefile import JSONStateFile
+
+class WatchedStateSnapshots():
+    '''
+    Watched states (playcount, lastplayed, dateadded) of library items taken
+    before they are removed for a refresh, kept on disk until they have been
+    written back. A run that dies between removal and restore leaves its
+    snapshot behind for the retry to restore. Snapshots older than maxAge
+    seconds are dropped. Without a statePath they only live in memory.
+    '''
+    log = logger.get_log('Snapshots')
+
+    def __init__(self, statePath=None, maxAge=7 * 86400):
+        self.path = statePath
+        self.maxAge = maxAge
+        self._file = JSONStateFile(statePath, 'watched state snapshot')
+
+    def _state(self, write=False):
+        # yields {key: {'saved': time, 'states': {itemKey: watchedState}}}, failing to write it is only logged
+        return self._file.open(write)
+
+    def load(self, key):
+        # {itemKey: watchedState} left behind for key, empty when there is none
+        with self._state() as state:
+            snapshot = state.get(key)
+            if snapshot and time.time() - snapshot['saved'] < self.maxAge:
+                return dict(snapshot['states'])
+        return {}
+
+    def save(self, key, states):
+        # returns False when the snapshot could not be written, nothing may be removed then
+        now = time.time()
+        try:
+            with self._file.open(write=True, strict=True) as state:
+                for old in [old for old, snapshot in state.items() if now - snapshot['saved'] >= self.maxAge]:
+                    del state[old]
+                state[key] = {'saved': now, 'states': states}
+        except IOError:
+            return False
+        return True
+
+    def discard(self, key):
+        with self._state(write=True) as state:
+            state.pop(key, None)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sqlite3
+import threading
+from utils import logger
+
+# Kodi's MyVideos schema, c00 is the title of movies, shows and episodes, c12/c13 season/episode numbers
+TVSHOW_QUERY = '''
+SELECT tvshowlinkpath.idShow, path.strPath, tvshow.c00 FROM tvshowlinkpath
+JOIN path ON path.idPath = tvshowlinkpath.idPath
+LEFT JOIN tvshow ON tvshow.idShow = tvshowlinkpath.idShow
+'''
+
+EPISODE_QUERY = '''
+SELECT episode.idEpisode, episode.idShow, episode.c12, episode.c13, episode.c00, path.strPath, files.strFilename,
+       files.playCount, files.lastPlayed, files.dateAdded, tvshow.c00 FROM episode
+JOIN files ON files.idFile = episode.idFile
+JOIN path ON path.idPath = files.idPath
+LEFT JOIN tvshow ON tvshow.idShow = episode.idShow
+'''
+
+MOVIE_QUERY = '''
+SELECT movie.idMovie, movie.c00, movie.premiered, path.strPath, files.strFilename,
+       files.playCount, files.lastPlayed, files.dateAdded FROM movie
+JOIN files ON files.idFile = movie.idFile
+JOIN path ON path.idPath = files.idPath
+'''
+
+def latestDatabase(names):
+    # newest MyVideos<version> of names, Kodi leaves the databases of older versions behind
+    versions = []
+    for name in names:
+        match = re.match(r'^MyVideos(\d+)(\.db)?$', name)
+        if match:
+            versions.append((int(match.group(1)), name))
+    return max(versions)[1] if versions else None
+
+def likePrefix(value):
+    # LIKE pattern matching everything starting with value
+    return value.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '%'
+
+def toInt(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+class SQLBackend():
+    '''
+    Read-only lookups straight from the video database Kodi shares with
+    other hosts (MySQL/MariaDB) or keeps locally (sqlite). Answers have the
+    shape of the matching JSON-RPC responses. Every method returns None when
+    the database can not be used so callers fall back to JSON-RPC. Writes and
+    scans always go through JSON-RPC.
+    '''
+    log = logger.get_log('SQLBackend')
+
+    def __init__(self, kind='sqlite', path=None, host=None, port=3306, username=None, password=None, database=None):
+        self.kind = kind
+        self.path = path
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.database = database
+        self.disabled = False
+        self._errors = (sqlite3.Error, OSError)
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.kind == 'mysql':
+            import pymysql # optional dependency, only needed for MySQL/MariaDB libraries
+            self._errors = (pymysql.MySQLError, OSError)
+            if not self.database:
+                conn = pymysql.connect(host=self.host, port=self.port, user=self.username, password=self.password, connect_timeout=5)
+                with conn.cursor() as cursor:
+                    cursor.execute("SHOW DATABASES LIKE 'MyVideos%'")
+                    self.database = latestDatabase(row[0] for row in cursor.fetchall())
+                conn.close()
+                if not self.database:
+                    raise pymysql.MySQLError('No MyVideos database on {}'.format(self.host))
+            return pymysql.connect(host=self.host, port=self.port, user=self.username, password=self.password,
+                                   database=self.database, connect_timeout=5, autocommit=True)
+
+        path = self.path
+        if os.path.isdir(path):
+            # Kodi's userdata/Database folder, use the database of the newest Kodi version
+            name = latestDatabase(os.listdir(path))
+            if not name:
+                raise sqlite3.OperationalError('No MyVideos database in {}'.format(path))
+            path = os.path.join(path, name)
+        return sqlite3.connect('file:{}?mode=ro'.format(path), uri=True, timeout=10, check_same_thread=False)
+
+    def _query(self, sql, params=()):
+        # returns list of rows, None when the database is unavailable
+        if self.disabled:
+            return None
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._conn = self._connect()
+                cursor = self._conn.cursor()
+                cursor.execute(sql.replace('?', '%s') if self.kind == 'mysql' else sql, params)
+                rows = cursor.fetchall()
+                cursor.close()
+                return rows
+            except ImportError as e:
+                self.log.error('Direct database lookups need PyMySQL (pip install pymysql). Using JSON-RPC only. Error: {}'.format(e))
+                self.disabled = True
+            except self._errors as e:
+                self.log.warning('Database lookup failed, falling back to JSON-RPC. Error: {}'.format(e))
+                self._close()
+        return None
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception: # pylint: disable=broad-except
+                pass
+        self._conn = None
+
+    def _pathClauses(self, paths):
+        # (where clause, params) matching files by directory and name ignoring extension
+        clauses = []
+        params = []
+        for path in paths:
+            directory, filename = os.path.split(path)
+            clauses.append("(path.strPath = ? AND files.strFilename LIKE ? ESCAPE '!')")
+            params += [directory + '/', likePrefix(os.path.splitext(filename)[0] + '.')]
+        return '(' + ' OR '.join(clauses) + ')', params
+
+    def _sameStem(self, items, paths):
+        # LIKE matched a prefix, keep rows whose file equals one of paths ignoring extension
+        stems = {os.path.splitext(path)[0] for path in paths}
+        return [item for item in items if os.path.splitext(item['file'])[0] in stems]
+
+    def pathContent(self, directory):
+        # content type ('tvshows', 'movies', ...) of the nearest parent of directory with content settings, '' without one
+        parents = []
+        directory = directory.rstrip('/')
+        while directory:
+            parents.append(directory + '/')
+            directory = directory.rpartition('/')[0]
+        if not parents:
+            return ''
+        rows = self._query("SELECT strPath, strContent FROM path WHERE strContent <> '' AND strPath IN ({})".format(', '.join('?' * len(parents))), parents)
+        if rows is None:
+            return None
+        return max(rows, key=lambda row: len(row[0]))[1] if rows else ''
+
+    ########################  TV Shows  #######################
+
+    def _tvShow(self, row):
+        showID, path, title = row
+        return {'tvshowid': showID, 'file': path, 'label': title or ''}
+
+    def tvShows(self, path=None):
+        # list of shows located at path (all shows without one)
+        if path is None:
+            rows = self._query(TVSHOW_QUERY)
+        else:
+            rows = self._query(TVSHOW_QUERY + 'WHERE path.strPath = ?', (path,))
+        return None if rows is None else [self._tvShow(row) for row in rows]
+
+    def tvShowDetails(self, tvshowID):
+        rows = self._query(TVSHOW_QUERY + 'WHERE tvshowlinkpath.idShow = ?', (int(tvshowID),))
+        if rows is None:
+            return None
+        return self._tvShow(rows[0]) if rows else {}
+
+    ########################  Episodes  #######################
+
+    def _episode(self, row):
+        episodeID, showID, season, episode, title, directory, filename, playcount, lastplayed, dateadded, showtitle = row
+        season, episode = toInt(season), toInt(episode)
+        return {
+            'episodeid': episodeID,
+            'tvshowid': showID,
+            'season': season,
+            'episode': episode,
+            'file': directory + filename,
+            'playcount': playcount or 0,
+            'lastplayed': lastplayed or '',
+            'dateadded': dateadded or '',
+            'showtitle': showtitle or '',
+            'label': '{}x{:02d}. {}'.format(season, episode, title or ''),
+        }
+
+    def episodes(self, tvshowID=None, season=None, episode=None, filename=None, paths=None, limit=None):
+        # list of episodes filtered like VideoLibrary.GetEpisodes, paths match ignoring extension
+        clauses = []
+        params = []
+        if tvshowID is not None:
+            clauses.append('episode.idShow = ?')
+            params.append(int(tvshowID))
+        if season is not None:
+            clauses.append('episode.c12 = ?')
+            params.append(str(int(season)))
+        if episode is not None:
+            clauses.append('episode.c13 = ?')
+            params.append(str(int(episode)))
+        if filename:
+            clauses.append("files.strFilename LIKE ? ESCAPE '!'")
+            params.append(likePrefix(filename))
+        if paths:
+            clause, pathParams = self._pathClauses(paths)
+            clauses.append(clause)
+            params += pathParams
+
+        sql = EPISODE_QUERY
+        if clauses:
+            sql += 'WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY episode.idEpisode'
+        if limit:
+            sql += ' LIMIT {}'.format(int(limit))
+
+        rows = self._query(sql, params)
+        if rows is None:
+            return None
+        episodes = [self._episode(row) for row in rows]
+        return self._sameStem(episodes, paths) if paths else episodes
+
+    def episodeDetails(self, episodeIDs):
+        # {episodeid: details}
+        episodeIDs = [int(episodeID) for episodeID in episodeIDs if episodeID]
+        if not episodeIDs:
+            return {}
+        rows = self._query(EPISODE_QUERY + 'WHERE episode.idEpisode IN ({})'.format(', '.join('?' * len(episodeIDs))), episodeIDs)
+        if rows is None:
+            return None
+        return {row[0]: self._episode(row) for row in rows}
+
+    ########################  Movies  #######################
+
+    def _movie(self, row):
+        movieID, title, premiered, directory, filename, playcount, lastplayed, dateadded = row
+        return {
+            'movieid': movieID,
+            'label': title or '',
+            'year': max(toInt((premiered or '')[:4]), 0),
+            'file': directory + filename,
+            'playcount': playcount or 0,
+            'lastplayed': lastplayed or '',
+            'dateadded': dateadded or '',
+        }
+
+    def movies(self, paths=None, title=None, directory=None):
+        # list of movies located at one of paths (ignoring extension), directly inside directory and/or titled title
+        clauses = []
+        params = []
+        if paths:
+            clause, params = self._pathClauses(paths)
+            clauses.append(clause)
+        if directory:
+            clauses.append('path.strPath = ?')
+            params.append(directory.rstrip('/') + '/')
+        if title:
+            clauses.append('movie.c00 = ?')
+            params.append(title)
+
+        sql = MOVIE_QUERY
+        if clauses:
+            sql += 'WHERE ' + ' AND '.join(clauses)
+        rows = self._query(sql + ' ORDER BY movie.idMovie', params)
+        if rows is None:
+            return None
+        movies = [self._movie(row) for row in rows]
+        return self._sameStem(movies, paths) if paths else movies
+
+    def movieDetails(self, movieIDs):
+        # {movieid: details}
+        movieIDs = [int(movieID) for movieID in movieIDs if movieID]
+        if not movieIDs:
+            return {}
+        rows = self._query(MOVIE_QUERY + 'WHERE movie.idMovie IN ({})'.format(', '.join('?' * len(movieIDs))), movieIDs)
+        if rows is None:
+            return None
+        return {row[0]: self._movie(row) for row in rows}
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+from utils import logger
+
+class JSONStateFile():
+    '''
+    A JSON object on disk shared by every process. open() yields it under a
+    shared flock, or an exclusive one with write set, and then writes it back
+    atomically. Failures are logged, strict callers get them raised as
+    IOError. Without a path the object only lives in memory.
+    '''
+    log = logger.get_log('StateFile')
+
+    def __init__(self, path, description='state'):
+        self.path = path
+        self.description = description
+        self._lock = threading.Lock()
+        self._memory = {}
+
+    @contextmanager
+    def open(self, write=False, strict=False):
+        if not self.path:
+            with self._lock:
+                yield self._memory
+            return
+        with self._lock:
+            try:
+                lockFile = open(self.path + '.lock', 'a')
+            except IOError as e:
+                self.log.warning('Could not lock {} at {} Error: {}'.format(self.description, self.path, e))
+                if strict:
+                    raise
+                yield {}
+                return
+            with lockFile:
+                fcntl.flock(lockFile, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+                try:
+                    with open(self.path, 'r') as stateFile:
+                        state = json.load(stateFile)
+                except (IOError, ValueError):
+                    state = {}
+                yield state
+                if write:
+                    temp = self.path + '.tmp'
+                    try:
+                        with open(temp, 'w') as stateFile:
+                            json.dump(state, stateFile)
+                        os.replace(temp, self.path)
+                    except IOError as e:
+                        self.log.warning('Could not write {} to {} Error: {}'.format(self.description, self.path, e))
+                        if strict:
+                            raise
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+from jsonrpcclient.server import Server
+from librarian.transport import BatchMixin, TransportError
+from utils import logger
+
+# Trace files hold one JSON object per line, every line carries the pid of the process that wrote it:
+#   {"session": <time>, "hosts": [names]}                          a Librarian was created
+#   {"call": <method>, "args": [...], "index": {...}}              an update started, with the index entries it could use
+#   {"host": <name>, "at": <seconds into session>, "seconds": <latency>, "error": null|"timeout"|"unreachable",
+#    "request": <JSON-RPC request>, "response": <JSON-RPC response or null>}
+
+def jsonText(text):
+    # text as it can be embedded in a trace line, requests and responses already are JSON
+    if text is None:
+        return 'null'
+    if '\n' in text or '\r' in text:
+        try:
+            return json.dumps(json.loads(text), separators=(',', ':'))
+        except ValueError:
+            pass
+    else:
+        try:
+            json.loads(text)
+            return text
+        except ValueError:
+            pass
+    return json.dumps(text)
+
+def signature(request, params=True):
+    # what identifies a request regardless of its id, batches by their calls in order. Without params only the methods count.
+    calls = request if isinstance(request, list) else [request]
+    return json.dumps([[call.get('method'), call.get('params') if params else None] for call in calls], sort_keys=True)
+
+def acknowledged(response):
+    # True for answers of writes (Set*Details, Remove*, Scan, ...) which are plain 'OK' results
+    items = response if isinstance(response, list) else [response]
+    return bool(items) and all(isinstance(item, dict) and item.get('result') == 'OK' for item in items)
+
+class TraceRecorder():
+    '''
+    Appends every JSON-RPC request and response of a Librarian's hosts, with
+    latencies, to a JSONL trace together with the update calls that caused
+    them. Several processes may record into the same file. TraceReplay
+    plays a trace back.
+    '''
+    log = logger.get_log('TraceRecorder')
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._failed = False
+
+    def _write(self, line):
+        # one O_APPEND write per line keeps lines of concurrent writers whole
+        with self._lock:
+            if self._failed:
+                return
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, (line + '\n').encode('utf-8'))
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                self._failed = True
+                self.log.warning('Could not write trace to {}. Tracing stopped. Error: {}'.format(self.path, e))
+
+    def session(self, hosts):
+        self._write(json.dumps({'pid': self.pid, 'session': self.started, 'hosts': hosts}, separators=(',', ':')))
+
+    def call(self, method, args, index=None):
+        self._write(json.dumps({'pid': self.pid, 'call': method, 'args': args, 'index': index or {}}, separators=(',', ':')))
+
+    def rpc(self, host, request, response, seconds, error=None):
+        # request and response are embedded as they went over the wire
+        self._write('{{"pid":{},"host":{},"at":{:.4f},"seconds":{:.4f},"error":{},"request":{},"response":{}}}'.format(
+            self.pid, json.dumps(host), time.time() - self.started, seconds, json.dumps(error), jsonText(request), jsonText(response)))
+
+class ReplayTransport(BatchMixin, Server):
+    '''
+    Answers a host's requests from its part of a trace. A request gets the
+    next recorded response with the same method and params, repeats the
+    last one when the recording had fewer, and borrows one from elsewhere
+    in the trace as last resort. Writes carry fresh values (the lastplayed
+    of a toggle) and match acknowledged writes by method alone. Recorded
+    latencies are slept divided by speed (0 for no delay). Requests the
+    trace can not answer fail with a JSON-RPC error and are counted in
+    unmatched.
+    '''
+    def __init__(self, name, entries, fallback, speed=1):
+        super().__init__('replay://{}'.format(name))
+        self.name = name
+        self.speed = speed
+        self.connectTimeout = 0
+        self.readTimeout = 0
+        self.served = 0
+        self.unmatched = 0
+        self._fallback = fallback
+        self._pending = defaultdict(list)
+        self._writes = defaultdict(list)
+        self._last = {}
+        for entry in entries:
+            self._pending[signature(entry['request'])].append(entry)
+            if acknowledged(entry['response']):
+                self._writes[signature(entry['request'], params=False)].append(entry)
+        self._used = set()
+        self._lock = threading.Lock()
+
+    def _take(self, entries):
+        # first of entries not replayed yet
+        while entries:
+            entry = entries.pop(0)
+            if not id(entry) in self._used:
+                self._used.add(id(entry))
+                return entry
+        return None
+
+    def _next(self, request):
+        key = signature(request)
+        with self._lock:
+            entry = self._take(self._pending.get(key, []))
+            if entry:
+                self._last[key] = entry
+                return entry
+            return self._last.get(key) or self._take(self._writes.get(signature(request, params=False), [])) or self._fallback.get(key)
+
+    def send_message(self, request):
+        self.log_request(request)
+        started = time.time()
+        parsed = json.loads(request)
+        entry = self._next(parsed)
+        if entry is None:
+            self.unmatched += 1
+            response = self._unmatched(parsed)
+            self._meter(request, started, len(response), response=response)
+            return response
+
+        if self.speed:
+            time.sleep(entry['seconds'] / self.speed)
+        self.served += 1
+        if entry['error']:
+            self._observe(False)
+            self._meter(request, started, error=entry['error'])
+            raise TransportError('replayed {}'.format(entry['error']))
+        response = json.dumps(self._withIDs(parsed, entry['request'], entry['response']))
+        self._observe(True)
+        self._meter(request, started, len(response), response=response)
+        self.log_response(response)
+        return response
+
+    @staticmethod
+    def _withIDs(request, recorded, response):
+        # the recorded response carrying the ids of this request
+        if isinstance(request, dict):
+            return dict(response, id=request.get('id')) if isinstance(response, dict) else response
+        ids = {old.get('id'): new.get('id') for old, new in zip(recorded, request)}
+        if not isinstance(response, list):
+            return response
+        return [dict(item, id=ids.get(item.get('id'))) if isinstance(item, dict) else item for item in response]
+
+    @staticmethod
+    def _unmatched(request):
+        def error(call):
+            return {'jsonrpc': '2.0', 'error': {'code': -32601, 'message': 'Not in trace.'}, 'id': call.get('id')}
+        if isinstance(request, list):
+            return json.dumps([error(call) for call in request])
+        return json.dumps(error(request))
+
+    @property
+    def stats(self):
+        return {'opened': 0, 'reused': self.served}
+
+    def close(self):
+        pass
+
+class TraceReplay():
+    '''
+    A recorded trace split into its update calls. transport(name) serves a
+    host from the requests recorded during the call being replayed, see
+    select().
+    '''
+    def __init__(self, path, speed=1):
+        self.speed = speed
+        self.calls = []
+        self._fallback = {}
+        sessions = {}
+        current = {}
+        with open(path, 'r') as traceFile:
+            for line in traceFile:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a writer died mid line
+                    continue
+                pid = record.get('pid')
+                if 'session' in record:
+                    sessions[pid] = record['hosts']
+                    current.pop(pid, None)
+                elif 'call' in record:
+                    current[pid] = dict(record, hosts=sessions.get(pid, []), rpcs=[])
+                    self.calls.append(current[pid])
+                elif 'host' in record:
+                    self._fallback[signature(record['request'])] = record
+                    if pid in current:
+                        current[pid]['rpcs'].append(record)
+        self._call = self.calls[0] if self.calls else None
+        self.transports = []
+
+    def select(self, number):
+        # replay the number-th recorded call, returns it
+        self._call = self.calls[number]
+        self.transports = []
+        return self._call
+
+    def transport(self, name):
+        entries = [entry for entry in self._call['rpcs'] if entry['host'] == name] if self._call else []
+        transport = ReplayTransport(name, entries, self._fallback, self.speed)
+        self.transports.append(transport)
+        return transport
+
+    def hostList(self):
+        # Config.hosts entries for the hosts of the selected call
+        names = self._call['hosts'] if self._call else []
+        return [{'name': name, 'hostname': 'replay', 'port': 0, 'username': '', 'password': '', 'always_on': True, 'show_notifications': True}
+                for name in names]
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+import re
+import json
+import time
+import socket
+import threading
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException, Timeout
+from jsonrpcclient.rpc import rpc_request
+from jsonrpcclient.server import Server
+from jsonrpcclient.http_server import HTTPServer
+from jsonrpcclient.exceptions import ReceivedNoResponse, ReceivedErrorResponse, ParseResponseError
+
+class TransportError(ReceivedNoResponse):
+    '''
+    Raised when a request could not be delivered or answered in time.
+    Subclasses ReceivedNoResponse so existing handlers treat it the same.
+    '''
+    def __init__(self, reason):
+        super().__init__()
+        self.args = ('No response was received: {}'.format(reason),)
+        self.reason = reason
+
+def requestMethod(request):
+    # method name of a JSON-RPC request string, batches as batch:<method of the first call>
+    match = re.search(r'"method"\s*:\s*"([^"]+)"', request)
+    method = match.group(1) if match else 'unknown'
+    return 'batch:' + method if request.lstrip().startswith('[') else method
+
+class BatchMixin():
+    '''
+    JSON-RPC 2.0 batch support for transports implementing send_message()
+    '''
+    # called with True when the host answered and False when it could not be reached
+    observer = None
+    # called with (method, seconds, bytes received, error) after every request, error is
+    # None, 'timeout' or 'unreachable'
+    meter = None
+    # called with (request, response, seconds, error) after every request, see librarian.trace
+    tracer = None
+
+    def _observe(self, answered):
+        if self.observer:
+            self.observer(answered)
+
+    def _meter(self, request, started, received=0, error=None, response=None):
+        seconds = time.time() - started
+        if self.meter:
+            self.meter(requestMethod(request), seconds, received, error)
+        if self.tracer:
+            self.tracer(request, response, seconds, error)
+
+    def batch(self, calls):
+        # send [(method, params), ...] in one round-trip and return the results in call order.
+        # A call that failed yields its exception (ReceivedErrorResponse / ReceivedNoResponse) instead of a result.
+        if not calls:
+            return []
+        requests = [rpc_request(method, params, response=True) if params else rpc_request(method, response=True) for method, params in calls]
+        response = self.send_message(json.dumps(requests))
+        if not response:
+            raise ReceivedNoResponse()
+        try:
+            responses = json.loads(response)
+        except ValueError:
+            raise ParseResponseError()
+
+        # a single error object means the batch as a whole was rejected
+        if isinstance(responses, dict):
+            error = responses.get('error', {})
+            raise ReceivedErrorResponse(error.get('code'), error.get('message'), error.get('data'))
+
+        byID = {item.get('id'): item for item in responses if isinstance(item, dict)}
+        results = []
+        for request in requests:
+            item = byID.get(request['id'])
+            if item is None:
+                results.append(ReceivedNoResponse())
+            elif 'error' in item:
+                error = item['error']
+                results.append(ReceivedErrorResponse(error.get('code'), error.get('message'), error.get('data')))
+            else:
+                results.append(item.get('result'))
+        return results
+
+class HTTPTransport(BatchMixin, HTTPServer):
+    '''
+    Kodi HTTP JSON-RPC endpoint using one persistent requests session per
+    host, so connections are kept alive and reused between calls, with
+    explicit connect/read timeouts.
+    '''
+    def __init__(self, endpoint, auth=None, connectTimeout=3, readTimeout=30, poolSize=4):
+        super().__init__(endpoint, headers={'content-type': 'application/json'}, auth=auth)
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+        self.session = Session()
+        self.session.auth = auth
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+
+    def send_message(self, request):
+        self.log_request(request, {'http_headers': self.headers})
+        started = time.time()
+        try:
+            response = self.session.post(self.endpoint, data=request, headers=self.headers, timeout=(self.connectTimeout, self.readTimeout))
+        except RequestException as e:
+            self._observe(False)
+            self._meter(request, started, error='timeout' if isinstance(e, Timeout) else 'unreachable')
+            raise TransportError(e)
+        self._observe(True)
+        self._meter(request, started, len(response.content), response=response.text)
+        self.log_response(response.text, {'http_code': response.status_code, 'http_reason': response.reason, 'http_headers': response.headers})
+        return response.text
+
+    @property
+    def stats(self):
+        # urllib3 keeps per pool counters of connections opened and requests made
+        opened = requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            requests += pool.num_requests
+        return {'opened': opened, 'reused': max(0, requests - opened)}
+
+    def close(self):
+        self.session.close()
+
+class TCPTransport(BatchMixin, Server):
+    '''
+    Kodi raw TCP JSON-RPC endpoint (default port 9090). Keeps a small pool
+    of open sockets, skipping notifications Kodi interleaves with responses.
+    '''
+    def __init__(self, hostname, port=9090, connectTimeout=3, readTimeout=30, poolSize=4):
+        super().__init__('tcp://{}:{}'.format(hostname, port))
+        self.address = (hostname, int(port))
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.poolSize = poolSize
+        self._idle = []
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._reused = 0
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                self._reused += 1
+                return self._idle.pop()
+        try:
+            sock = socket.create_connection(self.address, timeout=self.connectTimeout)
+        except OSError as e:
+            self._observe(False)
+            raise TransportError(e)
+        sock.settimeout(self.readTimeout)
+        with self._lock:
+            self._opened += 1
+        return sock
+
+    def _release(self, sock):
+        with self._lock:
+            if len(self._idle) < self.poolSize:
+                self._idle.append(sock)
+                return
+        sock.close()
+
+    def _receive(self, sock, requestID):
+        decoder = json.JSONDecoder()
+        buffer = b''
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                raise TransportError('connection closed by host')
+            buffer += data
+            try:
+                text = buffer.decode('utf-8')
+            except UnicodeDecodeError:
+                continue
+            while text.strip():
+                text = text.lstrip()
+                try:
+                    message, end = decoder.raw_decode(text)
+                except ValueError:
+                    break
+                text = text[end:]
+                if self._isResponse(message, requestID):
+                    return json.dumps(message)
+            buffer = text.encode('utf-8')
+
+    @staticmethod
+    def _isResponse(message, requestID):
+        # a batch answers with a list, single requests with an object carrying our id
+        if isinstance(message, list):
+            return True
+        return isinstance(message, dict) and 'id' in message and message['id'] == requestID
+
+    def send_message(self, request):
+        self.log_request(request)
+        requestID = None
+        parsed = json.loads(request)
+        if isinstance(parsed, dict):
+            requestID = parsed.get('id')
+        started = time.time()
+        try:
+            sock = self._acquire()
+        except TransportError:
+            self._meter(request, started, error='unreachable')
+            raise
+        try:
+            sock.sendall(request.encode('utf-8'))
+            if requestID is None and isinstance(parsed, dict):
+                # notifications get no response
+                self._release(sock)
+                return None
+            response = self._receive(sock, requestID)
+        except (OSError, TransportError) as e:
+            sock.close()
+            self._observe(False)
+            self._meter(request, started, error='timeout' if isinstance(e, socket.timeout) else 'unreachable')
+            if isinstance(e, TransportError):
+                raise
+            raise TransportError(e)
+        self._observe(True)
+        self._meter(request, started, len(response.encode('utf-8')), response=response)
+        self._release(sock)
+        self.log_response(response)
+        return response
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {'opened': self._opened, 'reused': self._reused}
+
+    def close(self):
+        with self._lock:
+            for sock in self._idle:
+                sock.close()
+            self._idle = []
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+'''
+Wall time, JSON-RPC traffic and bytes moved of the main update paths,
+measured against FakeKodi hosts sharing a generated library. Every run
+uses a fresh Librarian with an empty index like a queued worker does.
+
+    python3 -m tools.benchmark --episodes 100000 --movies 5000 --runs 3
+    python3 -m tools.benchmark --scenario upgrade --scan-latency 2 --jitter 0.01
+    python3 -m tools.benchmark --sql --scenario 'episode lookup' --scenario 'movie lookup'
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import logging
+import argparse
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_ROOT)
+
+from tools.fakekodi import FakeLibrary, FakeKodi # pylint: disable=wrong-import-position
+
+# Every scenario takes (library, run) and prepares the disk, returning a function updating a Librarian.
+# run numbers pick different shows and movies so repeated runs never touch the same item twice.
+
+def _show(library, run):
+    shows = sorted(library.shows)
+    return library.shows[shows[run % len(shows)]]
+
+def _episodeFiles(library, show):
+    return sorted(item['file'] for item in library.episodes.values() if item['tvshowid'] == show['tvshowid'])
+
+def newEpisode(library, run):
+    show = _show(library, run)
+    path = '{0}Season 99/{1} - S99E01.mkv'.format(show['file'], show['title'])
+    library.addFile(path, 'episode', show=show['file'], title=show['title'], season=99, episodes=[1])
+    return lambda kodi: kodi.updateTVShow(path, show['file'].rstrip('/'), '99', '1', [1])
+
+def upgradeEpisode(library, run):
+    # the same episode under a new name, its watched state has to survive
+    show = _show(library, run + 1)
+    old = _episodeFiles(library, show)[0]
+    episode = next(item for item in library.episodes.values() if item['file'] == old)
+    episode['playcount'] = 3
+    info = library.disk[old]
+    library.removeFile(old)
+    path = os.path.splitext(old)[0] + ' - 1080p.mkv'
+    library.addFile(path, 'episode', **{key: value for key, value in info.items() if not key == 'type'})
+    return lambda kodi: kodi.updateTVShow(path, show['file'].rstrip('/'), str(info['season']), str(info['episodes'][0]), info['episodes'])
+
+def newShow(library, run):
+    title = 'Benchmark Show {}'.format(run + 1)
+    directory = '/tv/{}/'.format(title)
+    path = '{}Season 1/{} - S01E01.mkv'.format(directory, title)
+    library.addFile(path, 'episode', show=directory, title=title, season=1, episodes=[1])
+    return lambda kodi: kodi.updateTVShow(path, directory.rstrip('/'), '1', '1', [1])
+
+def movieTitleMismatch(library, run):
+    # Radarr knows the movie under another title than Kodi scraped, the file is upgraded
+    movies = sorted(library.movies)
+    movie = library.movies[movies[run % len(movies)]]
+    old = movie['file']
+    info = library.disk[old]
+    library.removeFile(old)
+    path = os.path.splitext(old)[0] + ' 2160p.mkv'
+    library.addFile(path, 'movie', title=info['title'], year=info['year'])
+    directory = os.path.dirname(old)
+    return lambda kodi: kodi.updateMovie('The {} Returns'.format(movie['title']), directory, path)
+
+# (name, hosts, setup)
+SCENARIOS = [
+    ('new show', 1, newShow),
+    ('new episode', 1, newEpisode),
+    ('upgrade', 1, upgradeEpisode),
+    ('movie title mismatch', 1, movieTitleMismatch),
+    ('multi-host', 3, newEpisode),
+]
+
+# Lookups only read the library, with --sql they also run against a MyVideos copy of it through the database backend
+
+def lookupEpisode(library, run):
+    show = _show(library, run)
+    path = _episodeFiles(library, show)[0]
+    items = [item for item in library.episodes.values() if item['file'] == path]
+    expected = sorted(item['episodeid'] for item in items)
+    return lambda kodi: sorted(kodi._getFileEpisodeIDs(kodi._getTVShowID(show['file']), path, str(items[0]['season']), str(items[0]['episode']))) == expected
+
+def lookupMovie(library, run):
+    movies = sorted(library.movies)
+    movie = library.movies[movies[run % len(movies)]]
+    return lambda kodi: kodi._getMovieID(movie['title'], movie['file']) == movie['movieid']
+
+LOOKUPS = [
+    ('episode lookup', 1, lookupEpisode),
+    ('movie lookup', 1, lookupMovie),
+]
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def runScenario(library, hosts, setup, runs, offset, notifications, sql=None):
+    from librarian.librarian import Librarian
+    from librarian.libraryindex import LibraryIndex
+    samples = []
+    for run in range(runs):
+        update = setup(library, offset + run)
+        for host in hosts:
+            host.reset()
+        kodi = Librarian([host.hostConfig('Kodi {}'.format(number + 1)) for number, host in enumerate(hosts)], index=LibraryIndex(),
+                         use_notifications=notifications, sql=sql)
+        start = time.perf_counter()
+        try:
+            updated = update(kodi)
+        except Exception as e: # pylint: disable=broad-except
+            # injected failures may surface as exceptions, the run counts as failed like a queued job would
+            print('{} failed: {!r}'.format(setup.__name__, e), file=sys.stderr)
+            updated = False
+        elapsed = time.perf_counter() - start
+        for client in kodi.clients:
+            if client.listener:
+                client.listener.stop()
+        stats = [host.stats for host in hosts]
+        samples.append({
+            'updated': bool(updated),
+            'seconds': elapsed,
+            'requests': sum(stat['requests'] for stat in stats),
+            'calls': sum(stat['calls'] for stat in stats),
+            'bytes': sum(stat['bytes'] for stat in stats),
+        })
+    return {
+        'ok': all(sample['updated'] for sample in samples),
+        'seconds': median([sample['seconds'] for sample in samples]),
+        'requests': median([sample['requests'] for sample in samples]),
+        'calls': median([sample['calls'] for sample in samples]),
+        'bytes': median([sample['bytes'] for sample in samples]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark library updates against fake Kodi hosts')
+    parser.add_argument('--episodes', type=int, default=10000, help='episodes in the generated library')
+    parser.add_argument('--episodes-per-show', type=int, default=50)
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=3, help='runs per scenario, the median is reported')
+    parser.add_argument('--scenario', action='append', help='only run this scenario (repeatable)')
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.002, help='up to this many seconds added at random')
+    parser.add_argument('--scan-latency', type=float, default=0.5, help='seconds until a scan finds new files')
+    parser.add_argument('--error-rate', type=float, default=0, help='chance of a call failing with a JSON-RPC error')
+    parser.add_argument('--drop-rate', type=float, default=0, help='chance of a request getting no response')
+    parser.add_argument('--notifications', action='store_true', help='push library notifications over raw TCP')
+    parser.add_argument('--sql', action='store_true', help='also run the lookups through the database backend on a MyVideos copy of the library')
+    parser.add_argument('--json', action='store_true', help='print one JSON object per scenario')
+    parser.add_argument('--verbose', action='store_true', help='keep the librarian log')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    start = time.perf_counter()
+    library = FakeLibrary().generate(args.episodes, args.episodes_per_show, args.movies)
+    if not args.json:
+        print('Generated {} shows, {} episodes and {} movies in {:.1f}s'.format(len(library.shows), len(library.episodes), len(library.movies), time.perf_counter() - start))
+
+    hosts = [FakeKodi(library, notificationPort=0 if args.notifications else None, latency=args.latency, jitter=args.jitter, scanLatency=args.scan_latency,
+                      errorRate=args.error_rate, dropRate=args.drop_rate, seed=number).start()
+             for number in range(max(count for _, count, _ in LOOKUPS + SCENARIOS))]
+
+    # lookups run first, the update scenarios change the library
+    runs = [(name, hostCount, setup, None) for name, hostCount, setup in LOOKUPS + SCENARIOS]
+    databaseDirectory = None
+    if args.sql:
+        from tools.myvideos import fromLibrary
+        from librarian.sqlbackend import SQLBackend
+        databaseDirectory = tempfile.mkdtemp()
+        fromLibrary(os.path.join(databaseDirectory, 'MyVideos121.db'), library).close()
+        sql = SQLBackend('sqlite', databaseDirectory)
+        runs[len(LOOKUPS):len(LOOKUPS)] = [(name + ' (sql)', hostCount, setup, sql) for name, hostCount, setup in LOOKUPS]
+
+    rows = []
+    for number, (name, hostCount, setup, sql) in enumerate(runs):
+        if args.scenario and not name in args.scenario and not name.replace(' (sql)', '') in args.scenario:
+            continue
+        result = runScenario(library, hosts[:hostCount], setup, args.runs, number * args.runs, args.notifications, sql)
+        result['scenario'] = name
+        if args.json:
+            print(json.dumps(result))
+        rows.append(result)
+
+    for host in hosts:
+        host.stop()
+    if databaseDirectory:
+        shutil.rmtree(databaseDirectory)
+    if args.json:
+        return
+
+    width = max([len(row['scenario']) for row in rows] + [8])
+    print('{}  {:>4}  {:>9}  {:>8}  {:>6}  {:>10}'.format('scenario'.ljust(width), 'ok', 'wall ms', 'requests', 'calls', 'KB moved'))
+    for row in rows:
+        print('{}  {:>4}  {:>9.1f}  {:>8}  {:>6}  {:>10.1f}'.format(row['scenario'].ljust(width), 'yes' if row['ok'] else 'NO', row['seconds'] * 1000,
+                                                               row['requests'], row['calls'], row['bytes'] / 1024.0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+'''
+Offline stand-ins for a Kodi host, used to exercise KodiLibrarian without a
+real Kodi box.
+
+FakeNotificationServer mimics Kodi's raw TCP JSON-RPC port (9090) which
+pushes notifications such as VideoLibrary.OnUpdate to every connected
+client. Point a host's tcpPort at it and call send() to wake up waiting
+Librarian calls.
+
+FakeKodi answers the HTTP JSON-RPC calls KodiLibrarian makes from a
+FakeLibrary, which several FakeKodi hosts may share like a MySQL library.
+Scans pick up the files put on the library's fake disk after a delay.
+Response latency, jitter and failures can be injected, every request is
+counted.
+
+    python3 -m tools.fakekodi --port 9090
+    python3 -m tools.fakekodi --http-port 8080 --port 9090 --episodes 100000 --movies 5000
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class FakeNotificationServer():
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(5)
+        self.host, self.port = self._server.getsockname()
+        self._clients = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._accept, name='FakeNotificationServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self._server.close()
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+
+    def _accept(self):
+        while self.running:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                break
+            with self._lock:
+                self._clients.append(client)
+
+    @property
+    def clients(self):
+        with self._lock:
+            return len(self._clients)
+
+    def send(self, method, data=None):
+        # push a notification to every connected client, written without delimiter like Kodi does
+        message = json.dumps({
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': {'sender': 'xbmc', 'data': data},
+        }).encode('utf-8')
+        with self._lock:
+            for client in list(self._clients):
+                try:
+                    client.sendall(message)
+                except OSError:
+                    self._clients.remove(client)
+
+    def onUpdate(self, itemType, itemID, added=False):
+        data = {'item': {'id': itemID, 'type': itemType}}
+        if added:
+            data['added'] = True
+        self.send('VideoLibrary.OnUpdate', data)
+
+    def onScanFinished(self):
+        self.send('VideoLibrary.OnScanFinished')
+
+class FakeLibrary():
+    '''
+    Video library shared by FakeKodi hosts plus the files on disk a scan can
+    find. generate() fills both with shows of numbered episodes and movies,
+    addFile() puts a new file on disk only.
+    '''
+    def __init__(self, sources=('/tv/', '/movies/')):
+        self.lock = threading.RLock()
+        self.sources = list(sources)
+        self.shows = {}
+        self.episodes = {}
+        self.showEpisodes = {}
+        self.movies = {}
+        # path: {'type': 'episode'|'movie', ...}, in the order files arrived
+        self.disk = {}
+        self._nextID = 0
+
+    def _newID(self):
+        self._nextID += 1
+        return self._nextID
+
+    def generate(self, episodes=1000, episodesPerShow=50, movies=100, episodesPerSeason=10):
+        # shows '/tv/Show 0001/Season 1/Show 0001 - S01E01.mkv' and movies '/movies/Movie 0001 (2000)/Movie 0001 (2000).mkv'
+        for number in range((episodes + episodesPerShow - 1) // episodesPerShow):
+            title = 'Show {:04d}'.format(number + 1)
+            showID = self.addShow(title, '/tv/{}/'.format(title))
+            for index in range(min(episodesPerShow, episodes - number * episodesPerShow)):
+                season, episode = index // episodesPerSeason + 1, index % episodesPerSeason + 1
+                path = '/tv/{0}/Season {1}/{0} - S{1:02d}E{2:02d}.mkv'.format(title, season, episode)
+                self.addFile(path, 'episode', show='/tv/{}/'.format(title), title=title, season=season, episodes=[episode])
+                self.addEpisode(showID, path, season, episode)
+        for number in range(movies):
+            title = 'Movie {:04d}'.format(number + 1)
+            path = '/movies/{0} (2000)/{0} (2000).mkv'.format(title)
+            self.addFile(path, 'movie', title=title, year=2000)
+            self.addMovie(title, path, 2000)
+        return self
+
+    def addFile(self, path, kind, **info):
+        # kind 'episode' needs show (directory), title, season and episodes, 'movie' title and year
+        with self.lock:
+            self.disk[path] = dict(info, type=kind)
+
+    def removeFile(self, path):
+        with self.lock:
+            self.disk.pop(path, None)
+
+    def addShow(self, title, directory):
+        with self.lock:
+            showID = self._newID()
+            self.shows[showID] = {'tvshowid': showID, 'label': title, 'title': title, 'file': directory}
+            self.showEpisodes[showID] = set()
+            return showID
+
+    def addEpisode(self, showID, path, season, episode, playcount=0):
+        with self.lock:
+            episodeID = self._newID()
+            self.episodes[episodeID] = {
+                'episodeid': episodeID, 'tvshowid': showID, 'season': season, 'episode': episode, 'file': path,
+                'label': '{}x{:02d}. Episode {}'.format(season, episode, episode), 'showtitle': self.shows[showID]['title'],
+                'playcount': playcount, 'lastplayed': '', 'dateadded': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            self.showEpisodes[showID].add(episodeID)
+            return episodeID
+
+    def addMovie(self, title, path, year=2000, playcount=0):
+        with self.lock:
+            movieID = self._newID()
+            self.movies[movieID] = {
+                'movieid': movieID, 'label': title, 'title': title, 'year': year, 'file': path,
+                'playcount': playcount, 'lastplayed': '', 'dateadded': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            return movieID
+
+    def removeEpisode(self, episodeID):
+        with self.lock:
+            episode = self.episodes.pop(episodeID)
+            self.showEpisodes[episode['tvshowid']].discard(episodeID)
+
+    def scan(self, directory=None):
+        # add disk files below directory missing from the library, returns [(type, id)] of what was added
+        added = []
+        with self.lock:
+            known = {item['file'] for item in self.episodes.values()} | {item['file'] for item in self.movies.values()}
+            for path, info in list(self.disk.items()):
+                if path in known or directory and not path.startswith(directory):
+                    continue
+                if info['type'] == 'movie':
+                    added.append(('movie', self.addMovie(info['title'], path, info.get('year', 0))))
+                    continue
+                showID = next((show['tvshowid'] for show in self.shows.values() if show['file'] == info['show']), None)
+                if showID is None:
+                    showID = self.addShow(info['title'], info['show'])
+                    added.append(('tvshow', showID))
+                for episode in info['episodes']:
+                    added.append(('episode', self.addEpisode(showID, path, info['season'], episode)))
+        return added
+
+    def clean(self, directory=None):
+        # drop library items whose file left the disk, returns their count
+        with self.lock:
+            gone = [episodeID for episodeID, item in self.episodes.items()
+                    if not item['file'] in self.disk and (not directory or item['file'].startswith(directory))]
+            for episodeID in gone:
+                self.removeEpisode(episodeID)
+            movies = [movieID for movieID, item in self.movies.items()
+                      if not item['file'] in self.disk and (not directory or item['file'].startswith(directory))]
+            for movieID in movies:
+                del self.movies[movieID]
+            return len(gone) + len(movies)
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+def _fieldValue(item, field, kind):
+    if field == 'filename':
+        return os.path.basename(item['file'])
+    if field == 'path':
+        # shows are stored by folder, episodes and movies by the folder holding their file
+        return item['file'] if kind == 'tvshows' else os.path.dirname(item['file']) + '/'
+    return str(item.get(field, ''))
+
+def matches(item, rule, kind):
+    # evaluate a VideoLibrary filter ({'and': [...]}, {'or': [...]} or a field rule) for item
+    if 'and' in rule:
+        return all(matches(item, part, kind) for part in rule['and'])
+    if 'or' in rule:
+        return any(matches(item, part, kind) for part in rule['or'])
+    value, expected = _fieldValue(item, rule['field'], kind).lower(), str(rule['value']).lower()
+    operator = rule['operator']
+    if operator == 'is':
+        return value == expected
+    if operator == 'isnot':
+        return value != expected
+    if operator == 'startswith':
+        return value.startswith(expected)
+    if operator == 'contains':
+        return expected in value
+    raise RPCError(-32602, 'Invalid params. Unsupported operator {}'.format(operator))
+
+def listing(items, params, kind, idKey):
+    # the VideoLibrary.Get<kind> answer for items, filtered, sliced by limits and cut down to the requested properties
+    if 'filter' in params:
+        items = [item for item in items if matches(item, params['filter'], kind)]
+    items = sorted(items, key=lambda item: item[idKey])
+    total = len(items)
+    limits = params.get('limits', {})
+    start, end = limits.get('start', 0), limits.get('end', -1)
+    end = total if end < 0 else min(end, total)
+    answer = {'limits': {'start': start, 'end': end, 'total': total}}
+    if total:
+        answer[kind] = [properties(item, params, idKey) for item in items[start:end]]
+    return answer
+
+def properties(item, params, idKey):
+    answer = {key: item[key] for key in params.get('properties', []) if key in item}
+    answer[idKey] = item[idKey]
+    answer['label'] = item['label']
+    return answer
+
+class FakeKodiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+    def do_POST(self):
+        kodi = self.server.fakeKodi
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            request = json.loads(body.decode('utf-8'))
+        except ValueError:
+            request = None
+        if kodi.drop():
+            # injected failure, the client sees the connection go away without an answer
+            self.close_connection = True
+            return
+        kodi.delay()
+        if isinstance(request, list):
+            response = [kodi.handle(call) for call in request]
+        elif isinstance(request, dict):
+            response = kodi.handle(request)
+        else:
+            response = {'jsonrpc': '2.0', 'error': {'code': -32700, 'message': 'Parse error.'}, 'id': None}
+        data = json.dumps(response).encode('utf-8')
+        kodi.count(request, len(body), len(data))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class FakeKodi():
+    '''
+    One fake Kodi host answering HTTP JSON-RPC from library. latency plus up
+    to jitter seconds delay every response, scans finish scanLatency seconds
+    plus scanPerFile for every file on disk after they were started.
+    errorRate and dropRate are the chances of a call failing with a JSON-RPC
+    error or of a request getting no response at all. With notificationPort
+    a FakeNotificationServer pushes OnUpdate/OnScanFinished like Kodi does.
+    '''
+    def __init__(self, library, port=0, host='127.0.0.1', notificationPort=None, latency=0, jitter=0, scanLatency=0.5, scanPerFile=0,
+                 errorRate=0, dropRate=0, seed=None):
+        self.library = library
+        self.latency = latency
+        self.jitter = jitter
+        self.scanLatency = scanLatency
+        self.scanPerFile = scanPerFile
+        self.errorRate = errorRate
+        self.dropRate = dropRate
+        self.playing = False
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), FakeKodiHandler)
+        self._server.fakeKodi = self
+        self.host, self.port = self._server.server_address
+        self.notifications = FakeNotificationServer(host, notificationPort) if notificationPort is not None else None
+        self.reset()
+
+    def start(self):
+        if self.notifications:
+            self.notifications.start()
+        threading.Thread(target=self._server.serve_forever, name='FakeKodi', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self.notifications:
+            self.notifications.stop()
+
+    def hostConfig(self, name='Fake', **options):
+        # entry of Config.hosts pointing a Librarian at this host
+        host = {'name': name, 'hostname': self.host, 'port': self.port, 'username': 'kodi', 'password': 'kodi',
+                'always_on': True, 'show_notifications': True, 'transport': 'http',
+                'tcp_port': self.notifications.port if self.notifications else 9090}
+        host.update(options)
+        return host
+
+    ########################  Accounting  #######################
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.calls = Counter()
+            self.bytesReceived = 0
+            self.bytesSent = 0
+
+    def count(self, request, received, sent):
+        calls = request if isinstance(request, list) else [request]
+        with self._lock:
+            self.requests += 1
+            self.bytesReceived += received
+            self.bytesSent += sent
+            for call in calls:
+                if isinstance(call, dict):
+                    self.calls[call.get('method')] += 1
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'calls': sum(self.calls.values()), 'bytes': self.bytesReceived + self.bytesSent}
+
+    ########################  Failure injection  #######################
+
+    def _chance(self, rate):
+        if not rate:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def drop(self):
+        return self._chance(self.dropRate)
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                extra = self._random.uniform(0, self.jitter)
+            time.sleep(self.latency + extra)
+
+    ########################  JSON-RPC  #######################
+
+    def handle(self, call):
+        callID = call.get('id')
+        try:
+            if self._chance(self.errorRate):
+                raise RPCError(-32100, 'Failed to execute method.')
+            result = self.dispatch(call.get('method'), call.get('params') or {})
+        except RPCError as e:
+            return {'jsonrpc': '2.0', 'error': {'code': e.code, 'message': e.message}, 'id': callID}
+        except (KeyError, TypeError, ValueError) as e:
+            return {'jsonrpc': '2.0', 'error': {'code': -32602, 'message': 'Invalid params. {}'.format(e)}, 'id': callID}
+        return {'jsonrpc': '2.0', 'result': result, 'id': callID}
+
+    def _item(self, items, itemID):
+        item = items.get(int(itemID))
+        if item is None:
+            raise RPCError(-32602, 'Invalid params.')
+        return item
+
+    def _setDetails(self, items, idKey, itemType, params):
+        with self.library.lock:
+            item = self._item(items, params[idKey])
+            item.update({key: value for key, value in params.items() if not key == idKey})
+        self._notify('VideoLibrary.OnUpdate', {'item': {'id': item[idKey], 'type': itemType}})
+        return 'OK'
+
+    def _notify(self, method, data=None):
+        if self.notifications:
+            self.notifications.send(method, data)
+
+    def _scan(self, directory):
+        def run():
+            with self.library.lock:
+                files = len(self.library.disk)
+            time.sleep(self.scanLatency + self.scanPerFile * files)
+            self._notify('VideoLibrary.OnScanStarted')
+            for itemType, itemID in self.library.scan(directory):
+                self._notify('VideoLibrary.OnUpdate', {'item': {'id': itemID, 'type': itemType}, 'added': True})
+            self._notify('VideoLibrary.OnScanFinished')
+        threading.Thread(target=run, name='FakeKodiScan', daemon=True).start()
+        return 'OK'
+
+    def dispatch(self, method, params):
+        library = self.library
+        name = (method or '').lower()
+        if name == 'jsonrpc.ping':
+            return 'pong'
+        if name == 'player.getactiveplayers':
+            return [{'playerid': 1, 'type': 'video'}] if self.playing else []
+        if name == 'gui.shownotification':
+            return 'OK'
+        if name == 'files.getsources':
+            return {'sources': [{'file': source, 'label': source.strip('/')} for source in library.sources], 'limits': {'start': 0, 'end': len(library.sources), 'total': len(library.sources)}}
+        if name == 'videolibrary.scan':
+            return self._scan(params.get('directory') or None)
+        if name == 'videolibrary.clean':
+            library.clean(params.get('directory') or None)
+            self._notify('VideoLibrary.OnCleanFinished')
+            return 'OK'
+
+        with library.lock:
+            if name == 'videolibrary.gettvshows':
+                return listing(library.shows.values(), params, 'tvshows', 'tvshowid')
+            if name == 'videolibrary.getepisodes':
+                if 'tvshowid' in params:
+                    episodes = [library.episodes[episodeID] for episodeID in library.showEpisodes.get(int(params['tvshowid']), ())]
+                else:
+                    episodes = library.episodes.values()
+                if 'season' in params:
+                    episodes = [item for item in episodes if item['season'] == int(params['season'])]
+                return listing(episodes, params, 'episodes', 'episodeid')
+            if name == 'videolibrary.getmovies':
+                return listing(library.movies.values(), params, 'movies', 'movieid')
+            if name == 'videolibrary.gettvshowdetails':
+                return {'tvshowdetails': properties(self._item(library.shows, params['tvshowid']), params, 'tvshowid')}
+            if name == 'videolibrary.getepisodedetails':
+                return {'episodedetails': properties(self._item(library.episodes, params['episodeid']), params, 'episodeid')}
+            if name == 'videolibrary.getmoviedetails':
+                return {'moviedetails': properties(self._item(library.movies, params['movieid']), params, 'movieid')}
+            if name == 'videolibrary.removeepisode':
+                self._item(library.episodes, params['episodeid'])
+                library.removeEpisode(int(params['episodeid']))
+                return 'OK'
+            if name == 'videolibrary.removemovie':
+                self._item(library.movies, params['movieid'])
+                del library.movies[int(params['movieid'])]
+                return 'OK'
+        if name == 'videolibrary.setepisodedetails':
+            return self._setDetails(library.episodes, 'episodeid', 'episode', params)
+        if name == 'videolibrary.setmoviedetails':
+            return self._setDetails(library.movies, 'movieid', 'movie', params)
+        raise RPCError(-32601, 'Method not found.')
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Kodi host')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9090, help='notification (raw TCP) port')
+    parser.add_argument('--http-port', type=int, help='also answer HTTP JSON-RPC from a generated library on this port')
+    parser.add_argument('--episodes', type=int, default=1000)
+    parser.add_argument('--episodes-per-show', type=int, default=50)
+    parser.add_argument('--movies', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many seconds added at random')
+    parser.add_argument('--scan-latency', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--drop-rate', type=float, default=0)
+    args = parser.parse_args()
+
+    if args.http_port is None:
+        server = FakeNotificationServer(args.host, args.port).start()
+    else:
+        library = FakeLibrary().generate(args.episodes, args.episodes_per_show, args.movies)
+        kodi = FakeKodi(library, args.http_port, args.host, args.port, args.latency, args.jitter, args.scan_latency,
+                        errorRate=args.error_rate, dropRate=args.drop_rate).start()
+        server = kodi.notifications
+        print('Answering JSON-RPC on http://{}:{}/jsonrpc for {} episodes and {} movies'.format(kodi.host, kodi.port, len(library.episodes), len(library.movies)))
+    print('Listening on {}:{}. Enter "<method> [json data]" to send a notification.'.format(server.host, server.port))
+    for line in sys.stdin:
+        method, _, data = line.strip().partition(' ')
+        if method:
+            server.send(method, json.loads(data) if data else None)
+    server.stop()
+
+if __name__ == '__main__':
+    main()
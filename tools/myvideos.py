@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+'''
+Builds a sqlite database with the tables and indexes of Kodi's MyVideos
+schema that the direct database backend reads, for trying the backend
+without a Kodi installation. tools.benchmark --sql fills one from its
+generated library with fromLibrary().
+
+    python3 -m tools.myvideos MyVideos121.db /tv/Show/Season 1/Show - S01E01E02.mkv ...
+'''
+
+import os
+import re
+import sys
+import sqlite3
+
+# the columns SQLBackend reads, everything else of Kodi's schema is left out
+SCHEMA = '''
+CREATE TABLE path (idPath INTEGER PRIMARY KEY, strPath TEXT, strContent TEXT, strScraper TEXT, idParentPath INTEGER);
+CREATE UNIQUE INDEX ix_path ON path (strPath);
+CREATE TABLE files (idFile INTEGER PRIMARY KEY, idPath INTEGER, strFilename TEXT, playCount INTEGER, lastPlayed TEXT, dateAdded TEXT);
+CREATE UNIQUE INDEX ix_files ON files (idPath, strFilename);
+CREATE TABLE tvshow (idShow INTEGER PRIMARY KEY, c00 TEXT, c05 TEXT, c16 TEXT);
+CREATE TABLE tvshowlinkpath (idShow INTEGER, idPath INTEGER);
+CREATE UNIQUE INDEX ix_tvshowlinkpath_1 ON tvshowlinkpath (idShow, idPath);
+CREATE UNIQUE INDEX ix_tvshowlinkpath_2 ON tvshowlinkpath (idPath, idShow);
+CREATE TABLE episode (idEpisode INTEGER PRIMARY KEY, idFile INTEGER, c00 TEXT, c12 VARCHAR(24), c13 VARCHAR(24), c18 TEXT, c19 TEXT, idShow INTEGER, userrating INTEGER, idSeason INTEGER);
+CREATE INDEX ix_episode_file_1 ON episode (idEpisode, idFile);
+CREATE UNIQUE INDEX ix_episode_file_2 ON episode (idFile, idEpisode);
+CREATE INDEX ix_episode_show1 ON episode (idEpisode, idShow);
+CREATE INDEX ix_episode_show2 ON episode (idShow, idEpisode);
+CREATE TABLE movie (idMovie INTEGER PRIMARY KEY, idFile INTEGER, c00 TEXT, c22 TEXT, c23 INTEGER, idSet INTEGER, premiered TEXT);
+CREATE UNIQUE INDEX ix_movie_file_1 ON movie (idFile, idMovie);
+CREATE UNIQUE INDEX ix_movie_file_2 ON movie (idMovie, idFile);
+'''
+
+def createSchema(dbPath):
+    conn = sqlite3.connect(dbPath)
+    conn.executescript(SCHEMA)
+    return conn
+
+def addPath(conn, directory):
+    # returns idPath of directory, created when missing
+    if not directory.endswith('/'):
+        directory += '/'
+    row = conn.execute('SELECT idPath FROM path WHERE strPath = ?', (directory,)).fetchone()
+    if row:
+        return row[0]
+    return conn.execute('INSERT INTO path (strPath) VALUES (?)', (directory,)).lastrowid
+
+def addFile(conn, filePath, playCount=None, lastPlayed=None, dateAdded=None):
+    idPath = addPath(conn, os.path.dirname(filePath))
+    return conn.execute('INSERT INTO files (idPath, strFilename, playCount, lastPlayed, dateAdded) VALUES (?, ?, ?, ?, ?)',
+                        (idPath, os.path.basename(filePath), playCount, lastPlayed, dateAdded)).lastrowid
+
+def addTVShow(conn, title, showDirectory, idShow=None):
+    idShow = conn.execute('INSERT INTO tvshow (idShow, c00) VALUES (?, ?)', (idShow, title)).lastrowid
+    conn.execute('INSERT INTO tvshowlinkpath (idShow, idPath) VALUES (?, ?)', (idShow, addPath(conn, showDirectory)))
+    return idShow
+
+def addEpisode(conn, idShow, filePath, season, episode, title='', playCount=None, lastPlayed=None, idEpisode=None, idFile=None):
+    # episodes of a multi-episode file share its idFile
+    if idFile is None:
+        idFile = addFile(conn, filePath, playCount, lastPlayed)
+    return conn.execute('INSERT INTO episode (idEpisode, idFile, c00, c12, c13, c18, idShow) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (idEpisode, idFile, title, str(season), str(episode), filePath, idShow)).lastrowid
+
+def addMovie(conn, title, filePath, premiered='', playCount=None, lastPlayed=None, idMovie=None):
+    idFile = addFile(conn, filePath, playCount, lastPlayed)
+    return conn.execute('INSERT INTO movie (idMovie, idFile, c00, c22, premiered) VALUES (?, ?, ?, ?, ?)',
+                        (idMovie, idFile, title, filePath, premiered)).lastrowid
+
+def episodeNumbers(filename):
+    # (season, [episodes]) from SxxEyy, SxxEyyEzz or SxxEyy-Ezz in filename, None without one
+    match = re.search(r'S(\d+)((?:-?E\d+)+)', filename, re.IGNORECASE)
+    if not match:
+        return None
+    return int(match.group(1)), [int(number) for number in re.findall(r'\d+', match.group(2))]
+
+def fromLibrary(dbPath, library):
+    # write a tools.fakekodi FakeLibrary to a new database at dbPath keeping its ids
+    conn = createSchema(dbPath)
+    for show in library.shows.values():
+        addTVShow(conn, show['title'], show['file'], show['tvshowid'])
+    files = {}
+    for item in sorted(library.episodes.values(), key=lambda item: item['episodeid']):
+        idFile = files.get(item['file'])
+        if idFile is None:
+            idFile = files[item['file']] = addFile(conn, item['file'], item['playcount'], item['lastplayed'] or None, item['dateadded'])
+        addEpisode(conn, item['tvshowid'], item['file'], item['season'], item['episode'], 'Episode {}'.format(item['episode']),
+                   idEpisode=item['episodeid'], idFile=idFile)
+    for item in library.movies.values():
+        addMovie(conn, item['title'], item['file'], '{}-01-01'.format(item['year']), item['playcount'], item['lastplayed'] or None, item['movieid'])
+    conn.commit()
+    return conn
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    conn = createSchema(sys.argv[1])
+    shows = {}
+    for filePath in sys.argv[2:]:
+        # /tv/<show>/<season folder>/<file>, numbers are taken from SxxEyy in the file name
+        showDirectory = os.path.dirname(os.path.dirname(filePath))
+        if not showDirectory in shows:
+            shows[showDirectory] = addTVShow(conn, os.path.basename(showDirectory), showDirectory)
+        numbers = episodeNumbers(os.path.basename(filePath))
+        if not numbers:
+            print('Skipping {}, no SxxEyy in its name'.format(filePath))
+            continue
+        season, episodes = numbers
+        idFile = addFile(conn, filePath)
+        for episode in episodes:
+            addEpisode(conn, shows[showDirectory], filePath, season, episode, idFile=idFile)
+    conn.commit()
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+'''
+Replays updates recorded with [LOGS] trace_file against the recorded
+JSON-RPC responses instead of Kodi, at recorded speed or faster. Every
+replayed call ends with the per-event summary of where its time went.
+
+    python3 -m tools.replay trace.jsonl --list
+    python3 -m tools.replay trace.jsonl --call 3 --speed 10 --profile
+'''
+
+import os
+import sys
+import time
+import pstats
+import logging
+import argparse
+import cProfile
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_ROOT)
+
+from librarian.trace import TraceReplay # pylint: disable=wrong-import-position
+
+# speed 0 replays without delays, waits between polls still need some time to pass
+NO_DELAY_FACTOR = 1000
+
+def accelerate(kodi, factor):
+    # shrink poll timeouts and intervals alike, a poll still sees the recorded responses in the recorded order
+    for name in dir(kodi):
+        if name.startswith('POLL_'):
+            setattr(kodi, name, tuple(value / factor for value in getattr(kodi, name)))
+    kodi.EVENT_RECHECK = kodi.EVENT_RECHECK / factor
+    kodi.PLAYBACK_RECHECK = kodi.PLAYBACK_RECHECK / factor
+
+def describe(number, call):
+    return '#{} {}({}) on {} with {} requests'.format(number, call['call'], ', '.join(repr(arg) for arg in call['args']), ', '.join(call['hosts']), len(call['rpcs']))
+
+def replayCall(replay, number, speed):
+    from librarian.librarian import Librarian
+    from librarian.libraryindex import LibraryIndex
+    call = replay.select(number)
+    kodi = Librarian(replay.hostList(), index=LibraryIndex(), replay=replay)
+    kodi.index.load(call['index'])
+    if not speed == 1:
+        accelerate(kodi, speed or NO_DELAY_FACTOR)
+
+    start = time.perf_counter()
+    result = getattr(kodi, call['call'])(*call['args'])
+    elapsed = time.perf_counter() - start
+    kodi.endEvent(result)
+    print('{} returned {} after {:.2f}s'.format(describe(number, call), result, elapsed))
+    for transport in replay.transports:
+        print('  {}: {} responses replayed, {} requests not in trace'.format(transport.name, transport.served, transport.unmatched))
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded library updates offline')
+    parser.add_argument('trace', help='JSONL trace written with [LOGS] trace_file')
+    parser.add_argument('--list', action='store_true', help='list the recorded calls and exit')
+    parser.add_argument('--call', type=int, action='append', help='replay only this call (repeatable), see --list')
+    parser.add_argument('--speed', type=float, default=1, help='replay this many times faster, 0 for no delays')
+    parser.add_argument('--profile', action='store_true', help='print the functions the replay spent most time in')
+    parser.add_argument('--quiet', action='store_true', help='hide the librarian log')
+    args = parser.parse_args()
+
+    replay = TraceReplay(args.trace, args.speed)
+    if args.list or not replay.calls:
+        for number, call in enumerate(replay.calls):
+            print(describe(number, call))
+        if not replay.calls:
+            print('No update calls in {}'.format(args.trace))
+        return
+    if args.quiet:
+        logging.disable(logging.WARNING)
+
+    profiler = cProfile.Profile() if args.profile else None
+    for number in args.call or range(len(replay.calls)):
+        if profiler:
+            profiler.enable()
+        replayCall(replay, number, args.speed)
+        if profiler:
+            profiler.disable()
+    if profiler:
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+if __name__ == '__main__':
+    main()
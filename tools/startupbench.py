@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''
+Startup cost of KodiLibrarian, phase by phase. Every phase runs in a fresh
+interpreter after importing what it depends on, so the figure is the
+import or init cost that phase adds on its own. The end to end rows time
+a whole KodiLibrarian.py run for a Sonarr test event.
+
+    python3 -m tools.startupbench --runs 10
+'''
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, setup, measured statement)
+PHASES = [
+    ('utils (config, env, logger, updater)', '', 'import utils'),
+    ('librarian.events', 'import utils', 'import librarian.events'),
+    ('librarian.jobqueue', 'import utils, librarian.events', 'import librarian.jobqueue'),
+    ('librarian.daemon', 'import utils, librarian.jobqueue', 'import librarian.daemon'),
+    ('GitPython (first pull only)', 'import utils', 'import git'),
+    ('Kodi client stack', 'import utils', 'import librarian.librarian'),
+    ('Librarian() without host probes', 'from utils import config\nfrom librarian.librarian import Librarian', 'Librarian(config.hosts)'),
+    ('Librarian().hosts (probes hosts)', 'from utils import config\nfrom librarian.librarian import Librarian\nkodi = Librarian(config.hosts)', 'kodi.hosts'),
+]
+
+MEASURE = '''
+import time
+{setup}
+start = time.perf_counter()
+{measured}
+print(time.perf_counter() - start)
+'''
+
+def runPhase(setup, measured):
+    # seconds spent in measured, None if the phase failed
+    code = MEASURE.format(setup=setup, measured=measured)
+    result = subprocess.run([sys.executable, '-c', code], cwd=APP_ROOT, capture_output=True, text=True)
+    if result.returncode:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+def runScript(args, env):
+    # wall time of a whole interpreter run
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + args, cwd=APP_ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    return elapsed if result.returncode == 0 else None
+
+def summary(samples):
+    samples = sorted(sample for sample in samples if sample is not None)
+    if not samples:
+        return 'failed'
+    return '{:8.1f} ms  (min {:.1f})'.format(samples[len(samples) // 2] * 1000, samples[0] * 1000)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure KodiLibrarian start up cost per phase')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per phase, the median is reported')
+    parser.add_argument('--probe', action='store_true', help='include the phase that pings the configured hosts')
+    args = parser.parse_args()
+
+    testEnv = dict(os.environ, sonarr_eventtype='Test')
+    rows = [('interpreter', [runScript(['-c', 'pass'], os.environ) for _ in range(args.runs)])]
+    for name, setup, measured in PHASES:
+        if measured == 'kodi.hosts' and not args.probe:
+            continue
+        rows.append((name, [runPhase(setup, measured) for _ in range(args.runs)]))
+    rows.append(('end to end: sonarr test event', [runScript(['KodiLibrarian.py'], testEnv) for _ in range(args.runs)]))
+
+    width = max(len(name) for name, _ in rows)
+    for name, samples in rows:
+        print('{}  {}'.format(name.ljust(width), summary(samples)))
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,11 @@ from utils.updater import Updater
 
 CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'settings.ini')
 LOG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'KodiLibrarian.log')
+INDEX_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'library.db')
+QUEUE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'queue.db')
+HEALTH_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'hosts.json')
+WATCHED_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'watched.json')
+WORKER_LOCK_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'worker.lock')
 env = Env()
 config = Config(CONFIG_PATH)
 logger = Logger(LOG_PATH, config.log_level, config.log_to_file)
@@ -44,6 +44,14 @@ class Config(object):
                 return self._raw_config['LOGS'].getboolean('log_to_file', False)
         return False
 
+    @property
+    def trace_file(self):
+        # JSONL file every JSON-RPC request and response is appended to, empty to not record
+        if not self._raw_config is None:
+            if 'LOGS' in self._raw_config.sections():
+                return self._raw_config['LOGS'].get('trace_file', '')
+        return ''
+
     @property
     def clean_after_update(self):
         if not self._raw_config is None:
@@ -51,6 +59,22 @@ class Config(object):
                 return self._raw_config['LIBRARY'].getboolean('clean_after_update', False)
         return False
 
+    @property
+    def clean_deferred(self):
+        # collect cleans after updates and run them together later
+        if not self._raw_config is None:
+            if 'LIBRARY' in self._raw_config.sections():
+                return self._raw_config['LIBRARY'].getboolean('clean_deferred', False)
+        return False
+
+    @property
+    def clean_window(self):
+        # HH:MM-HH:MM deferred cleans are limited to, empty for whenever no host is playing
+        if not self._raw_config is None:
+            if 'LIBRARY' in self._raw_config.sections():
+                return self._raw_config['LIBRARY'].get('clean_window', '')
+        return ''
+
     @property
     def update_while_playing(self):
         if not self._raw_config is None:
@@ -58,6 +82,197 @@ class Config(object):
                 return self._raw_config['LIBRARY'].getboolean('update_while_playing', False)
         return False
 
+    @property
+    def use_notifications(self):
+        if not self._raw_config is None:
+            if 'LIBRARY' in self._raw_config.sections():
+                return self._raw_config['LIBRARY'].getboolean('use_notifications', False)
+        return False
+
+    @property
+    def max_workers(self):
+        if not self._raw_config is None:
+            if 'LIBRARY' in self._raw_config.sections():
+                return self._raw_config['LIBRARY'].getint('max_workers', 4)
+        return 4
+
+    @property
+    def index_ttl(self):
+        if not self._raw_config is None:
+            if 'LIBRARY' in self._raw_config.sections():
+                return self._raw_config['LIBRARY'].getint('index_ttl', 3600)
+        return 3600
+
+    @property
+    def read_cache_ttl(self):
+        if not self._raw_config is None:
+            if 'LIBRARY' in self._raw_config.sections():
+                return self._raw_config['LIBRARY'].getint('read_cache_ttl', 0)
+        return 0
+
+    @property
+    def connect_timeout(self):
+        if not self._raw_config is None:
+            if 'CONNECTION' in self._raw_config.sections():
+                return self._raw_config['CONNECTION'].getfloat('connect_timeout', 3)
+        return 3
+
+    @property
+    def read_timeout(self):
+        if not self._raw_config is None:
+            if 'CONNECTION' in self._raw_config.sections():
+                return self._raw_config['CONNECTION'].getfloat('read_timeout', 30)
+        return 30
+
+    @property
+    def pool_size(self):
+        if not self._raw_config is None:
+            if 'CONNECTION' in self._raw_config.sections():
+                return self._raw_config['CONNECTION'].getint('pool_size', 4)
+        return 4
+
+    @property
+    def health_ttl(self):
+        if not self._raw_config is None:
+            if 'CONNECTION' in self._raw_config.sections():
+                return self._raw_config['CONNECTION'].getint('health_ttl', 60)
+        return 60
+
+    @property
+    def playing_ttl(self):
+        if not self._raw_config is None:
+            if 'CONNECTION' in self._raw_config.sections():
+                return self._raw_config['CONNECTION'].getint('playing_ttl', 10)
+        return 10
+
+    @property
+    def failure_threshold(self):
+        if not self._raw_config is None:
+            if 'CONNECTION' in self._raw_config.sections():
+                return self._raw_config['CONNECTION'].getint('failure_threshold', 3)
+        return 3
+
+    @property
+    def failure_cooldown(self):
+        if not self._raw_config is None:
+            if 'CONNECTION' in self._raw_config.sections():
+                return self._raw_config['CONNECTION'].getint('failure_cooldown', 300)
+        return 300
+
+    @property
+    def probe_timeout(self):
+        if not self._raw_config is None:
+            if 'CONNECTION' in self._raw_config.sections():
+                return self._raw_config['CONNECTION'].getfloat('probe_timeout', 1)
+        return 1
+
+    @property
+    def daemon_listen(self):
+        if not self._raw_config is None:
+            if 'DAEMON' in self._raw_config.sections():
+                return self._raw_config['DAEMON'].get('listen', '127.0.0.1')
+        return '127.0.0.1'
+
+    @property
+    def daemon_port(self):
+        if not self._raw_config is None:
+            if 'DAEMON' in self._raw_config.sections():
+                return self._raw_config['DAEMON'].getint('port', 8765)
+        return 8765
+
+    @property
+    def daemon_forward(self):
+        if not self._raw_config is None:
+            if 'DAEMON' in self._raw_config.sections():
+                return self._raw_config['DAEMON'].getboolean('forward', True)
+        return True
+
+    @property
+    def daemon_coalesce_window(self):
+        if not self._raw_config is None:
+            if 'DAEMON' in self._raw_config.sections():
+                return self._raw_config['DAEMON'].getfloat('coalesce_window', 10)
+        return 10
+
+    @property
+    def daemon_credentials(self):
+        if not self._raw_config is None:
+            if 'DAEMON' in self._raw_config.sections():
+                user = self._raw_config['DAEMON'].get('user', '')
+                if user:
+                    return (user, self._raw_config['DAEMON'].get('pass', ''))
+        return (None, None)
+
+    @property
+    def queue_workers(self):
+        if not self._raw_config is None:
+            if 'QUEUE' in self._raw_config.sections():
+                return self._raw_config['QUEUE'].getint('workers', 2)
+        return 2
+
+    @property
+    def queue_max_attempts(self):
+        if not self._raw_config is None:
+            if 'QUEUE' in self._raw_config.sections():
+                return self._raw_config['QUEUE'].getint('max_attempts', 10)
+        return 10
+
+    @property
+    def queue_retry_delay(self):
+        if not self._raw_config is None:
+            if 'QUEUE' in self._raw_config.sections():
+                return self._raw_config['QUEUE'].getint('retry_delay', 30)
+        return 30
+
+    @property
+    def update_check_interval(self):
+        # seconds between update checks, negative disables automatic updates
+        if not self._raw_config is None:
+            if 'UPDATER' in self._raw_config.sections():
+                return self._raw_config['UPDATER'].getint('check_interval', 86400)
+        return 86400
+
+    @property
+    def update_background(self):
+        if not self._raw_config is None:
+            if 'UPDATER' in self._raw_config.sections():
+                return self._raw_config['UPDATER'].getboolean('background', True)
+        return True
+
+    @property
+    def update_timeout(self):
+        if not self._raw_config is None:
+            if 'UPDATER' in self._raw_config.sections():
+                return self._raw_config['UPDATER'].getint('timeout', 60)
+        return 60
+
+    @property
+    def video_database(self):
+        # direct read-only access to Kodi's video database, None when not configured
+        if not self._raw_config is None:
+            if 'DATABASE' in self._raw_config.sections():
+                section = self._raw_config['DATABASE']
+                kind = section.get('type', '').lower()
+                if kind in ('sqlite', 'mysql'):
+                    return {
+                        'kind': kind,
+                        'path': section.get('path', ''),
+                        'host': section.get('host', ''),
+                        'port': section.getint('port', 3306),
+                        'username': section.get('user', ''),
+                        'password': section.get('pass', ''),
+                        'database': section.get('name', ''),
+                    }
+        return None
+
+    @property
+    def metrics_textfile(self):
+        # Prometheus textfile rewritten after every update, empty to only log per-event summaries
+        if not self._raw_config is None:
+            if 'METRICS' in self._raw_config.sections():
+                return self._raw_config['METRICS'].get('textfile', '')
+        return ''
+
     @property
     def hosts(self):
         hosts = []
@@ -71,6 +286,11 @@ class Config(object):
                     'password': self._raw_config.get(section, 'pass'),
                     'always_on': self._raw_config.getboolean(section, 'alwaysOn'),
                     'show_notifications': self._raw_config.getboolean(section, 'showNotifications'),
+                    'tcp_port': self._raw_config.getint(section, 'tcpPort', fallback=9090),
+                    'transport': self._raw_config.get(section, 'transport', fallback='http').lower(),
+                    'connect_timeout': self.connect_timeout,
+                    'read_timeout': self.read_timeout,
+                    'pool_size': self.pool_size,
                 }
                 hosts.append(host)
         hosts.sort(reverse=True, key=lambda host: host['always_on'])
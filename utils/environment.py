@@ -41,10 +41,16 @@ class Env():
 
     @property
     def episodeNumber(self):
-        episodeNumberKeys = ['sonarr_release_episodenumbers']
-        for k, v in self._vars.items():
-            if k in episodeNumberKeys:
-                return v.split(',')[0]
+        episodeNumbers = self.episodeNumbers
+        return episodeNumbers[0] if episodeNumbers else None
+
+    @property
+    def episodeNumbers(self):
+        # every episode in the imported file, a multi-episode file lists several
+        episodeNumberKeys = ['sonarr_episodefile_episodenumbers', 'sonarr_release_episodenumbers']
+        for key in episodeNumberKeys:
+            if self._vars.get(key):
+                return [number.strip() for number in self._vars[key].split(',') if number.strip()]
         return None
 
     @property
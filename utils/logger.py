@@ -1,6 +1,36 @@
 import logging
 import logging.handlers
 import os
+import threading
+
+class ThreadBuffer(logging.Filter):
+    '''
+    Holds back records emitted by threads that called capture() so they
+    can be replayed later in a deterministic order
+    '''
+    _local = threading.local()
+
+    @classmethod
+    def capture(cls):
+        cls._local.records = []
+
+    @classmethod
+    def release(cls):
+        records = getattr(cls._local, 'records', None)
+        cls._local.records = None
+        return records or []
+
+    @staticmethod
+    def replay(records):
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+
+    def filter(self, record):
+        records = getattr(self._local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
 
 class Logger():
     '''
@@ -15,6 +45,10 @@ class Logger():
     def get_log(self, name):
         log = logging.getLogger(name)
         log.setLevel(self._log_level)
+        if log.handlers:
+            # already configured by an earlier call
+            return log
+        log.addFilter(ThreadBuffer())
         
         sh = logging.StreamHandler()
         sh.setFormatter(self._format)
@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
-import git
 import os
+import sys
+import json
+import glob
+import fcntl
 import inspect
 import time
-import shutil
+import subprocess
+from contextlib import contextmanager
 
-from git.exc import GitCommandError
+# GitPython is slow to import and most runs never pull, it is imported by the methods that need it
 
 APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -24,11 +28,96 @@ class Printer():
         print('{} - INFO - {}'.format(self.__getTime(), msg))
 
 class Updater():
-    def __init__(self, log=None):
+    def __init__(self, log=None, statePath=None, lockPath=None):
         if log:
             self.log = log
         else:
             self.log = Printer()
+        self.statePath = statePath or os.path.join(APP_ROOT, 'update.json')
+        self.lockPath = lockPath or os.path.join(APP_ROOT, 'update.lock')
+
+    def __read_state(self):
+        try:
+            with open(self.statePath, 'r') as stateFile:
+                return json.load(stateFile)
+        except (IOError, ValueError):
+            return {}
+
+    def __write_state(self, state):
+        # write to a temporary file and rename so readers never see a partial file
+        temp = self.statePath + '.tmp'
+        try:
+            with open(temp, 'w') as stateFile:
+                json.dump(state, stateFile)
+            os.replace(temp, self.statePath)
+        except IOError as e:
+            self.log.warning('Could not record update state in "{}" ERROR: {}'.format(self.statePath, e))
+
+    def due(self, interval):
+        '''
+        Returns True when the last recorded check is older than interval
+        seconds. A negative interval disables checks entirely.
+        '''
+        if interval < 0:
+            return False
+        return time.time() - self.__read_state().get('lastCheck', 0) >= interval
+
+    @contextmanager
+    def eventLock(self):
+        '''
+        Held (shared) while an event is processed. Updates take the same
+        lock exclusively so files are never replaced in the middle of an
+        event, and events wait for a running update to finish.
+        '''
+        with open(self.lockPath, 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def check(self, interval=0, timeout=60, wait=False):
+        '''
+        Pull if the last check is older than interval seconds. The check
+        time is recorded before contacting the remote so failing or
+        concurrent callers do not retry on every event. Without wait the
+        check is skipped when an event is being processed. Returns the
+        same tuple as pull().
+        '''
+        with open(self.lockPath, 'a') as lockFile:
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.log.debug('Events are being processed. Postponing update check.')
+                return (False, [])
+            if not self.due(interval):
+                return (False, [])
+            state = self.__read_state()
+            state['lastCheck'] = time.time()
+            self.__write_state(state)
+            from git.exc import GitCommandError
+            try:
+                result = self.pull(timeout=timeout)
+            except GitCommandError as e:
+                self.log.warning('Update check failed. ERROR: {}'.format(e))
+                result = (False, [])
+            if result[0]:
+                state['lastUpdate'] = time.time()
+                self.__write_state(state)
+            return result
+
+    def spawn(self, script):
+        '''
+        Run "script --update --if-due" in a detached process so the caller
+        is not held up by the network.
+        '''
+        try:
+            subprocess.Popen([sys.executable, script, '--update', '--if-due'], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL, start_new_session=True, close_fds=True)
+        except OSError as e:
+            self.log.warning('Failed to start update check. ERROR: {}'.format(e))
+            return False
+        return True
 
     def __get_calling_file(self):
         '''
@@ -57,6 +146,7 @@ class Updater():
         and returns a list of files that contain changes 
         between the remote and local repo.
         '''
+        import git
         assert type(repo) is git.repo.base.Repo, "Passed in repo needs to be of type 'git.repo.base.Repo'"
         diff = str(repo.git.diff("--name-only")).splitlines()
         if len(diff) == 0:
@@ -74,6 +164,7 @@ class Updater():
         If for some reason the function fails to find the current branch
         an IOError is raised to indicate something has gone wrong. 
         '''
+        import git
         assert type(repo) is git.repo.base.Repo, "Passed in repo needs to be of type 'git.repo.base.Repo'"
         branches = str(repo.git.branch()).splitlines()
         for branch in branches:
@@ -148,24 +239,39 @@ class Updater():
         #     except git.InvalidGitRepositoryError:
         #         file_path = os.path.normpath(file_path + "/..")
 
-    def __clean_pycache(self, rootDir):
+    def __clean_pycache(self, rootDir, files):
+        '''
+        This function will remove the cached bytecode of the given python
+        files (relative to rootDir). Unchanged modules keep their cache so
+        the next start does not recompile the whole tree.
+        '''
+        self.log.info('Cleaning cached bytecode of updated modules')
+        for name in files:
+            if not name.endswith('.py'):
+                continue
+            directory, module = os.path.split(os.path.join(os.path.abspath(rootDir), name))
+            for path in glob.glob(os.path.join(directory, '__pycache__', os.path.splitext(module)[0] + '.*.pyc')):
+                self.log.debug('Removing: "{}"'.format(path))
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    self.log.warning('Could not remove "{}" ERROR: {}'.format(path, e))
+
+    def __git_env(self, timeout):
         '''
-        This function will remove all '__pycache__' directories.
-        IOError is raised if unable
+        Environment for network git commands: never prompt for credentials
+        and let git itself abort stalled transfers, as killing git on
+        timeout leaves its transport helper (and our pipes) behind.
         '''
-        self.log.info('Cleaning pycache directories')
-        for root, dirs, _ in os.walk(os.path.abspath(rootDir)):
-            for directory in dirs:
-                if directory == '__pycache__':
-                    path = os.path.join(root, directory)
-                    if os.path.isdir(path):
-                        self.log.debug('Removing: "{}"'.format(path))
-                        try:
-                            shutil.rmtree(path)
-                        except IOError as e:
-                            self.log.warning('Could not remove "{}" ERROR: {}'.format(path, e))
+        env = {'GIT_TERMINAL_PROMPT': '0'}
+        if timeout:
+            env['GIT_HTTP_LOW_SPEED_LIMIT'] = '1'
+            env['GIT_HTTP_LOW_SPEED_TIME'] = str(int(timeout))
+            env['GIT_SSH_COMMAND'] = os.environ.get('GIT_SSH_COMMAND', 'ssh') + ' -o ConnectTimeout={} -o BatchMode=yes'.format(int(timeout))
+        return env
 
     def __get_repo(self):
+        import git
         repo = git.Repo(APP_ROOT)
         try:
             assert not repo.bare
@@ -174,7 +280,7 @@ class Updater():
             return None
         return repo
 
-    def pull(self, force=False, check_dev=True):
+    def pull(self, force=False, check_dev=True, timeout=None):
         '''
         This function will attempt to pull any remote changes down to 
         the repository that the calling script is contained in. If 
@@ -191,26 +297,30 @@ class Updater():
         referenced relative to the base of the repository. This function 
         attempts to capture git errors but it is entirely possible that 
         it does not handle a git error correctly in which case it will be 
-        raised again to be potentially handled higher up. 
+        raised again to be potentially handled higher up. Git commands
+        taking longer than timeout seconds are killed and raise
+        GitCommandError.
         '''
+        from git.exc import GitCommandError
         self.log.info('Checking Git for updates.')
         repo = self.__get_repo()
         if not force:
             try:
-                resp = str(repo.git.pull()).splitlines()
-                if resp[0] == "Already up-to-date.":
+                head = repo.head.commit.hexsha
+                repo.git.pull(kill_after_timeout=timeout, env=self.__git_env(timeout))
+                if repo.head.commit.hexsha == head:
                     self.log.info("Repository is already up to date.")
                     return (False, [])
 
-                files = [a.split("|")[0][1:-1] for a in resp[2:-1]]
-                self.__clean_pycache(APP_ROOT)
+                files = str(repo.git.diff('--name-only', head, 'HEAD')).splitlines()
+                self.__clean_pycache(APP_ROOT, files)
                 self.log.debug("Files updated: " + "\n  ".join(files))
                 return (True, files)
             except GitCommandError as err:
                 err_list = str(err).splitlines()
 
                 # this is a poor and rudimentary way to tell if there was a specific error TODO: fix
-                if err_list[3] == "  stderr: 'error: Your local changes to the following files would be overwritten by merge:":
+                if len(err_list) > 3 and err_list[3] == "  stderr: 'error: Your local changes to the following files would be overwritten by merge:":
                     files = [a[1:] for a in err_list[4:-2]]
                     self.log.warning("Pull failed. Files with conflicts:" + "\n  ".join(files))
                     return (False, files)
@@ -231,7 +341,8 @@ class Updater():
                 return (False, [])
 
             # fetch all
-            fetch_resp = str(repo.git.fetch("--all"))
+            head = repo.head.commit.hexsha
+            fetch_resp = str(repo.git.fetch("--all", kill_after_timeout=timeout, env=self.__git_env(timeout)))
             self.log.debug("Fetched any and all changes with response: {}".format(fetch_resp))
             # reset
             reset_resp = str(repo.git.reset("--hard", "origin/{}".format(branch)))
@@ -239,5 +350,8 @@ class Updater():
             # clean
             clean_resp = str(repo.git.clean("-f"))
             self.log.info("Completed clean with response: {}".format(clean_resp))
-            self.__clean_pycache(APP_ROOT)
-            return (True, diffs)
\ No newline at end of file
+            # bytecode of the pulled files and of the discarded local changes is stale now
+            files = str(repo.git.diff('--name-only', head, 'HEAD')).splitlines()
+            files += [diff for diff in diffs if not diff in files]
+            self.__clean_pycache(APP_ROOT, files)
+            return (True, files)
\ No newline at end of file